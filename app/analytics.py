@@ -0,0 +1,176 @@
+#локальный (без LLM) расчёт периодов продуктивности, восстановления и критических периодов по метрикам на NumPy
+import numpy as np
+
+from .config import settings
+from .utils import MetricRows, MetricsColumns
+
+# средняя индивидуальная частота альфа-ритма у взрослых (Klimesch); отклонение на 2 Гц считаем предельным
+IAF_NORM_HZ = 10.0
+IAF_SPAN_HZ = 2.0
+
+# порог критического периода в стандартных отклонениях от среднего по выгрузке: "средний" и "высокий" уровень
+ALERT_Z = 1.0
+HIGH_ALERT_Z = 2.0
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def iaf_weights(iaf_hz: float | None) -> dict:
+    """
+    Веса метрик с поправкой на IAF: при низкой IAF сильнее учитываем усталость и стресс
+    (утомляемость и реактивность на стресс выше), при высокой — слабее. Без IAF все веса 1.
+    """
+    factor = 0.0
+    if iaf_hz:
+        factor = float(np.clip((iaf_hz - IAF_NORM_HZ) / IAF_SPAN_HZ, -1.0, 1.0))
+    return {
+        "focus": 1.0,
+        "concentration_index": 1.0,
+        "stress": 1.0 - 0.25 * factor,
+        "fatique_score": 1.0 - 0.5 * factor,
+    }
+
+
+def _zscore(values: np.ndarray) -> np.ndarray:
+    """Отклонение от среднего в единицах стандартного отклонения; пустые значения и постоянная колонка — 0."""
+    if np.isnan(values).all():
+        return np.zeros_like(values)
+    std = np.nanstd(values)
+    if not std:
+        return np.zeros_like(values)
+    return np.nan_to_num((values - np.nanmean(values)) / std)
+
+
+def _bin_means(bins: np.ndarray, values: np.ndarray, n_bins: int) -> np.ndarray:
+    """Среднее по корзинам времени суток без учёта NaN; пустая корзина — NaN."""
+    valid = ~np.isnan(values)
+    sums = np.bincount(bins[valid], weights=values[valid], minlength=n_bins)
+    counts = np.bincount(bins[valid], minlength=n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Центрированное скользящее среднее по window корзинам, NaN пропускаются (не растягивается на пустые корзины)."""
+    if window <= 1:
+        return values
+    valid = ~np.isnan(values)
+    kernel = np.ones(window)
+    sums = np.convolve(np.where(valid, values, 0.0), kernel, mode="same")
+    counts = np.convolve(valid.astype(np.float64), kernel, mode="same")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        smooth = sums / counts
+    smooth[~valid] = np.nan
+    return smooth
+
+
+def _runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """Непрерывные участки True: список (первая корзина, последняя корзина + 1)."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
+def _clock(minutes: int) -> str:
+    minutes = min(minutes, MINUTES_PER_DAY - 1)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _top_runs(mask: np.ndarray, score: np.ndarray, limit: int) -> list[tuple[int, int]]:
+    """limit участков с наибольшим средним score, по времени суток."""
+    runs = _runs(mask)
+    runs.sort(key=lambda r: float(np.nanmean(score[r[0]:r[1]])), reverse=True)
+    return sorted(runs[:limit])
+
+
+def _mean(values: np.ndarray, start: int, stop: int) -> float | None:
+    chunk = values[start:stop]
+    return None if np.isnan(chunk).all() else float(np.nanmean(chunk))
+
+
+def _describe(label: str, value: float | None) -> str:
+    return "" if value is None else f"{label} {value:.0f}"
+
+
+def analyze_periods(metrics_rows, iaf_hz: float | None = None, bin_minutes: int | None = None,
+                    window_bins: int | None = None, max_periods: int | None = None) -> dict:
+    """
+    Периоды по профилю метрик за сутки: строки (или MetricsColumns) раскладываются по корзинам
+    времени суток по bin_minutes минут (даты не важны — несколько дней усредняются), сглаживаются
+    скользящим окном из window_bins корзин, и по z-оценкам focus, concentration_index, stress и fatique_score
+    с весами iaf_weights() считаются:
+    - productivity_periods — верхняя четверть "фокус + концентрация − стресс − усталость";
+    - recovery_periods — верхняя четверть "усталость + стресс − фокус" (вне периодов продуктивности);
+    - critical_alert_periods — стресс или усталость выше ALERT_Z стандартных отклонений.
+    Результат — dict в формате ответа LLM (см. format_full_report_json); пустые списки, если данных мало.
+    """
+    bin_minutes = bin_minutes or settings.ANALYTICS_BIN_MINUTES
+    window_bins = window_bins or settings.ANALYTICS_WINDOW_BINS
+    max_periods = max_periods or settings.ANALYTICS_MAX_PERIODS
+    result = {"productivity_periods": [], "recovery_periods": [], "critical_alert_periods": []}
+
+    if isinstance(metrics_rows, MetricRows):
+        columns = metrics_rows.columns
+    elif isinstance(metrics_rows, MetricsColumns):
+        columns = metrics_rows
+    else:
+        columns = MetricsColumns.from_rows(list(metrics_rows))
+    columns = columns.take(~np.isnat(columns.timestamps))
+    if not len(columns):
+        return result
+
+    ts = columns.timestamps.astype("datetime64[m]")
+    minute_of_day = (ts - ts.astype("datetime64[D]")).astype(np.int64)
+    n_bins = -(-MINUTES_PER_DAY // bin_minutes)
+    bins = minute_of_day // bin_minutes
+
+    weights = iaf_weights(iaf_hz)
+    profile = {key: _rolling_mean(_bin_means(bins, columns.column(key), n_bins), window_bins) for key in weights}
+    covered = ~np.all([np.isnan(v) for v in profile.values()], axis=0)
+    if not covered.any():
+        return result
+    z = {key: np.where(covered, _zscore(values), np.nan) for key, values in profile.items()}
+
+    productivity = (weights["focus"] * z["focus"] + weights["concentration_index"] * z["concentration_index"]
+                    - weights["stress"] * z["stress"] - weights["fatique_score"] * z["fatique_score"])
+    recovery = weights["fatique_score"] * z["fatique_score"] + weights["stress"] * z["stress"] - weights["focus"] * z["focus"]
+
+    def top_quarter(score: np.ndarray) -> np.ndarray:
+        threshold = np.nanpercentile(score[covered], 75)
+        return covered & (np.nan_to_num(score, nan=-np.inf) >= threshold) & (np.nan_to_num(score) > 0)
+
+    productive = top_quarter(productivity)
+    for start, stop in _top_runs(productive, productivity, max_periods):
+        details = ", ".join(filter(None, [
+            _describe("фокус", _mean(profile["focus"], start, stop)),
+            _describe("стресс", _mean(profile["stress"], start, stop)),
+        ]))
+        result["productivity_periods"].append({
+            "start_time": _clock(start * bin_minutes),
+            "end_time": _clock(stop * bin_minutes),
+            "recommended_activity": "Сложные задачи, требующие концентрации" + (f" ({details})" if details else ""),
+        })
+
+    resting = top_quarter(recovery) & ~productive
+    for start, stop in _top_runs(resting, recovery, max_periods):
+        fatigue = _mean(profile["fatique_score"], start, stop)
+        result["recovery_periods"].append({
+            "start_time": _clock(start * bin_minutes),
+            "end_time": _clock(stop * bin_minutes),
+            "recommended_activity": "Перерыв: прогулка, дыхательные упражнения или тренировка альфа-ритма"
+                                    + (f" (усталость {fatigue:.1f})" if fatigue is not None else ""),
+        })
+
+    alerts = []
+    for key, issue in (("stress", "Высокий стресс"), ("fatique_score", "Высокая усталость")):
+        level = weights[key] * z[key]
+        for start, stop in _runs(covered & (np.nan_to_num(level) >= ALERT_Z)):
+            peak = float(np.nanmax(level[start:stop]))
+            value = _mean(profile[key], start, stop)
+            alerts.append({
+                "start_time": _clock(start * bin_minutes),
+                "end_time": _clock(stop * bin_minutes),
+                "issue": issue + (f" (в среднем {value:.1f})" if value is not None else ""),
+                "alert_level": "высокий" if peak >= HIGH_ALERT_Z else "средний",
+            })
+    result["critical_alert_periods"] = sorted(alerts, key=lambda a: a["start_time"])
+    return result
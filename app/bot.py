@@ -1,9 +1,11 @@
 #это основной код бота. Он принимает файл, парсит, сохраняет в БД, вызывает LLM (или мок) и отдаёт пользователю результаты с кнопками
+import asyncio
+import functools
 import json
 from pathlib import Path
 from datetime import datetime
 import aiohttp # Добавляем импорт aiohttp
-import re # Добавляем импорт re для safe_json_loads
+import re
 import pytz
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -68,56 +70,6 @@ def _augment_prompt_with_period(base_text: str, period) -> str:
 
 
 
-def safe_json_loads(raw: str):
-    """
-    Попытка безопасно распарсить JSON из ответа модели.
-    Возвращает dict или выбрасывает json.JSONDecodeError.
-    """
-    cleaned = raw.strip()
-
-    # убираем markdown-блоки ```json ... ```
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[7:]
-    if cleaned.startswith("```"):
-        cleaned = cleaned[3:]
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3]
-
-    cleaned = cleaned.strip()
-
-    # вырезаем от первой { до последней }
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
-    if start != -1 and end != -1:
-        cleaned = cleaned[start:end+1]
-    else:
-        # Если не найдено начало/конец JSON, возвращаем исходную строку
-        # или выбрасываем ошибку, в зависимости от желаемого поведения
-        raise json.JSONDecodeError("JSON object not found", raw, 0)
-
-    # Удаляем троеточия '...' которые часто вставляются LLM при обрезке ответа
-    cleaned = re.sub(r"\.{2,5}", "", cleaned) # Удаляем от 2 до 5 точек, чтобы захватить '...', '....', '.....'
-
-    # пробуем распарсить как есть
-    try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        pass
-
-    # фиксируем частые ошибки: висящие кавычки, лишние запятые
-    fixed = re.sub(r",\s*([}\]])", r"\1", cleaned)  # убираем запятую перед } или ]
-    fixed = fixed.replace('\\"', '"')  # убираем лишние escape
-    # умные кавычки → обычные
-    fixed = fixed.replace('"', '"').replace('"', '"').replace('"', '"').replace('"', '"')
-    fixed = fixed.replace("'", '"')  # одинарные кавычки → двойные
-
-    # Удаляем попытку закрыть незавершенные строковые значения и балансировать скобки
-
-    # пробуем снова
-    return json.loads(fixed)
-
-
-
 def format_full_report_json(json_text):
     """
     Преобразует JSON-ответ от LLM в красивый текстовый отчет.
@@ -169,14 +121,26 @@ def format_full_report_json(json_text):
 
 
 from .config import settings
-from .database import AsyncSessionLocal
+from .database import AsyncSessionLocal, db_pool_stats, warm_db_pool, close_db_pool
+from .stats import STATS_MODES, collect_stats
 from .crud import (
-    get_or_create_user, save_metrics_bulk, save_productivity_periods,
-    get_productivity_periods, get_user_metrics, save_day_plan, save_improvement_suggestions,
-    update_user_iaf, get_all_users
+    get_or_create_user, save_productivity_periods,
+    get_productivity_periods, get_recent_metrics, get_metric_rows, get_rollup_history, save_day_plan, save_improvement_suggestions,
+    update_user_iaf, get_all_users, user_cache_stats,
+    find_metric_upload, get_upload_analysis, get_upload_hashes, save_metric_upload, save_upload_report
+)
+from .utils import build_prompt_for_llm
+from .llm_client import (
+    analyze_metrics, stream_chat_with_llm, summarize_dialog,
+    get_llm_client, warm_llm_client, close_llm_client, llm_cache_stats, llm_scheduler_stats,
+    llm_backend_stats
 )
-from .utils import parse_metrics_file, build_prompt_for_llm
-from .llm_client import analyze_metrics, chat_with_llm
+from .streaming import MESSAGE_LIMIT, split_message, stream_to_message
+from .chat_history import ChatHistory
+from .analytics import analyze_periods
+from .schemas import UploadAnalysis, DayPlanResponse, ImprovementSuggestionsResponse, parse_llm_json, llm_json_stats
+from .ingest import ingest_upload, get_http_session, close_http_session
+from .executors import run_light, warm_pools, shutdown_pools
 
 DOWNLOAD_DIR = Path(settings.DOWNLOADS_DIR)
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -215,25 +179,62 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def cmd_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда для проверки состояния БД"""
+    """Команда для проверки состояния БД: /db_stats [exact|estimate|counters] (по умолчанию DB_STATS_MODE)"""
     try:
-        from .models import User, Metric, ProductivityPeriod, DailyRecommendation, ImprovementSuggestion
-        from sqlalchemy import func
-        
+        mode = context.args[0].lower() if context.args else None
+        if mode is not None and mode not in STATS_MODES:
+            await update.message.reply_text(f"Режим статистики: {', '.join(STATS_MODES)}")
+            return
+
         async with AsyncSessionLocal() as session:
-            u = (await session.execute(func.count(User.user_id))).scalar() or 0
-            m = (await session.execute(func.count(Metric.id))).scalar() or 0
-            p = (await session.execute(func.count(ProductivityPeriod.id))).scalar() or 0
-            d = (await session.execute(func.count(DailyRecommendation.id))).scalar() or 0
-            i = (await session.execute(func.count(ImprovementSuggestion.id))).scalar() or 0
+            db = await collect_stats(session, mode)
+        counts = db["counts"]
+        approx = "≈" if db["mode"] == "estimate" else ""
+        mode_title = {"exact": "точно", "estimate": "оценка pg_class", "counters": "счётчики"}[db["mode"]]
+        top_users = "".join(
+            f"\n  • {row['name'] or row['telegram_id']}: {row['rows']}"
+            + (f" ({row['first']:%d.%m.%Y} – {row['last']:%d.%m.%Y})" if row["first"] and row["last"] else "")
+            for row in db["users"]
+        )
+        users_title = "строк метрик" if db["users_source"] == "counters" else "строк в загрузках"
+        ingest = ", ".join(
+            f"за {hours} ч: {rate['uploads']} файлов, {rate['rows']} строк ({rate['rows_per_hour']:.0f}/ч)"
+            for hours, rate in db["ingest"].items()
+        )
+        cache = llm_cache_stats()
+        queue = llm_scheduler_stats()
+        parsing = llm_json_stats()
+        users = user_cache_stats()
+        pool = db_pool_stats()
+        backends = "".join(
+            f"\n  • {b['name']}: {'✅' if b['available'] else '⛔'}"
+            + (f" p50 {b['p50']:.1f} с, p95 {b['p95']:.1f} с" if b["p50"] is not None else "")
+            + f", ошибок {b['error_rate']:.0%}"
+            for b in llm_backend_stats()
+        )
         
         await update.message.reply_text(
-            f"📊 Статистика БД:\n\n"
-            f"👥 Пользователи: {u}\n"
-            f"📈 Метрики: {m}\n"
-            f"⏰ Периоды продуктивности: {p}\n"
-            f"📅 Рекомендации: {d}\n"
-            f"💡 Советы по улучшению: {i}"
+            f"📊 Статистика БД ({mode_title}):\n\n"
+            f"👥 Пользователи: {approx}{counts['users']}\n"
+            f"📈 Метрики: {approx}{counts['metrics']}\n"
+            f"⏰ Периоды продуктивности: {approx}{counts['productivity_periods']}\n"
+            f"📅 Рекомендации: {approx}{counts['daily_recommendations']}\n"
+            f"💡 Советы по улучшению: {approx}{counts['improvement_suggestions']}\n"
+            f"📥 Загрузки {ingest}\n"
+            + (f"🏆 Больше всего {users_title}:{top_users}\n" if top_users else "")
+            + "\n"
+            f"🗄 Пул БД: занято {pool.get('active', 0)}, свободно {pool.get('idle', 0)}, "
+            f"сверх пула {pool.get('overflow', 0)}, выдача p95 {pool['checkout_p95'] * 1000:.0f} мс, "
+            f"таймаутов {pool['timeouts']}; запросов {pool['queries']}, p95 {pool['query_p95'] * 1000:.0f} мс\n"
+            f"👤 Кэш пользователей: {users['size']}/{users['maxsize']}, попаданий {users['hit_rate']:.0%}\n"
+            f"🧠 Кэш LLM: {cache['size']}/{cache['maxsize']} записей, "
+            f"попаданий {cache['hits']} (+{cache['disk_hits']} с диска), промахов {cache['misses']}, "
+            f"не закэшировано (ответ не разобрался) {cache['rejected']}\n"
+            f"🚦 Запросы к LLM: в работе {queue['active']}, в очереди {queue['queued']}, "
+            f"отклонено {queue['rejected']}, ожидание p95 {queue['wait_p95']:.1f} с\n"
+            f"🧩 JSON от LLM: с первого раза {parsing['parsed']}, после починки {parsing['repaired']} "
+            f"({parsing['repair_seconds'] * 1000:.0f} мс), не разобрано {parsing['failed']}"
+            + (f"\n🌐 Бэкенды LLM:{backends}" if backends else "")
         )
     except Exception as e:
         await update.message.reply_text(
@@ -311,19 +312,23 @@ async def handle_question_input(update: Update, context: ContextTypes.DEFAULT_TY
     question = update.message.text
     name = update.effective_user.full_name
     
-    await update.message.reply_text("🤔 Обрабатываю ваш вопрос...")
+    placeholder = await update.message.reply_text("🤔 Обрабатываю ваш вопрос...")
     
     # Формируем промпт для Deepseek с учетом режима дня
-    # История переписки для пользователя
-    history = context.chat_data.get("history", [])
-    if not history:
-        history = [
-            {"role": "system", "content": (
+    # История переписки для пользователя: укладывается в CHAT_HISTORY_TOKENS, старое сворачивается в краткое содержание
+    history = context.chat_data.get("history")
+    if not isinstance(history, ChatHistory):
+        history = ChatHistory(
+            system_prompt=(
                 "Ты — эксперт по нейрофизиологии и нейропсихофизиологии. Отвечай на русском, кратко и по делу. "
                 "Не используй JSON/фигурные скобки/блоки кода, только обычный текст. "
                 "Если вопрос не относится к нейрофизиологии, ЭЭГ/BCI, альфа-ритмам, когнитивным функциям, стрессу, "
-                "концентрации или восстановлению – вежливо откажись отвечать и предложи перейти к анализу метрик, либо пусть задаст вопрос в рамках темы." )}
-        ]
+                "концентрации или восстановлению – вежливо откажись отвечать и предложи перейти к анализу метрик, либо пусть задаст вопрос в рамках темы."
+            ),
+            budget=settings.CHAT_HISTORY_TOKENS,
+            summarize=functools.partial(summarize_dialog, user_key=tg_id),
+        )
+        context.chat_data["history"] = history
     # Добавляем новое сообщение пользователя (с доп. контекстом периода)
     period_time = _extract_time_from_question(question) or get_moscow_time().time()
     augmented_question = question
@@ -336,23 +341,24 @@ async def handle_question_input(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception:
         pass
 
-    history.append({"role": "user", "content": augmented_question})
+    # Контекст периода нужен только в текущем вопросе — в историю уходит сам вопрос
+    messages = history.messages() + [{"role": "user", "content": augmented_question}]
     
     try:
-        answer = await chat_with_llm(history, max_tokens=800, temperature=0.2)
-        # Обновляем историю: добавляем ответ ассистента и сохраняем
-        history.append({"role": "assistant", "content": answer})
-        context.chat_data["history"] = history[-20:]
-        
-        # Получаем актуальное состояние напоминаний
-        async with AsyncSessionLocal() as session:
-            user = await get_or_create_user(session, telegram_id=tg_id, name=name)
         # После ответа ai-neiry показываем минимальное меню
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("Начать анализ", callback_data="input_iaf")],
             [InlineKeyboardButton("Задать ещё вопрос", callback_data="ask_question")]
         ])
-        await update.message.reply_text(f"Ответ ai-neiry:\n\n{answer}", reply_markup=keyboard)
+        # Ответ дописывается в «Обрабатываю...» по мере генерации
+        answer = await stream_to_message(
+            placeholder,
+            stream_chat_with_llm(messages, max_tokens=800, temperature=0.2, user_key=tg_id),
+            prefix="Ответ ai-neiry:\n\n",
+            reply_markup=keyboard,
+        )
+        # Обновляем историю: вопрос и ответ ассистента
+        history.add_turn(question, answer)
         user_states[tg_id] = "welcome"
     except Exception as e:
         await update.message.reply_text(
@@ -454,41 +460,32 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Сохраняем файл с обработкой таймаута
-    saved_path = DOWNLOAD_DIR / f"{tg_id}_{doc.file_name}"
-    
     # Отладочная информация
     print(f"DEBUG: Загружаем файл {doc.file_name}")
     print(f"DEBUG: Размер файла: {doc.file_size}")
-    print(f"DEBUG: Путь сохранения: {saved_path}")
+
+    # Повторная отправка того же файла: отдаём сохранённый отчёт без скачивания, разбора и LLM
+    async with AsyncSessionLocal() as session:
+        user = await get_or_create_user(session, telegram_id=tg_id, name=name)
+        known = await find_metric_upload(session, user.user_id, file_unique_id=doc.file_unique_id)
+        known_hashes = await get_upload_hashes(session, user.user_id)
+    if known is not None and known.report_text:
+        print(f"DEBUG: Файл уже загружался (upload_id={known.id}), отдаём сохранённый отчёт")
+        await send_analysis_report(update.message, tg_id, known.report_text, upload_id=known.id)
+        return
     
     try:
-        await update.message.reply_text("📥 Скачиваю файл...")
+        await update.message.reply_text("📥 Скачиваю и разбираю файл...")
         file = await doc.get_file()
         file_url = file.file_path # Получаем URL файла
         
-        print(f"DEBUG: Получен объект файла: {file}")
-        print(f"DEBUG: file_size от doc: {doc.file_size}")
         print(f"DEBUG: URL файла: {file_url}")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url, timeout=300) as response: # Устанавливаем таймаут для aiohttp
-                response.raise_for_status() # Проверяем на ошибки HTTP
-                with open(saved_path, "wb") as f:
-                    while True:
-                        chunk = await response.content.read(1024)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-        
-        print(f"DEBUG: Файл скачан с помощью aiohttp, проверяем существование...")
+        # Скачивание, разбор CSV и запись в БД идут одновременно, на диск файл не пишется
+        async with AsyncSessionLocal() as session:
+            n_new, n_known, parsed = await ingest_upload(session, user.user_id, file_url, doc.file_name, known_hashes=known_hashes)
         
-        # Проверяем, что файл действительно скачался
-        if not saved_path.exists():
-            raise Exception("Файл не был сохранен на диск")
-            
-        file_size = saved_path.stat().st_size
-        print(f"DEBUG: Файл сохранен, размер: {file_size} байт")
+        print(f"DEBUG: Файл обработан, корректных строк: {parsed.rows_total}, статус: {parsed.status}")
         await update.message.reply_text("✅ Файл скачан успешно")
             
     except aiohttp.ClientError as e:
@@ -516,7 +513,7 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             file_size_info = "Размер файла: неизвестен"
             
-        if "Timed out" in error_msg or "timeout" in error_msg.lower():
+        if isinstance(e, asyncio.TimeoutError) or "Timed out" in error_msg or "timeout" in error_msg.lower():
             await update.message.reply_text(
                 f"⏰ Таймаут загрузки файла\n\n"
                 f"Файл слишком большой или медленное соединение.\n"
@@ -540,64 +537,109 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         return
     
-    await update.message.reply_text("Файл получен. Парсю...")
-
-    try:
-        rows, status = parse_metrics_file(str(saved_path))
-        
-        # Обрабатываем ошибки
-        if status.startswith("file_error"):
-            error_msg = status.split(": ", 1)[1] if ": " in status else "Неизвестная ошибка"
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
-            ])
-            await update.message.reply_text(
-                f"❌ Ошибка загрузки файла\n\n"
-                f"Причина: {error_msg}\n\n"
-                f"Таблица продуктивных часов не может быть сформирована",
-                reply_markup=keyboard
-            )
-            return
-            
-        elif status.startswith("incomplete_data"):
-            error_msg = status.split(": ", 1)[1] if ": " in status else "Неполные данные"
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📎 Прикрепить файл", callback_data="upload_file")]
-            ])
-            await update.message.reply_text(
-                f"⚠️ Неполные данные\n\n"
-                f"Проверьте файл:\n"
-                f"• временные интервалы\n"
-                f"• обязательные метрики\n\n"
-                f"Исправьте и попробуйте еще раз",
-                reply_markup=keyboard
-            )
-            return
-            
-        elif status != "success":
-            await update.message.reply_text(f"Неизвестная ошибка: {status}")
+    status = parsed.status or "file_error: Файл пустой"
+    duplicate = None
+    
+    # Обрабатываем ошибки разбора
+    if status.startswith("duplicate"):
+        # содержимое совпало с уже загруженным файлом — строки не сохранялись повторно
+        async with AsyncSessionLocal() as session:
+            duplicate = await find_metric_upload(session, user.user_id, content_hash=parsed.content_hash)
+        if duplicate is not None and duplicate.report_text:
+            await send_analysis_report(update.message, tg_id, duplicate.report_text, upload_id=duplicate.id)
             return
-            
-    except Exception as e:
+
+    elif status.startswith("file_error"):
+        error_msg = status.split(": ", 1)[1] if ": " in status else "Неизвестная ошибка"
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
         ])
         await update.message.reply_text(
             f"❌ Ошибка загрузки файла\n\n"
-            f"Причина: {str(e)}\n\n"
+            f"Причина: {error_msg}\n\n"
             f"Таблица продуктивных часов не может быть сформирована",
             reply_markup=keyboard
         )
         return
+        
+    elif status.startswith("incomplete_data"):
+        error_msg = status.split(": ", 1)[1] if ": " in status else "Неполные данные"
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📎 Прикрепить файл", callback_data="upload_file")]
+        ])
+        await update.message.reply_text(
+            f"⚠️ Неполные данные\n\n"
+            f"Проверьте файл:\n"
+            f"• временные интервалы\n"
+            f"• обязательные метрики\n\n"
+            f"Исправьте и попробуйте еще раз",
+            reply_markup=keyboard
+        )
+        return
+        
+    elif status != "success":
+        await update.message.reply_text(f"Неизвестная ошибка: {status}")
+        return
 
-    # Сохраняем метрики в БД
+    if duplicate is not None:
+        # прошлый анализ этого файла не сохранился — анализируем уже записанные строки
+        upload_id = duplicate.id
+        async with AsyncSessionLocal() as session:
+            rows = await get_metric_rows(
+                session, user.user_id,
+                start=duplicate.first_timestamp,
+                end=duplicate.last_timestamp,
+                limit=settings.METRICS_TAIL_ROWS,
+                newest=True,
+            )
+        await update.message.reply_text(
+            f"Этот файл уже загружен ранее ({duplicate.rows_count} строк), повторно не сохраняю. Запускаю анализ..."
+        )
+    else:
+        rows = parsed.tail
+        async with AsyncSessionLocal() as session:
+            upload = await save_metric_upload(
+                session, user.user_id, parsed.content_hash,
+                file_unique_id=doc.file_unique_id,
+                file_name=doc.file_name,
+                rows_count=parsed.rows_total,
+                first_timestamp=parsed.first_timestamp,
+                last_timestamp=parsed.last_timestamp,
+            )
+        upload_id = upload.id
+        if n_known:
+            await update.message.reply_text(
+                f"Сохранено новых строк метрик: {n_new}, уже были загружены ранее: {n_known}. Запускаю анализ..."
+            )
+        else:
+            await update.message.reply_text(f"Сохранено {n_new} строк метрик. Запускаю анализ...")
+
+    # Передаём IAF пользователем в промпт и в расчёт периодов, если он есть
+    iaf_value = None
+    try:
+        iaf_value = float(user.iaf) if getattr(user, "iaf", None) is not None else None
+    except Exception:
+        iaf_value = None
+
+    # В промпт — только последние ANALYSIS_MAX_ROWS строк файла, остальное (и прошлые загрузки) —
+    # часовыми и дневными агрегатами до конца файла, как в обработчиках кнопок
+    prompt_rows = rows[-settings.ANALYSIS_MAX_ROWS:] if settings.ANALYSIS_MAX_ROWS else rows
     async with AsyncSessionLocal() as session:
-        user = await get_or_create_user(session, telegram_id=tg_id, name=name)
-        n = await save_metrics_bulk(session, user.user_id, rows)
+        history = await _metric_history(
+            session, user.user_id,
+            until=duplicate.last_timestamp if duplicate is not None else parsed.last_timestamp,
+        )
 
-    await update.message.reply_text(f"Сохранено {n} строк метрик. Запускаю анализ...")
+    # Периоды считаем локально по метрикам — сразу показываем их, пока LLM пишет подробный разбор
+    local = await run_light(analyze_periods, rows, iaf_hz=iaf_value)
+    has_local = any(local.values())
+    if has_local:
+        await update.message.reply_text(
+            "📊 Расчёт по метрикам (подробный разбор готовится):\n\n" + format_full_report_json(json.dumps(local))
+        )
 
-    # Анализируем метрики через LLM (DeepSeek)
+    # Разбор через LLM (DeepSeek) одним запросом: полный отчёт, план дня и советы
+    # сохраняются за загрузкой, и кнопки ниже берут их из БД без повторных запросов к модели
     instruction = """
 Ты — эксперт в области нейрофизиологии и нейропсихофизиологии, специализирующийся на анализе BCI/ЭЭГ данных. 
 Используй подходы доказательной медицины и результаты исследований (Базановой Ольги Михайловны, Pfurtscheller, Klimesch и др.) 
@@ -607,66 +649,36 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 индекс релаксации, индекс концентрации, усталость, обратная усталость, альфа-гравитация, ЧСС) 
 с учётом временной структуры и активности (рабочие задачи, тренировки альфа-ритма(если они есть)).
 
-⚠️ Требования к результату:
-1. Ответ должен быть строго на русском языке.
-2. Верни полный текстовый отчет, структурированный по разделам, с абзацами и списками, без использования формата JSON.
-3. Каждый раздел должен быть озаглавлен, внутри разделов используй абзацы и, если нужно, маркированные или нумерованные списки.
-4. Не используй форматирование кода, не заключай ответ в кавычки или блоки.
-5. Используй реальные значения из данных (приводи только время и показатели, не указывай даты).
-6. Отчет должен быть подробным, с пояснениями и ссылками на научные эффекты (например, влияние альфа-ритма на внимание).
-7. Избегай общих фраз, используй конкретику из данных.
-8. Структурируй отчет как: "Периоды максимальной продуктивности:", "План дня:", "Рекомендации и советы:" - аналогично короткому отчету, но с подробными объяснениями.
-"""
+Периоды продуктивности, восстановления и критические периоды уже рассчитаны по метрикам (см. ниже) —
+опирайся на них и не пересчитывай.
 
+Верни СТРОГО один JSON-объект со всеми ключами:
+- "full_report": подробный отчёт обычным текстом (без JSON и блоков кода) с разделами "Периоды максимальной продуктивности:", "План дня:", "Рекомендации и советы:", с абзацами, списками и пояснениями научных эффектов (например, влияние альфа-ритма на внимание);
+- "day_plan": персональное расписание дня одной строкой: часы максимальной продуктивности для сложных задач, время отдыха/релаксации, оптимальное время сна;
+- "improvement_suggestions": список строк — конкретные шаги по улучшению режима дня (повышение продуктивности, снижение утомляемости, восстановление ресурсов).
 
+⚠️ Требования к результату:
+1. Все тексты строго на русском языке.
+2. Используй реальные значения из данных (приводи только время и показатели, не указывай даты).
+3. Избегай общих фраз, используй конкретику из данных.
+4. JSON должен быть полным и валидным.
 
-    # Передаём IAF пользователем в промпт, если он есть
-    iaf_value = None
-    try:
-        iaf_value = float(user.iaf) if getattr(user, "iaf", None) is not None else None
-    except Exception:
-        iaf_value = None
+Рассчитанные периоды:
+""" + json.dumps(local, ensure_ascii=False)
 
-    prompt = build_prompt_for_llm(
+    prompt = await run_light(
+        build_prompt_for_llm,
         user_name=name,
-        metrics_rows=rows,
+        metrics_rows=prompt_rows,
         instruction=instruction,
-        iaf_hz=iaf_value
+        iaf_hz=iaf_value,
+        encoding=settings.PROMPT_ENCODING,
+        history=history,
     )
 
     try:
-        raw = await analyze_metrics(prompt)
-        
-        
-        
-        # Очищаем ответ от лишних символов и форматирования
-        cleaned_raw = raw.strip()
-        
-        # Убираем markdown блоки ```json и ```
-        if cleaned_raw.startswith("```json"):
-            cleaned_raw = cleaned_raw[7:]  # убираем ```json
-        if cleaned_raw.startswith("```"):
-            cleaned_raw = cleaned_raw[3:]   # убираем ```
-        if cleaned_raw.endswith("```"):
-            cleaned_raw = cleaned_raw[:-3]  # убираем ```
-        
-        cleaned_raw = cleaned_raw.strip()
-        
-        # Дополнительная очистка - убираем возможные лишние символы в начале
-        if not cleaned_raw.startswith("{"):
-            # Ищем первую открывающую скобку
-            start_idx = cleaned_raw.find("{")
-            if start_idx != -1:
-                cleaned_raw = cleaned_raw[start_idx:]
-        
-        # Убираем возможные лишние символы в конце
-        if not cleaned_raw.endswith("}"):
-            # Ищем последнюю закрывающую скобку
-            end_idx = cleaned_raw.rfind("}")
-            if end_idx != -1:
-                cleaned_raw = cleaned_raw[:end_idx + 1]
-        
-        data = safe_json_loads(raw) # Используем safe_json_loads
+        raw = await analyze_metrics(prompt, user_key=tg_id, max_tokens=settings.ANALYSIS_MAX_TOKENS, schema=UploadAnalysis)
+        data = parse_llm_json(raw, UploadAnalysis)
     except json.JSONDecodeError as e:
         await update.message.reply_text(
             f"❌ Ошибка парсинга JSON от модели\n\n"
@@ -675,7 +687,10 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Ответ модели:\n{raw[:500]}...\n\n"
             f"Ошибка: {str(e)}"
         )
-        return
+        # без разбора LLM отчёт всё равно строим по рассчитанным периодам
+        if not has_local:
+            return
+        data = {}
     except Exception as e:
         # Если произошла ошибка до определения raw, показываем текст ошибки
         err_text = str(e)
@@ -688,11 +703,13 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             + ("\nОтвет модели:\n" + str(fallback) if fallback else "")
             + ("\nТехническая ошибка: " + err_text if err_text else "")
         )
-        return
+        if not has_local:
+            return
+        data = {}
 
+    # Периоды — из локального расчёта, от LLM — только текст
+    data = {**(data if isinstance(data, dict) else {}), **local}
     periods = data.get("productivity_periods", []) or []
-    day_plan = data.get("day_plan", "") or ""
-    suggestions = data.get("improvement_suggestions", []) or []
 
     # Сохраняем периоды продуктивности в БД
     async with AsyncSessionLocal() as session:
@@ -700,16 +717,6 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Удалено: пересоздание уведомлений по периодам
 
-    # Меняем состояние
-    user_states[tg_id] = "analysis_complete"
-    
-    # Показываем результаты и кнопки: сразу полный отчёт, без превью
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📥 Скачать отчёт (CSV)", callback_data="download_csv")],
-        [InlineKeyboardButton("Получить рекомендации по режиму дня", callback_data="get_recommendations")],
-        [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
-    ])
-    
     # Формируем полный текст отчёта из JSON-ответа
     full_report_text = format_full_report_json(json.dumps(data)) if isinstance(data, dict) else str(data)
     if not full_report_text or not full_report_text.strip():
@@ -718,13 +725,78 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             full_report_text = raw.strip()
         except Exception:
             full_report_text = "(Пустой отчёт)"
+
+    # Запоминаем отчёт за файлом: повторная отправка того же файла получит его сразу
+    async with AsyncSessionLocal() as session:
+        await save_upload_report(session, upload_id, full_report_text, analysis=data if isinstance(data, dict) else None)
+
+    await send_analysis_report(update.message, tg_id, full_report_text, upload_id=upload_id)
+
+async def send_analysis_report(message, tg_id: int, full_report_text: str, upload_id: int | None = None):
+    """Показывает отчёт с кнопками и запоминает его для выгрузки в CSV."""
+    # Показываем результаты и кнопки: сразу полный отчёт, без превью
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📥 Скачать отчёт (CSV)", callback_data="download_csv")],
+        [InlineKeyboardButton("Получить рекомендации по режиму дня", callback_data="get_recommendations")],
+        [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
+    ])
     
-    # Сохраняем текст для дальнейшей выгрузки в CSV
+    # Сохраняем текст для дальнейшей выгрузки в CSV и загрузку, к которой относятся кнопки
     user_states[tg_id] = {
         "state": "analysis_complete",
-        "last_report": full_report_text
+        "last_report": full_report_text,
+        "upload_id": upload_id,
     }
-    await update.message.reply_text(full_report_text, reply_markup=keyboard)
+    await message.reply_text(full_report_text, reply_markup=keyboard)
+
+def _current_upload_id(tg_id: int) -> int | None:
+    """Загрузка, отчёт по которой пользователь сейчас смотрит (None — берём последнюю проанализированную)."""
+    state = user_states.get(tg_id)
+    return state.get("upload_id") if isinstance(state, dict) else None
+
+def _clean_report_text(full_report_text: str) -> str:
+    """Дополнительная очистка от JSON, если модель всё ещё его вернула"""
+    cleaned_text = full_report_text.strip()
+    
+    # Убираем блоки кода и JSON
+    if cleaned_text.startswith("```"):
+        cleaned_text = cleaned_text.split("```", 2)[1] if "```" in cleaned_text[3:] else cleaned_text[3:]
+    if cleaned_text.endswith("```"):
+        cleaned_text = cleaned_text.rsplit("```", 1)[0]
+    
+    # Убираем фигурные скобки в начале и конце
+    if cleaned_text.startswith("{"):
+        start_idx = cleaned_text.find("{")
+        end_idx = cleaned_text.rfind("}")
+        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+            # Если это JSON, пытаемся извлечь содержимое
+            try:
+                json_data = json.loads(cleaned_text[start_idx:end_idx+1])
+                # Форматируем как обычный текст
+                lines = []
+                if "productivity_periods" in json_data:
+                    lines.append("Периоды максимальной продуктивности:")
+                    for p in json_data["productivity_periods"]:
+                        lines.append(f"- {p.get('start_time', '?')}–{p.get('end_time', '?')}: {p.get('recommended_activity', '')}")
+                    lines.append("")
+                
+                if "day_plan" in json_data:
+                    lines.append("План дня:")
+                    lines.append(json_data["day_plan"])
+                    lines.append("")
+                
+                if "improvement_suggestions" in json_data:
+                    lines.append("Рекомендации и советы:")
+                    for s in json_data["improvement_suggestions"]:
+                        lines.append(f"- {s}")
+                    lines.append("")
+                
+                cleaned_text = "\n".join(lines)
+            except:
+                # Если не JSON, просто убираем скобки
+                cleaned_text = cleaned_text.strip("{}")
+    return cleaned_text
+
 
 async def cb_get_full_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Получить полный отчет'"""
@@ -734,34 +806,54 @@ async def cb_get_full_report(update: Update, context: ContextTypes.DEFAULT_TYPE)
     tg_id = query.from_user.id
     name = query.from_user.full_name
 
+    async with AsyncSessionLocal() as session:
+        user = await get_or_create_user(session, telegram_id=tg_id, name=name)
+        analysis = await get_upload_analysis(session, user.user_id, upload_id=_current_upload_id(tg_id))
+
+    # Полный отчёт уже получен вместе с анализом загрузки — показываем его сразу
+    stored_report = (analysis or {}).get("full_report")
+    if stored_report:
+        pages = split_message("Вот ваш полный отчет:\n\n" + _clean_report_text(stored_report), MESSAGE_LIMIT)
+        await query.edit_message_text(pages[0])
+        for page in pages[1:]:
+            await query.message.reply_text(page)
+    else:
+        await _stream_full_report(query, user)
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Получить рекомендации по режиму дня", callback_data="get_recommendations")],
+        [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
+    ])
+    await query.message.reply_text("Что дальше?", reply_markup=keyboard)
+
+async def _metric_history(session, user_id: int, until: datetime | None = None) -> dict:
+    """Длинная история для промпта: часовые и дневные агрегаты вместо сырых строк (до until, если задан)."""
+    return await get_rollup_history(
+        session, user_id,
+        hourly_days=settings.ANALYSIS_HOURLY_DAYS,
+        daily_days=settings.ANALYSIS_DAILY_DAYS,
+        until=until,
+    )
+
+async def _stream_full_report(query, user):
+    """Полный отчёт отдельным запросом к LLM (для загрузок, проанализированных до единого анализа)."""
+    tg_id = query.from_user.id
+    name = query.from_user.full_name
+
     await query.edit_message_text("Генерирую подробный отчет...")
 
     async with AsyncSessionLocal() as session:
-        user = await get_or_create_user(session, telegram_id=tg_id, name=name)
-        metrics = await get_user_metrics(session, user.user_id)
+        rows = await get_recent_metrics(
+            session, user.user_id,
+            limit=settings.ANALYSIS_MAX_ROWS,
+            last_days=settings.ANALYSIS_WINDOW_DAYS or None,
+        )
+        history = await _metric_history(session, user.user_id)
 
-    if not metrics:
+    if not rows:
         await query.edit_message_text("Нет метрик для генерации отчета. Пришлите файл с метриками сначала.")
         return
 
-    rows = []
-    for m in metrics[:120]: # Ограничиваем количество метрик для LLM
-        rows.append({
-            "timestamp": m.timestamp,
-            "cognitive_score": m.cognitive_score,
-            "focus": m.focus,
-            "chill": m.chill,
-            "stress": m.stress,
-            "self_control": m.self_control,
-            "anger": m.anger,
-            "relaxation_index": m.relaxation_index,
-            "concentration_index": m.concentration_index,
-            "fatique_score": m.fatique_score,
-            "reverse_fatique": m.reverse_fatique,
-            "alpha_gravity": m.alpha_gravity,
-            "heart_rate": m.heart_rate,
-        })
-
     instruction = """
 Ты — эксперт в области нейрофизиологии и нейропсихофизиологии, специализирующийся на анализе BCI/ЭЭГ данных.
 Используй подходы доказательной медицины и результаты исследований (Базановой Ольги Михайловны, Pfurtscheller, Klimesch и др.) для построения индивидуализированного профиля состояния.
@@ -795,68 +887,28 @@ async def cb_get_full_report(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception:
         iaf_value = None
 
-    prompt = build_prompt_for_llm(
+    prompt = await run_light(
+        build_prompt_for_llm,
         user_name=name,
         metrics_rows=rows,
         instruction=instruction,
-        iaf_hz=iaf_value
+        iaf_hz=iaf_value,
+        encoding=settings.PROMPT_ENCODING,
+        history=history,
     )
 
     try:
-        full_report_text = await chat_with_llm([{"role": "user", "content": prompt}], max_tokens=1200, temperature=0.2)
-        
-        # Дополнительная очистка от JSON, если модель всё ещё его вернула
-        cleaned_text = full_report_text.strip()
-        
-        # Убираем блоки кода и JSON
-        if cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text.split("```", 2)[1] if "```" in cleaned_text[3:] else cleaned_text[3:]
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text.rsplit("```", 1)[0]
-        
-        # Убираем фигурные скобки в начале и конце
-        if cleaned_text.startswith("{"):
-            start_idx = cleaned_text.find("{")
-            end_idx = cleaned_text.rfind("}")
-            if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                # Если это JSON, пытаемся извлечь содержимое
-                try:
-                    import json
-                    json_data = json.loads(cleaned_text[start_idx:end_idx+1])
-                    # Форматируем как обычный текст
-                    lines = []
-                    if "productivity_periods" in json_data:
-                        lines.append("Периоды максимальной продуктивности:")
-                        for p in json_data["productivity_periods"]:
-                            lines.append(f"- {p.get('start_time', '?')}–{p.get('end_time', '?')}: {p.get('recommended_activity', '')}")
-                        lines.append("")
-                    
-                    if "day_plan" in json_data:
-                        lines.append("План дня:")
-                        lines.append(json_data["day_plan"])
-                        lines.append("")
-                    
-                    if "improvement_suggestions" in json_data:
-                        lines.append("Рекомендации и советы:")
-                        for s in json_data["improvement_suggestions"]:
-                            lines.append(f"- {s}")
-                        lines.append("")
-                    
-                    cleaned_text = "\n".join(lines)
-                except:
-                    # Если не JSON, просто убираем скобки
-                    cleaned_text = cleaned_text.strip("{}")
-        
-        await query.message.reply_text(f"Вот ваш полный отчет:\n\n{cleaned_text}")
+        # Отчёт дописывается в «Генерирую подробный отчет...» по мере генерации
+        await stream_to_message(
+            query.message,
+            stream_chat_with_llm([{"role": "user", "content": prompt}], max_tokens=1200, temperature=0.2,
+                                 user_key=tg_id),
+            prefix="Вот ваш полный отчет:\n\n",
+            transform=_clean_report_text,
+        )
     except Exception as e:
         await query.message.reply_text(f"❌ Ошибка при генерации полного отчета: {str(e)}")
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Получить рекомендации по режиму дня", callback_data="get_recommendations")],
-        [InlineKeyboardButton("🔄 Start (переход на начало)", callback_data="restart")]
-    ])
-    await query.message.reply_text("Что дальше?", reply_markup=keyboard)
-
 
 async def cb_download_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Загрузить файл'"""
@@ -908,39 +960,20 @@ async def cb_download_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=keyboard
     )
 
-async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка кнопки 'Получить рекомендации по режиму дня'"""
-    query = update.callback_query
-    await query.answer()
-    
+async def _generate_day_plan(query, user) -> str | None:
+    """План дня отдельным запросом к LLM (если анализа загрузки нет); None — ошибка уже показана пользователю."""
     tg_id = query.from_user.id
-    
     async with AsyncSessionLocal() as session:
-        user = await get_or_create_user(session, telegram_id=tg_id, name=query.from_user.full_name)
-        metrics = await get_user_metrics(session, user.user_id)
+        rows = await get_recent_metrics(
+            session, user.user_id,
+            limit=settings.ANALYSIS_MAX_ROWS,
+            last_days=settings.ANALYSIS_WINDOW_DAYS or None,
+        )
+        history = await _metric_history(session, user.user_id)
     
-    if not metrics:
+    if not rows:
         await query.edit_message_text("Нет метрик. Пришлите файл сначала.")
-        return
-    
-    # Подготавливаем данные для LLM
-    rows = []
-    for m in metrics[:120]:
-        rows.append({
-            "timestamp": m.timestamp,
-            "cognitive_score": m.cognitive_score,
-            "focus": m.focus,
-            "chill": m.chill,
-            "stress": m.stress,
-            "self_control": m.self_control,
-            "anger": m.anger,
-            "relaxation_index": m.relaxation_index,
-            "concentration_index": m.concentration_index,
-            "fatique_score": m.fatique_score,
-            "reverse_fatique": m.reverse_fatique,
-            "alpha_gravity": m.alpha_gravity,
-            "heart_rate": m.heart_rate,
-        })
+        return None
     
     # Получаем рекомендации от LLM
     # Добавим IAF в промпт
@@ -950,7 +983,8 @@ async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_T
     except Exception:
         iaf_value = None
 
-    prompt = build_prompt_for_llm(
+    prompt = await run_light(
+        build_prompt_for_llm,
         user_name=query.from_user.full_name, 
         metrics_rows=rows,
         instruction = """
@@ -967,39 +1001,11 @@ async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_T
 {"day_plan": "1. Утренний подъем (7:00-7:30): Легкая зарядка, медитация. 2. Продуктивная работа (9:00-12:00): Сосредоточенные задачи..."}
 ```
 """
-    , iaf_hz=iaf_value)
+    , iaf_hz=iaf_value, encoding=settings.PROMPT_ENCODING, history=history)
     
     try:
-        raw = await analyze_metrics(prompt)
-        
-        # Очищаем ответ от лишних символов и форматирования
-        cleaned_raw = raw.strip()
-        
-        # Убираем markdown блоки ```json и ```
-        if cleaned_raw.startswith("```json"):
-            cleaned_raw = cleaned_raw[7:]  # убираем ```json
-        if cleaned_raw.startswith("```"):
-            cleaned_raw = cleaned_raw[3:]   # убираем ```
-        if cleaned_raw.endswith("```"):
-            cleaned_raw = cleaned_raw[:-3]  # убираем ```
-        
-        cleaned_raw = cleaned_raw.strip()
-        
-        # Дополнительная очистка - убираем возможные лишние символы в начале
-        if not cleaned_raw.startswith("{"):
-            # Ищем первую открывающую скобку
-            start_idx = cleaned_raw.find("{")
-            if start_idx != -1:
-                cleaned_raw = cleaned_raw[start_idx:]
-        
-        # Убираем возможные лишние символы в конце
-        if not cleaned_raw.endswith("}"):
-            # Ищем последнюю закрывающую скобку
-            end_idx = cleaned_raw.rfind("}")
-            if end_idx != -1:
-                cleaned_raw = cleaned_raw[:end_idx + 1]
-        
-        data = safe_json_loads(raw) # Используем safe_json_loads
+        raw = await analyze_metrics(prompt, user_key=tg_id, schema=DayPlanResponse)
+        data = parse_llm_json(raw, DayPlanResponse)
     except json.JSONDecodeError as e:
         await query.edit_message_text(
             f"❌ Ошибка парсинга JSON от модели\n\n"
@@ -1008,12 +1014,30 @@ async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_T
             f"Ответ модели:\n{raw[:500]}...\n\n"
             f"Ошибка: {str(e)}"
         )
-        return
+        return None
     except Exception as e:
         await query.edit_message_text(f"Ошибка LLM: {e}\nОтвет:\n{raw}")
-        return
+        return None
     
-    day_plan = data.get("day_plan", "(нет)")
+    return data.get("day_plan", "(нет)")
+
+async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Получить рекомендации по режиму дня'"""
+    query = update.callback_query
+    await query.answer()
+    
+    tg_id = query.from_user.id
+    
+    async with AsyncSessionLocal() as session:
+        user = await get_or_create_user(session, telegram_id=tg_id, name=query.from_user.full_name)
+        analysis = await get_upload_analysis(session, user.user_id, upload_id=_current_upload_id(tg_id))
+    
+    # План дня обычно уже есть в анализе загрузки; отдельный запрос к LLM — только для старых загрузок
+    day_plan = (analysis or {}).get("day_plan")
+    if not day_plan:
+        day_plan = await _generate_day_plan(query, user)
+        if day_plan is None:
+            return
     
     # Сохраняем рекомендации в БД
     try:
@@ -1040,35 +1064,16 @@ async def cb_get_recommendations(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=keyboard
     )
 
-async def cb_improve_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка кнопки 'Улучшить режим дня'"""
-    query = update.callback_query
-    await query.answer()
-    
+async def _generate_improvement_suggestions(query, user) -> list | None:
+    """Советы отдельным запросом к LLM (если анализа загрузки нет); None — ошибка уже показана пользователю."""
     tg_id = query.from_user.id
-    
     async with AsyncSessionLocal() as session:
-        user = await get_or_create_user(session, telegram_id=tg_id, name=query.from_user.full_name)
-        metrics = await get_user_metrics(session, user.user_id)
-    
-    # Подготавливаем данные для LLM
-    rows = []
-    for m in metrics[:120]:
-        rows.append({
-            "timestamp": m.timestamp,
-            "cognitive_score": m.cognitive_score,
-            "focus": m.focus,
-            "chill": m.chill,
-            "stress": m.stress,
-            "self_control": m.self_control,
-            "anger": m.anger,
-            "relaxation_index": m.relaxation_index,
-            "concentration_index": m.concentration_index,
-            "fatique_score": m.fatique_score,
-            "reverse_fatique": m.reverse_fatique,
-            "alpha_gravity": m.alpha_gravity,
-            "heart_rate": m.heart_rate,
-        })
+        rows = await get_recent_metrics(
+            session, user.user_id,
+            limit=settings.ANALYSIS_MAX_ROWS,
+            last_days=settings.ANALYSIS_WINDOW_DAYS or None,
+        )
+        history = await _metric_history(session, user.user_id)
     
     # Получаем улучшения от LLM
     iaf_value = None
@@ -1077,7 +1082,8 @@ async def cb_improve_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception:
         iaf_value = None
 
-    prompt = build_prompt_for_llm(
+    prompt = await run_light(
+        build_prompt_for_llm,
         user_name=query.from_user.full_name, 
         metrics_rows=rows,
         instruction = """
@@ -1094,39 +1100,11 @@ async def cb_improve_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE
 {"improvement_suggestions": ["1. Увеличьте продолжительность сна на 30 минут.", "2. Включите короткие перерывы в работу..."]}
 ```
 """
-    , iaf_hz=iaf_value)
+    , iaf_hz=iaf_value, encoding=settings.PROMPT_ENCODING, history=history)
     
     try:
-        raw = await analyze_metrics(prompt)
-        
-        # Очищаем ответ от лишних символов и форматирования
-        cleaned_raw = raw.strip()
-        
-        # Убираем markdown блоки ```json и ```
-        if cleaned_raw.startswith("```json"):
-            cleaned_raw = cleaned_raw[7:]  # убираем ```json
-        if cleaned_raw.startswith("```"):
-            cleaned_raw = cleaned_raw[3:]   # убираем ```
-        if cleaned_raw.endswith("```"):
-            cleaned_raw = cleaned_raw[:-3]  # убираем ```
-        
-        cleaned_raw = cleaned_raw.strip()
-        
-        # Дополнительная очистка - убираем возможные лишние символы в начале
-        if not cleaned_raw.startswith("{"):
-            # Ищем первую открывающую скобку
-            start_idx = cleaned_raw.find("{")
-            if start_idx != -1:
-                cleaned_raw = cleaned_raw[start_idx:]
-        
-        # Убираем возможные лишние символы в конце
-        if not cleaned_raw.endswith("}"):
-            # Ищем последнюю закрывающую скобку
-            end_idx = cleaned_raw.rfind("}")
-            if end_idx != -1:
-                cleaned_raw = cleaned_raw[:end_idx + 1]
-        
-        data = safe_json_loads(raw) # Используем safe_json_loads
+        raw = await analyze_metrics(prompt, user_key=tg_id, schema=ImprovementSuggestionsResponse)
+        data = parse_llm_json(raw, ImprovementSuggestionsResponse)
     except json.JSONDecodeError as e:
         await query.edit_message_text(
             f"❌ Ошибка парсинга JSON от модели\n\n"
@@ -1135,12 +1113,30 @@ async def cb_improve_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"Ответ модели:\n{raw[:500]}...\n\n"
             f"Ошибка: {str(e)}"
         )
-        return
+        return None
     except Exception as e:
         await query.edit_message_text(f"Ошибка LLM: {e}\nОтвет:\n{raw}")
-        return
+        return None
+    
+    return data.get("improvement_suggestions", []) or []
+
+async def cb_improve_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Улучшить режим дня'"""
+    query = update.callback_query
+    await query.answer()
+    
+    tg_id = query.from_user.id
     
-    tips = data.get("improvement_suggestions", []) or []
+    async with AsyncSessionLocal() as session:
+        user = await get_or_create_user(session, telegram_id=tg_id, name=query.from_user.full_name)
+        analysis = await get_upload_analysis(session, user.user_id, upload_id=_current_upload_id(tg_id))
+    
+    # Советы обычно уже есть в анализе загрузки; отдельный запрос к LLM — только для старых загрузок
+    tips = (analysis or {}).get("improvement_suggestions")
+    if not tips:
+        tips = await _generate_improvement_suggestions(query, user)
+        if tips is None:
+            return
     
     if tips:
         # Сохраняем улучшения в БД
@@ -1197,7 +1193,7 @@ async def handle_schedule_question(update: Update, context: ContextTypes.DEFAULT
     name = update.effective_user.full_name
     question = update.message.text
 
-    await update.message.reply_text("🤔 Обрабатываю ваш вопрос по режиму дня...")
+    placeholder = await update.message.reply_text("🤔 Обрабатываю ваш вопрос по режиму дня...")
 
     # Системная инструкция для режима дня — разрешаем вопросы про расписание/питание/сон
     history = [
@@ -1223,16 +1219,17 @@ async def handle_schedule_question(update: Update, context: ContextTypes.DEFAULT
     history.append({"role": "user", "content": augmented_question})
 
     try:
-        answer = await chat_with_llm(history, max_tokens=600, temperature=0.3)
-        # Получаем актуальное состояние напоминаний
-        async with AsyncSessionLocal() as session:
-            user = await get_or_create_user(session, telegram_id=tg_id, name=name)
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("Вопрос по режиму дня", callback_data="ask_schedule")],
             [InlineKeyboardButton("✨ Улучшить режим дня", callback_data="improve_schedule")],
             [InlineKeyboardButton("🔄 Start", callback_data="restart")]
         ])
-        await update.message.reply_text(f"Ответ по режиму дня:\n\n{answer}", reply_markup=keyboard)
+        await stream_to_message(
+            placeholder,
+            stream_chat_with_llm(history, max_tokens=600, temperature=0.3, user_key=tg_id),
+            prefix="Ответ по режиму дня:\n\n",
+            reply_markup=keyboard,
+        )
         user_states[tg_id] = "welcome"
     except Exception as e:
         await update.message.reply_text(
@@ -1266,8 +1263,26 @@ MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 def get_moscow_time():
     return datetime.now(MOSCOW_TZ)
 
+async def on_startup(app: Application):
+    """Ресурсы, общие для всех апдейтов: создаются один раз при старте бота."""
+    get_http_session()
+    get_llm_client()
+    await asyncio.gather(warm_pools(), warm_llm_client(), warm_db_pool())
+
+async def on_shutdown(app: Application):
+    await close_http_session()
+    await close_llm_client()
+    await close_db_pool()
+    shutdown_pools()
+
 def main():
-    app = Application.builder().token(settings.BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(settings.BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Увеличиваем таймауты для загрузки файлов
     app.bot.request.timeout = 300  # 5 минут для больших файлов
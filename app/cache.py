@@ -0,0 +1,100 @@
+#кэши: LRU в памяти процесса с ограничением по размеру и времени жизни записей и файловый (SQLite) для переживания рестартов
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TTLCache:
+    """
+    LRU-кэш на OrderedDict: не больше maxsize записей, каждая живёт ttl секунд (0 — бессрочно).
+    Считает попадания и промахи — см. stats().
+    Не потокобезопасен: использовать из event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None:
+            expires, value = item
+            if not expires or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteCache:
+    """
+    Постоянный кэш строк «ключ → текст» в файле SQLite; записи старше ttl секунд (0 — бессрочно) не отдаются.
+    Методы синхронные (sqlite3) — из асинхронного кода вызывать через executors.run_light.
+    Соединение открывается на каждый вызов, поэтому объект можно использовать из разных потоков.
+    """
+
+    def __init__(self, path: str, ttl: float = 0, table: str = "cache"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+            if ttl > 0:
+                conn.execute(f"DELETE FROM {table} WHERE created_at < ?", (time.time() - ttl,))
+
+    @contextmanager
+    def _connect(self):
+        # with sqlite3.Connection только коммитит, но не закрывает соединение — закрываем сами
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> str | None:
+        min_created = time.time() - self.ttl if self.ttl > 0 else 0
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND created_at >= ?", (key, min_created)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
@@ -0,0 +1,78 @@
+#история диалога с LLM: системный промпт закреплён, реплики укладываются в бюджет токенов,
+#вытесненные реплики сворачиваются в краткое содержание фоновой задачей
+import asyncio
+
+from .utils import estimate_tokens
+
+# служебные токены на каждое сообщение (роль, разделители) в OpenAI-совместимых API
+MESSAGE_OVERHEAD = 4
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD
+
+
+class ChatHistory:
+    """
+    История переписки одного чата (хранится в context.chat_data).
+    messages() — системный промпт (с кратким содержанием прошлого разговора, если оно есть)
+    и последние реплики, всего не больше budget токенов. Последние keep_turns пар «вопрос-ответ»
+    остаются всегда, даже если сами не влезают в бюджет.
+    Вытесненные реплики отдаются summarize(summary, turns) -> str в фоновой задаче, чтобы не задерживать
+    ответ пользователю; пока она работает, в промпт идёт прежнее краткое содержание.
+    Без summarize старые реплики просто отбрасываются.
+    """
+
+    def __init__(self, system_prompt: str, budget: int, summarize=None, keep_turns: int = 1):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.turns: list[dict] = []
+        self._folding: list[dict] = []
+        self._task: asyncio.Task | None = None
+
+    def messages(self) -> list[dict]:
+        system = self.system_prompt
+        if self.summary:
+            system += f"\n\nКраткое содержание предыдущего разговора: {self.summary}"
+        return [{"role": "system", "content": system}] + self.turns
+
+    def tokens(self) -> int:
+        return sum(message_tokens(m) for m in self.messages())
+
+    def add_turn(self, question: str, answer: str):
+        """Добавляет пару «вопрос-ответ» и ужимает историю до бюджета."""
+        self.turns += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        self._trim()
+
+    def _trim(self):
+        total = self.tokens()
+        while total > self.budget and len(self.turns) > 2 * self.keep_turns:
+            oldest = self.turns[:2]
+            del self.turns[:2]
+            total -= sum(message_tokens(m) for m in oldest)
+            self._folding += oldest
+        if not self._folding:
+            return
+        if self.summarize is None:
+            self._folding.clear()
+        elif self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._fold())
+
+    async def _fold(self):
+        # реплики, вытесненные пока шло сворачивание, подхватываются следующим проходом
+        while self._folding:
+            batch = list(self._folding)
+            try:
+                summary = await self.summarize(self.summary, batch)
+                self.summary = summary.strip()
+            except Exception as e:
+                print(f"DEBUG: не удалось свернуть историю чата ({len(batch)} сообщений): {e}")
+            del self._folding[:len(batch)]
+
+    async def wait_summary(self):
+        """Дожидается фонового сворачивания (нужно в тестах)."""
+        if self._task is not None:
+            await self._task
@@ -13,7 +13,96 @@ try:
         DEEPSEEK_API_KEY: str = ""
         OPENROUTER_API_KEY: str = ""
         LLM_MODEL: str = "deepseek/deepseek-chat-v3.1"
+        # адреса chat/completions; для нагрузочных тестов — локальный mock_llm_server.py
+        OPENROUTER_ENDPOINT: str = "https://openrouter.ai/api/v1/chat/completions"
+        DEEPSEEK_ENDPOINT: str = "https://api.deepseek.com/v1/chat/completions"
         DOWNLOADS_DIR: str = "./downloads"
+        # сколько последних строк загруженного файла держать в памяти для расчёта периодов и промпта
+        # (файл пишется в БД потоково, целиком в памяти он не хранится); должно быть больше 0
+        METRICS_TAIL_ROWS: int = 50000
+        # что делать со строками, чья временная метка уже есть у пользователя:
+        # "ignore" — пропускать, "update" — перезаписывать значения,
+        # "hwm" — брать только строки новее последней сохранённой метки
+        METRICS_INGEST_MODE: str = "ignore"
+        # пул соединений с БД (app/database.py): постоянных соединений, сверх них, ожидание свободного (сек),
+        # пересоздавать соединение старше (сек, -1 — никогда), проверять соединение перед выдачей,
+        # кэш подготовленных запросов asyncpg (0 — для pgbouncer в режиме transaction),
+        # сколько соединений открыть при старте, порог медленного запроса для лога (мс, 0 — не писать)
+        DB_POOL_SIZE: int = 5
+        DB_MAX_OVERFLOW: int = 10
+        DB_POOL_TIMEOUT: float = 30
+        DB_POOL_RECYCLE: int = 1800
+        DB_POOL_PRE_PING: bool = False
+        DB_STATEMENT_CACHE_SIZE: int = 100
+        DB_POOL_WARM: int = 2
+        DB_SLOW_QUERY_MS: float = 500
+        # /db_stats: "exact" (count(*) одним запросом), "estimate" (оценка по pg_class) или "counters"
+        # (счётчики create_tables.py --stats-counters); сколько пользователей показывать в разбивке
+        DB_STATS_MODE: str = "estimate"
+        DB_STATS_TOP_USERS: int = 5
+        # часовые и дневные агрегаты метрик (metrics_hourly/metrics_daily) при записи; сколько дней часовых
+        # и дневных агрегатов давать в промпт как длинную историю (0 — не давать)
+        METRICS_ROLLUPS: bool = True
+        ANALYSIS_HOURLY_DAYS: int = 2
+        ANALYSIS_DAILY_DAYS: int = 30
+        # кэш пользователей по telegram_id (crud.get_or_create_user): сколько записей и сколько секунд живёт запись
+        USER_CACHE_SIZE: int = 10000
+        USER_CACHE_TTL: int = 600
+        # сколько последних строк метрик отдавать в LLM и за сколько дней до последней метки (0 — без ограничения)
+        ANALYSIS_MAX_ROWS: int = 120
+        ANALYSIS_WINDOW_DAYS: int = 0
+        # лимит токенов ответа для анализа загрузки (периоды, полный отчёт, план дня и советы одним JSON)
+        ANALYSIS_MAX_TOKENS: int = 3000
+        # локальный расчёт периодов (app/analytics.py): корзины времени суток (мин), окно сглаживания (корзин), сколько периодов каждого вида
+        ANALYTICS_BIN_MINUTES: int = 15
+        ANALYTICS_WINDOW_BINS: int = 3
+        ANALYTICS_MAX_PERIODS: int = 3
+        # формат таблицы метрик в промпте: "compact" (TSV, в разы меньше токенов) или "verbose" (ключ:значение)
+        PROMPT_ENCODING: str = "compact"
+        # общий HTTP-клиент LLM: таймауты (сек), размер пула соединений, HTTP/2 (нужен пакет h2)
+        LLM_TIMEOUT: float = 60
+        LLM_CONNECT_TIMEOUT: float = 10
+        LLM_MAX_CONNECTIONS: int = 20
+        LLM_MAX_KEEPALIVE: int = 10
+        LLM_KEEPALIVE_EXPIRY: float = 120
+        LLM_HTTP2: bool = True
+        # кэш ответов LLM: записей в памяти (0 — выключен), время жизни (сек, 0 — бессрочно),
+        # файл SQLite для постоянного кэша (пусто — только память)
+        LLM_CACHE_SIZE: int = 256
+        LLM_CACHE_TTL: int = 24 * 3600
+        LLM_CACHE_PATH: str = ""
+        # потоковый ответ LLM: как часто (сек) править сообщение в Telegram, пока текст дописывается
+        STREAM_EDIT_INTERVAL: float = 1.0
+        # планировщик запросов к LLM: одновременно в сети, в очереди на пользователя и всего,
+        # сколько секунд ждать в очереди (0 — без ограничения); сверх лимитов запрос отклоняется
+        LLM_MAX_CONCURRENCY: int = 4
+        LLM_MAX_QUEUED_PER_USER: int = 2
+        LLM_MAX_QUEUED: int = 50
+        LLM_QUEUE_TIMEOUT: float = 120
+        # роутер OpenRouter/DeepSeek: модель для DeepSeek API, повторы с паузой (сек, растёт вдвое),
+        # общий бюджет времени на запрос (сек), автомат: ошибок подряд / доля ошибок / пауза (сек);
+        # LLM_HEDGE — дублировать запрос в другой бэкенд, если первый медленнее своей p95 (до замеров — LLM_HEDGE_DELAY)
+        DEEPSEEK_MODEL: str = "deepseek-chat"
+        LLM_RETRIES: int = 2
+        LLM_RETRY_BACKOFF: float = 0.5
+        LLM_TIMEOUT_BUDGET: float = 90
+        LLM_BREAKER_FAILURES: int = 3
+        LLM_BREAKER_ERROR_RATE: float = 0.5
+        LLM_BREAKER_COOLDOWN: float = 30
+        LLM_HEDGE: bool = False
+        LLM_HEDGE_DELAY: float = 15
+        # история вопросов к ai-neiry: бюджет токенов на промпт с историей и длина краткого содержания
+        # вытесненных реплик (токенов)
+        CHAT_HISTORY_TOKENS: int = 1500
+        CHAT_SUMMARY_TOKENS: int = 250
+        # скачивание файлов: размер чтения из сокета (байт) и общий таймаут (сек)
+        DOWNLOAD_CHUNK_BYTES: int = 1024 * 1024
+        DOWNLOAD_TIMEOUT: int = 300
+        # разбор загрузок блоками по ~PARSE_BLOCK_BYTES в пуле из PARSE_PROCESS_WORKERS процессов;
+        # CPU_THREAD_WORKERS — потоки для сборки промптов. 0 воркеров — выполнять прямо в event loop
+        PARSE_BLOCK_BYTES: int = 4 * 1024 * 1024
+        PARSE_PROCESS_WORKERS: int = 2
+        CPU_THREAD_WORKERS: int = 4
 
         model_config = SettingsConfigDict(env_file=".env")
 
@@ -27,7 +116,96 @@ except Exception:
         DEEPSEEK_API_KEY: str = ""
         OPENROUTER_API_KEY: str = ""
         LLM_MODEL: str = "deepseek/deepseek-chat-v3.1"
+        # адреса chat/completions; для нагрузочных тестов — локальный mock_llm_server.py
+        OPENROUTER_ENDPOINT: str = "https://openrouter.ai/api/v1/chat/completions"
+        DEEPSEEK_ENDPOINT: str = "https://api.deepseek.com/v1/chat/completions"
         DOWNLOADS_DIR: str = "./downloads"
+        # сколько последних строк загруженного файла держать в памяти для расчёта периодов и промпта
+        # (файл пишется в БД потоково, целиком в памяти он не хранится); должно быть больше 0
+        METRICS_TAIL_ROWS: int = 50000
+        # что делать со строками, чья временная метка уже есть у пользователя:
+        # "ignore" — пропускать, "update" — перезаписывать значения,
+        # "hwm" — брать только строки новее последней сохранённой метки
+        METRICS_INGEST_MODE: str = "ignore"
+        # пул соединений с БД (app/database.py): постоянных соединений, сверх них, ожидание свободного (сек),
+        # пересоздавать соединение старше (сек, -1 — никогда), проверять соединение перед выдачей,
+        # кэш подготовленных запросов asyncpg (0 — для pgbouncer в режиме transaction),
+        # сколько соединений открыть при старте, порог медленного запроса для лога (мс, 0 — не писать)
+        DB_POOL_SIZE: int = 5
+        DB_MAX_OVERFLOW: int = 10
+        DB_POOL_TIMEOUT: float = 30
+        DB_POOL_RECYCLE: int = 1800
+        DB_POOL_PRE_PING: bool = False
+        DB_STATEMENT_CACHE_SIZE: int = 100
+        DB_POOL_WARM: int = 2
+        DB_SLOW_QUERY_MS: float = 500
+        # /db_stats: "exact" (count(*) одним запросом), "estimate" (оценка по pg_class) или "counters"
+        # (счётчики create_tables.py --stats-counters); сколько пользователей показывать в разбивке
+        DB_STATS_MODE: str = "estimate"
+        DB_STATS_TOP_USERS: int = 5
+        # часовые и дневные агрегаты метрик (metrics_hourly/metrics_daily) при записи; сколько дней часовых
+        # и дневных агрегатов давать в промпт как длинную историю (0 — не давать)
+        METRICS_ROLLUPS: bool = True
+        ANALYSIS_HOURLY_DAYS: int = 2
+        ANALYSIS_DAILY_DAYS: int = 30
+        # кэш пользователей по telegram_id (crud.get_or_create_user): сколько записей и сколько секунд живёт запись
+        USER_CACHE_SIZE: int = 10000
+        USER_CACHE_TTL: int = 600
+        # сколько последних строк метрик отдавать в LLM и за сколько дней до последней метки (0 — без ограничения)
+        ANALYSIS_MAX_ROWS: int = 120
+        ANALYSIS_WINDOW_DAYS: int = 0
+        # лимит токенов ответа для анализа загрузки (периоды, полный отчёт, план дня и советы одним JSON)
+        ANALYSIS_MAX_TOKENS: int = 3000
+        # локальный расчёт периодов (app/analytics.py): корзины времени суток (мин), окно сглаживания (корзин), сколько периодов каждого вида
+        ANALYTICS_BIN_MINUTES: int = 15
+        ANALYTICS_WINDOW_BINS: int = 3
+        ANALYTICS_MAX_PERIODS: int = 3
+        # формат таблицы метрик в промпте: "compact" (TSV, в разы меньше токенов) или "verbose" (ключ:значение)
+        PROMPT_ENCODING: str = "compact"
+        # общий HTTP-клиент LLM: таймауты (сек), размер пула соединений, HTTP/2 (нужен пакет h2)
+        LLM_TIMEOUT: float = 60
+        LLM_CONNECT_TIMEOUT: float = 10
+        LLM_MAX_CONNECTIONS: int = 20
+        LLM_MAX_KEEPALIVE: int = 10
+        LLM_KEEPALIVE_EXPIRY: float = 120
+        LLM_HTTP2: bool = True
+        # кэш ответов LLM: записей в памяти (0 — выключен), время жизни (сек, 0 — бессрочно),
+        # файл SQLite для постоянного кэша (пусто — только память)
+        LLM_CACHE_SIZE: int = 256
+        LLM_CACHE_TTL: int = 24 * 3600
+        LLM_CACHE_PATH: str = ""
+        # потоковый ответ LLM: как часто (сек) править сообщение в Telegram, пока текст дописывается
+        STREAM_EDIT_INTERVAL: float = 1.0
+        # планировщик запросов к LLM: одновременно в сети, в очереди на пользователя и всего,
+        # сколько секунд ждать в очереди (0 — без ограничения); сверх лимитов запрос отклоняется
+        LLM_MAX_CONCURRENCY: int = 4
+        LLM_MAX_QUEUED_PER_USER: int = 2
+        LLM_MAX_QUEUED: int = 50
+        LLM_QUEUE_TIMEOUT: float = 120
+        # роутер OpenRouter/DeepSeek: модель для DeepSeek API, повторы с паузой (сек, растёт вдвое),
+        # общий бюджет времени на запрос (сек), автомат: ошибок подряд / доля ошибок / пауза (сек);
+        # LLM_HEDGE — дублировать запрос в другой бэкенд, если первый медленнее своей p95 (до замеров — LLM_HEDGE_DELAY)
+        DEEPSEEK_MODEL: str = "deepseek-chat"
+        LLM_RETRIES: int = 2
+        LLM_RETRY_BACKOFF: float = 0.5
+        LLM_TIMEOUT_BUDGET: float = 90
+        LLM_BREAKER_FAILURES: int = 3
+        LLM_BREAKER_ERROR_RATE: float = 0.5
+        LLM_BREAKER_COOLDOWN: float = 30
+        LLM_HEDGE: bool = False
+        LLM_HEDGE_DELAY: float = 15
+        # история вопросов к ai-neiry: бюджет токенов на промпт с историей и длина краткого содержания
+        # вытесненных реплик (токенов)
+        CHAT_HISTORY_TOKENS: int = 1500
+        CHAT_SUMMARY_TOKENS: int = 250
+        # скачивание файлов: размер чтения из сокета (байт) и общий таймаут (сек)
+        DOWNLOAD_CHUNK_BYTES: int = 1024 * 1024
+        DOWNLOAD_TIMEOUT: int = 300
+        # разбор загрузок блоками по ~PARSE_BLOCK_BYTES в пуле из PARSE_PROCESS_WORKERS процессов;
+        # CPU_THREAD_WORKERS — потоки для сборки промптов. 0 воркеров — выполнять прямо в event loop
+        PARSE_BLOCK_BYTES: int = 4 * 1024 * 1024
+        PARSE_PROCESS_WORKERS: int = 2
+        CPU_THREAD_WORKERS: int = 4
 
         class Config:
             env_file = ".env"
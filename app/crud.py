@@ -1,30 +1,105 @@
 #сохраняет и читает данные из БД
-from sqlalchemy import select
+import json
+import numpy as np
+from sqlalchemy import select, insert, update, func, text, cast, Date
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, date, time, timezone
+from datetime import datetime, date, time, timedelta, timezone
+from itertools import repeat
 from typing import List
-from .models import User, Metric, ProductivityPeriod, DailyRecommendation, ImprovementSuggestion
+from .models import (
+    User, Metric, MetricUpload, ProductivityPeriod, DailyRecommendation, ImprovementSuggestion,
+    MetricHourly, MetricDaily, ROLLUP_METRICS,
+)
+from .cache import TTLCache
+from .config import settings
+from .utils import NUMERIC_MAP, MetricsColumns
+
+# порядок колонок при COPY в metrics
+METRIC_COLUMNS = ["user_id", "timestamp", *NUMERIC_MAP.keys()]
+# размер пачки при конвертации колонок в записи / executemany
+_WRITE_BATCH = 10000
+# временная таблица для COPY перед INSERT ... ON CONFLICT
+_STAGE_TABLE = "metrics_stage"
+# см. settings.METRICS_INGEST_MODE
+INGEST_MODES = ("ignore", "update", "hwm")
 
 # users
-async def get_or_create_user(session: AsyncSession, telegram_id: int, name: str | None) -> User:
-    res = await session.execute(select(User).where(User.telegram_id == telegram_id))
-    user = res.scalars().first()
-    if user:
-        return user
-    user = User(telegram_id=int(telegram_id), name=name, created_at=datetime.now())
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)
+class CachedUser:
+    """Снимок пользователя для кэша: поля, которые нужны обработчикам; к сессии не привязан."""
+
+    __slots__ = ("user_id", "telegram_id", "name", "iaf")
+
+    def __init__(self, user: User):
+        self.user_id = user.user_id
+        self.telegram_id = user.telegram_id
+        self.name = user.name
+        self.iaf = user.iaf
+
+
+# почти каждый апдейт начинается с get_or_create_user — держим пользователей в памяти,
+# чтобы не ходить за ними в БД; update_user_iaf сбрасывает запись
+_user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+def user_cache_stats() -> dict:
+    stats = _user_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return {**stats, "hit_rate": stats["hits"] / lookups if lookups else 0.0}
+
+async def _user_insert(session: AsyncSession):
+    """INSERT для users с ON CONFLICT под диалект сессии (PostgreSQL/SQLite); None — диалект без upsert."""
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(User)
+
+async def get_or_create_user(session: AsyncSession, telegram_id: int, name: str | None) -> User | CachedUser:
+    """
+    Пользователь по telegram_id (создаётся при первом обращении). Из кэша возвращается CachedUser —
+    без запроса к БД; сессия при этом не используется.
+    Промах кэша — один запрос INSERT ... ON CONFLICT (telegram_id) ... RETURNING: два одновременных
+    первых сообщения одного пользователя не упираются в уникальный индекс, refresh после commit не нужен.
+    """
+    cached = _user_cache.get(int(telegram_id))
+    if cached is not None:
+        return cached
+    stmt = await _user_insert(session)
+    if stmt is None:
+        res = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        user = res.scalars().first()
+        if not user:
+            user = User(telegram_id=int(telegram_id), name=name, created_at=datetime.now())
+            session.add(user)
+            await session.commit()
+            await session.refresh(user)
+    else:
+        stmt = stmt.values(telegram_id=int(telegram_id), name=name, created_at=datetime.now())
+        # DO NOTHING не вернул бы уже существующую строку — "пустой" UPDATE отдаёт её в RETURNING
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["telegram_id"],
+            set_={"telegram_id": stmt.excluded.telegram_id},
+        ).returning(User)
+        res = await session.execute(stmt, execution_options={"populate_existing": True})
+        user = res.scalars().first()
+        await session.commit()
+    _user_cache.set(int(telegram_id), CachedUser(user))
     return user
 
 async def update_user_iaf(session: AsyncSession, telegram_id: int, iaf: float) -> User:
-    res = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    """Сохраняет IAF одним запросом UPDATE ... RETURNING; ValueError, если пользователя нет."""
+    res = await session.execute(
+        update(User).where(User.telegram_id == telegram_id).values(iaf=iaf).returning(User),
+        execution_options={"populate_existing": True, "synchronize_session": False},
+    )
     user = res.scalars().first()
     if not user:
         raise ValueError("User not found")
-    user.iaf = iaf
     await session.commit()
-    await session.refresh(user)
+    _user_cache.pop(int(telegram_id))
     return user
 
 async def get_all_users(session: AsyncSession) -> List[User]:
@@ -33,19 +108,437 @@ async def get_all_users(session: AsyncSession) -> List[User]:
 
 
 # metrics
-async def save_metrics_bulk(session: AsyncSession, user_id: int, rows: List[dict]) -> int:
-    objs = []
-    for r in rows:
-        # r must have keys matching model: timestamp, cognitive_score, ...
-        objs.append(Metric(user_id=user_id, **r))
-    session.add_all(objs)
+def _as_columns(rows) -> MetricsColumns:
+    # MetricRows из utils уже несёт колонки; старый формат list[dict] собираем в колонки
+    columns = getattr(rows, "columns", None)
+    return columns if isinstance(columns, MetricsColumns) else MetricsColumns.from_rows(rows)
+
+def _metric_records(user_id: int, columns: MetricsColumns):
+    # кортежи в порядке METRIC_COLUMNS, пачками через .tolist() (None вместо пустых значений)
+    for start in range(0, len(columns), _WRITE_BATCH):
+        lists = columns.to_lists(start, start + _WRITE_BATCH)
+        yield from zip(repeat(user_id), *lists.values())
+
+async def _copy_metric_rows(session: AsyncSession, user_id: int, columns: MetricsColumns, table: str = Metric.__tablename__) -> int:
+    """Быстрый путь для PostgreSQL+asyncpg: бинарный COPY в таблицу (по умолчанию metrics)."""
+    # COPY идёт мимо SQLAlchemy, а asyncpg-адаптер открывает транзакцию только на первом запросе:
+    # без него COPY закоммитится сразу и rollback сессии его не отменит
+    await session.execute(text("SELECT 1"))
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table,
+        records=_metric_records(user_id, columns),
+        columns=METRIC_COLUMNS,
+    )
+    return len(columns)
+
+async def _executemany_metric_rows(session: AsyncSession, user_id: int, columns: MetricsColumns, stmt=None) -> int:
+    """Запасной путь для остальных диалектов: Core executemany пачками, без ORM-объектов."""
+    stmt = insert(Metric) if stmt is None else stmt
+    keys = list(METRIC_COLUMNS)
+    for start in range(0, len(columns), _WRITE_BATCH):
+        batch = columns.take(slice(start, start + _WRITE_BATCH))
+        await session.execute(stmt, [dict(zip(keys, rec)) for rec in _metric_records(user_id, batch)])
+    return len(columns)
+
+async def _user_high_water_mark(session: AsyncSession, user_id: int) -> datetime | None:
+    res = await session.execute(select(func.max(Metric.timestamp)).where(Metric.user_id == user_id))
+    return res.scalar()
+
+async def _upsert_via_stage(session: AsyncSession, user_id: int, columns: MetricsColumns, mode: str) -> int:
+    """
+    PostgreSQL+asyncpg: COPY во временную таблицу, затем INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Возвращает число строк, которые вставил именно этот запрос (RETURNING), — строки параллельной
+    загрузки новыми не считаются. В режиме "update" уже известные строки затем перезаписывает UPDATE,
+    пропуская строки с теми же значениями.
+    """
+    cols = ", ".join(METRIC_COLUMNS)
+    # таблица живёт до конца транзакции, между кусками одного файла только очищается
+    await session.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {_STAGE_TABLE} ON COMMIT DROP AS "
+        f"SELECT {cols} FROM {Metric.__tablename__} WITH NO DATA"
+    ))
+    await session.execute(text(f"TRUNCATE {_STAGE_TABLE}"))
+    await _copy_metric_rows(session, user_id, columns, table=_STAGE_TABLE)
+
+    res = await session.execute(text(
+        f"WITH ins AS ("
+        f"INSERT INTO {Metric.__tablename__} ({cols}) SELECT {cols} FROM {_STAGE_TABLE} "
+        f"ON CONFLICT (user_id, timestamp) DO NOTHING RETURNING user_id"
+        f") SELECT count(*) FROM ins"
+    ))
+    inserted = int(res.scalar() or 0)
+    if mode == "update" and inserted < len(columns):
+        assignments = ", ".join(f"{key} = s.{key}" for key in NUMERIC_MAP)
+        changed = " OR ".join(f"m.{key} IS DISTINCT FROM s.{key}" for key in NUMERIC_MAP)
+        await session.execute(text(
+            f"UPDATE {Metric.__tablename__} m SET {assignments} FROM {_STAGE_TABLE} s "
+            f"WHERE m.user_id = s.user_id AND m.timestamp = s.timestamp AND ({changed})"
+        ))
+    return inserted
+
+async def _upsert_via_dialect(session: AsyncSession, user_id: int, columns: MetricsColumns, mode: str) -> int:
+    """Остальные диалекты: INSERT ... ON CONFLICT через SQLAlchemy (PostgreSQL/SQLite). Возвращает число новых строк."""
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return await _executemany_metric_rows(session, user_id, columns)
+
+    # сколько меток куска уже есть в БД — считаем заранее, rowcount у executemany ненадёжен
+    lo = columns.timestamps.min().astype("datetime64[us]").item()
+    hi = columns.timestamps.max().astype("datetime64[us]").item()
+    res = await session.execute(
+        select(Metric.timestamp).where(Metric.user_id == user_id, Metric.timestamp >= lo, Metric.timestamp <= hi)
+    )
+    existing = np.array(res.scalars().all(), dtype="datetime64[us]")
+    known = int(np.isin(columns.timestamps.astype("datetime64[us]"), existing).sum())
+
+    stmt = dialect_insert(Metric)
+    if mode == "update":
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "timestamp"],
+            set_={key: stmt.excluded[key] for key in NUMERIC_MAP},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["user_id", "timestamp"])
+    await _executemany_metric_rows(session, user_id, columns, stmt=stmt)
+    return len(columns) - known
+
+async def _insert_metric_rows(session: AsyncSession, user_id: int, rows, mode: str, hwm: datetime | None = None) -> tuple[int, int]:
+    """Пишет кусок метрик с учётом уже сохранённых меток. Возвращает (новых строк, уже известных)."""
+    if not len(rows):
+        return 0, 0
+    columns = _as_columns(rows)
+    total = len(columns)
+    # повторы внутри куска ON CONFLICT не переварит (DO UPDATE падает), убираем их заранее
+    columns = columns.unique_timestamps(keep_last=mode == "update")
+    if mode == "hwm" and hwm is not None:
+        columns = columns.take(columns.timestamps > np.datetime64(hwm, "ns"))
+    if not len(columns):
+        return 0, total
+
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "asyncpg":
+        new = await _upsert_via_stage(session, user_id, columns, mode)
+    else:
+        new = await _upsert_via_dialect(session, user_id, columns, mode)
+    # в режиме "update" значения могли поменяться и без новых строк
+    if settings.METRICS_ROLLUPS and (new or mode == "update"):
+        lo = columns.timestamps.min().astype("datetime64[us]").item()
+        hi = columns.timestamps.max().astype("datetime64[us]").item()
+        await refresh_metric_rollups(session, user_id, lo, hi)
+    return new, total - new
+
+# rollups
+def _rollup_aggregates(source, hourly: bool) -> list:
+    """Агрегаты в порядке колонок rollup-таблиц: из сырых metrics (hourly) или из metrics_hourly (для дней)."""
+    if hourly:
+        columns = [func.count()]
+        for key in ROLLUP_METRICS:
+            value = getattr(source, key)
+            columns += [func.sum(value), func.min(value), func.max(value), func.count(value)]
+        return columns
+    columns = [func.sum(source.c.rows)]
+    for key in ROLLUP_METRICS:
+        columns += [
+            func.sum(source.c[f"{key}_sum"]), func.min(source.c[f"{key}_min"]),
+            func.max(source.c[f"{key}_max"]), func.sum(source.c[f"{key}_n"]),
+        ]
+    return columns
+
+def _rollup_upsert(table, bucket, aggregates, source_filter, group_source):
+    """INSERT INTO <rollup> SELECT ... GROUP BY user_id, bucket ON CONFLICT DO UPDATE (PostgreSQL)."""
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    names = [col.name for col in table.__table__.columns]
+    query = (
+        select(group_source.user_id, bucket, *aggregates)
+        .where(*source_filter)
+        .group_by(group_source.user_id, bucket)
+    )
+    stmt = pg_insert(table).from_select(names, query)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "bucket"],
+        set_={name: stmt.excluded[name] for name in names if name not in ("user_id", "bucket")},
+    )
+
+async def refresh_metric_rollups(session: AsyncSession, user_id: int, start: datetime, end: datetime):
+    """
+    Пересчитывает часы и дни, задетые метками [start, end], из сырых строк (по индексу user_id, timestamp),
+    а дни — из уже пересчитанных часов. Пересчёт целых интервалов, а не прибавление новых строк,
+    верен при любом METRICS_INGEST_MODE (в т.ч. "update"). Без коммита — в транзакции записи метрик.
+    Только PostgreSQL; на других БД агрегаты не ведутся, и история читается из сырых строк.
+    """
+    conn = await session.connection()
+    if conn.dialect.name != "postgresql":
+        return
+    hour_lo = start.replace(minute=0, second=0, microsecond=0)
+    hour_hi = end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    hour = func.date_trunc("hour", Metric.timestamp)
+    await session.execute(_rollup_upsert(
+        MetricHourly, hour, _rollup_aggregates(Metric, hourly=True),
+        [Metric.user_id == user_id, Metric.timestamp >= hour_lo, Metric.timestamp < hour_hi], Metric,
+    ))
+
+    day_lo = datetime.combine(start.date(), time())
+    day_hi = datetime.combine(end.date(), time()) + timedelta(days=1)
+    hours = MetricHourly.__table__
+    day = cast(hours.c.bucket, Date)
+    await session.execute(_rollup_upsert(
+        MetricDaily, day, _rollup_aggregates(hours, hourly=False),
+        [hours.c.user_id == user_id, hours.c.bucket >= day_lo, hours.c.bucket < day_hi], hours.c,
+    ))
+
+def _rollup_row(row: dict) -> dict:
+    """Строка агрегата в формате строк метрик (timestamp + средние по NUMERIC_MAP) плюс rows и {ключ}_min/_max."""
+    bucket = row["bucket"]
+    result = {
+        "timestamp": bucket if isinstance(bucket, datetime) else datetime.combine(bucket, time()),
+        "rows": row["rows"],
+    }
+    for key in ROLLUP_METRICS:
+        n = row[f"{key}_n"]
+        result[key] = row[f"{key}_sum"] / n if n else None
+        result[f"{key}_min"] = row[f"{key}_min"]
+        result[f"{key}_max"] = row[f"{key}_max"]
+    return result
+
+async def get_metric_rollups(session: AsyncSession, user_id: int, grain: str = "hour",
+                             start: datetime | None = None, end: datetime | None = None) -> List[dict]:
+    """Агрегаты пользователя за часы (grain="hour") или дни ("day") по возрастанию времени; start/end включительно."""
+    table = {"hour": MetricHourly, "day": MetricDaily}[grain].__table__
+    query = select(table).where(table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(table.c.bucket >= (start if grain == "hour" else start.date()))
+    if end is not None:
+        query = query.where(table.c.bucket <= (end if grain == "hour" else end.date()))
+    res = await session.execute(query.order_by(table.c.bucket.asc()))
+    return [_rollup_row(row) for row in res.mappings()]
+
+async def get_rollup_history(session: AsyncSession, user_id: int, hourly_days: int, daily_days: int,
+                             until: datetime | None = None) -> dict:
+    """
+    Длинная история для промптов: часовые агрегаты за hourly_days и дневные за daily_days дней
+    до последней сохранённой метки (или до until, например конца загруженного файла).
+    {"hour": [...], "day": [...]}; пусто, если агрегатов нет.
+    """
+    history = {"hour": [], "day": []}
+    if not (hourly_days or daily_days):
+        return history
+    latest = until or await _user_high_water_mark(session, user_id)
+    if latest is None:
+        return history
+    if hourly_days:
+        history["hour"] = await get_metric_rollups(
+            session, user_id, "hour", start=latest - timedelta(days=hourly_days), end=until
+        )
+    if daily_days:
+        history["day"] = await get_metric_rollups(
+            session, user_id, "day", start=latest - timedelta(days=daily_days), end=until
+        )
+    return history
+
+async def _ingest_mode(session: AsyncSession, user_id: int) -> tuple[str, datetime | None]:
+    mode = settings.METRICS_INGEST_MODE
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Неизвестный METRICS_INGEST_MODE: {mode!r} (ожидается одно из {', '.join(INGEST_MODES)})")
+    hwm = await _user_high_water_mark(session, user_id) if mode == "hwm" else None
+    return mode, hwm
+
+async def save_metrics_bulk(session: AsyncSession, user_id: int, rows: List[dict]) -> tuple[int, int]:
+    """
+    Сохраняет метрики одной транзакцией: на PostgreSQL+asyncpg через COPY, иначе executemany.
+    rows — MetricRows из utils.parse_metrics_file или список словарей с ключами ALL_COLS.
+    Строки с уже известной меткой времени обрабатываются по METRICS_INGEST_MODE.
+    Возвращает (новых строк, уже известных).
+    """
+    mode, hwm = await _ingest_mode(session, user_id)
+    counts = await _insert_metric_rows(session, user_id, rows, mode, hwm)
     await session.commit()
-    return len(objs)
+    return counts
+
+async def save_metrics_stream(session: AsyncSession, user_id: int, chunks) -> tuple[int, int]:
+    """
+    Пишет метрики по мере разбора кусков в одной транзакции. chunks — асинхронный (ingest.ingest_upload)
+    или обычный итератор по MetricRows; если у него есть .status и после чтения файла он не "success" —
+    уже записанные куски откатываются и возвращается (0, 0).
+    Иначе возвращает (новых строк, уже известных), как save_metrics_bulk.
+    """
+    new = known = 0
+    try:
+        mode, hwm = await _ingest_mode(session, user_id)
+        if hasattr(chunks, "__aiter__"):
+            async for rows in chunks:
+                n_new, n_known = await _insert_metric_rows(session, user_id, rows, mode, hwm)
+                new, known = new + n_new, known + n_known
+        else:
+            for rows in chunks:
+                n_new, n_known = await _insert_metric_rows(session, user_id, rows, mode, hwm)
+                new, known = new + n_new, known + n_known
+    except Exception:
+        await session.rollback()
+        raise
+    if getattr(chunks, "status", "success") != "success":
+        await session.rollback()
+        return 0, 0
+    await session.commit()
+    return new, known
 
 async def get_user_metrics(session: AsyncSession, user_id: int) -> List[Metric]:
+    """Вся история пользователя ORM-объектами. Для анализа используйте get_recent_metrics / get_metric_rows."""
     res = await session.execute(select(Metric).where(Metric.user_id == user_id).order_by(Metric.timestamp.asc()))
     return list(res.scalars().all())
 
+# колонки строки метрик в формате utils (timestamp + ключи NUMERIC_MAP), без ORM-объектов
+_ROW_COLUMNS = [Metric.timestamp, *(getattr(Metric, key) for key in NUMERIC_MAP)]
+# размер страницы при постраничном чтении
+_PAGE_ROWS = 5000
+
+def _metric_rows_query(user_id: int, start: datetime | None, end: datetime | None):
+    query = select(*_ROW_COLUMNS).where(Metric.user_id == user_id)
+    if start is not None:
+        query = query.where(Metric.timestamp >= start)
+    if end is not None:
+        query = query.where(Metric.timestamp <= end)
+    return query
+
+async def get_metric_rows(session: AsyncSession, user_id: int, start: datetime | None = None, end: datetime | None = None,
+                          limit: int | None = None, newest: bool = False) -> List[dict]:
+    """
+    Строки метрик пользователя словарями (как в utils.parse_metrics_file), по возрастанию времени.
+    start/end — границы включительно. limit — первые limit строк окна, с newest=True — последние.
+    Фильтр, сортировка и лимит выполняются в БД по индексу (user_id, timestamp).
+    """
+    query = _metric_rows_query(user_id, start, end)
+    query = query.order_by(Metric.timestamp.desc() if newest else Metric.timestamp.asc())
+    if limit:
+        query = query.limit(limit)
+    res = await session.execute(query)
+    rows = [dict(row) for row in res.mappings()]
+    if newest:
+        rows.reverse()
+    return rows
+
+async def get_metric_page(session: AsyncSession, user_id: int, after: datetime | None = None, limit: int = _PAGE_ROWS,
+                          start: datetime | None = None, end: datetime | None = None) -> tuple[List[dict], datetime | None]:
+    """
+    Keyset-пагинация по времени: до limit строк строго после метки after.
+    Возвращает (строки, курсор для следующей страницы или None, если страниц больше нет).
+    В отличие от OFFSET, стоимость страницы не растёт с её номером.
+    """
+    query = _metric_rows_query(user_id, start, end)
+    if after is not None:
+        query = query.where(Metric.timestamp > after)
+    res = await session.execute(query.order_by(Metric.timestamp.asc()).limit(limit))
+    rows = [dict(row) for row in res.mappings()]
+    cursor = rows[-1]["timestamp"] if len(rows) == limit else None
+    return rows, cursor
+
+async def iter_metric_pages(session: AsyncSession, user_id: int, start: datetime | None = None, end: datetime | None = None,
+                            page_size: int = _PAGE_ROWS):
+    """Асинхронный генератор страниц get_metric_page — для обхода всей истории без загрузки её в память целиком."""
+    cursor = None
+    while True:
+        rows, cursor = await get_metric_page(session, user_id, after=cursor, limit=page_size, start=start, end=end)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+async def get_recent_metrics(session: AsyncSession, user_id: int, limit: int, last_days: int | None = None) -> List[dict]:
+    """
+    Последние limit строк пользователя (по возрастанию времени).
+    last_days — только за N дней до последней сохранённой метки (не до "сейчас": выгрузки бывают старыми).
+    """
+    start = None
+    if last_days:
+        latest = await _user_high_water_mark(session, user_id)
+        if latest is None:
+            return []
+        start = latest - timedelta(days=last_days)
+    return await get_metric_rows(session, user_id, start=start, limit=limit, newest=True)
+
+async def get_last_upload_metrics(session: AsyncSession, user_id: int, limit: int | None = None) -> List[dict]:
+    """Строки из временного диапазона последнего загруженного файла (последние limit строк)."""
+    res = await session.execute(
+        select(MetricUpload)
+        .where(MetricUpload.user_id == user_id, MetricUpload.first_timestamp.is_not(None))
+        .order_by(MetricUpload.created_at.desc(), MetricUpload.id.desc())
+        .limit(1)
+    )
+    upload = res.scalars().first()
+    if upload is None:
+        return []
+    return await get_metric_rows(
+        session, user_id, start=upload.first_timestamp, end=upload.last_timestamp, limit=limit, newest=True
+    )
+
+# uploads
+async def find_metric_upload(session: AsyncSession, user_id: int, file_unique_id: str | None = None, content_hash: str | None = None) -> MetricUpload | None:
+    """Ищет ранее загруженный файл пользователя по file_unique_id из Telegram или по sha256 содержимого."""
+    if file_unique_id:
+        res = await session.execute(
+            select(MetricUpload).where(MetricUpload.user_id == user_id, MetricUpload.file_unique_id == file_unique_id)
+        )
+        upload = res.scalars().first()
+        if upload is not None:
+            return upload
+    if content_hash:
+        res = await session.execute(
+            select(MetricUpload).where(MetricUpload.user_id == user_id, MetricUpload.content_hash == content_hash)
+        )
+        return res.scalars().first()
+    return None
+
+async def get_upload_hashes(session: AsyncSession, user_id: int) -> set[str]:
+    res = await session.execute(select(MetricUpload.content_hash).where(MetricUpload.user_id == user_id))
+    return set(res.scalars().all())
+
+async def save_metric_upload(session: AsyncSession, user_id: int, content_hash: str, file_unique_id: str | None = None,
+                             file_name: str | None = None, rows_count: int = 0,
+                             first_timestamp: datetime | None = None, last_timestamp: datetime | None = None) -> MetricUpload:
+    upload = MetricUpload(
+        user_id=user_id,
+        content_hash=content_hash,
+        file_unique_id=file_unique_id,
+        file_name=file_name,
+        rows_count=rows_count,
+        first_timestamp=first_timestamp,
+        last_timestamp=last_timestamp,
+    )
+    session.add(upload)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # тот же файл параллельно загрузили второй раз — отдаём уже сохранённую запись
+        await session.rollback()
+        return await find_metric_upload(session, user_id, content_hash=content_hash)
+    await session.refresh(upload)
+    return upload
+
+async def save_upload_report(session: AsyncSession, upload_id: int, report_text: str, analysis: dict | None = None):
+    """Запоминает за загрузкой показанный отчёт и (если есть) весь результат анализа — для кнопок и повторной отправки."""
+    values = {"report_text": report_text}
+    if analysis is not None:
+        values["analysis_json"] = json.dumps(analysis, ensure_ascii=False)
+    await session.execute(update(MetricUpload).where(MetricUpload.id == upload_id).values(**values))
+    await session.commit()
+
+async def get_upload_analysis(session: AsyncSession, user_id: int, upload_id: int | None = None) -> dict | None:
+    """Результат анализа загрузки upload_id, а без него — последней проанализированной загрузки пользователя."""
+    stmt = select(MetricUpload.analysis_json).where(
+        MetricUpload.user_id == user_id, MetricUpload.analysis_json.is_not(None)
+    )
+    if upload_id is not None:
+        stmt = stmt.where(MetricUpload.id == upload_id)
+    res = await session.execute(stmt.order_by(MetricUpload.created_at.desc(), MetricUpload.id.desc()).limit(1))
+    raw = res.scalar()
+    return json.loads(raw) if raw else None
+
 # productivity periods
 async def save_productivity_periods(session: AsyncSession, user_id: int, periods: List[dict]) -> int:
     objs = []
@@ -1,10 +1,195 @@
 #устанавливает асинхронное подключение к БД
+import asyncio
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
+
+class DBStats:
+    """
+    Замеры пула и запросов: время выдачи соединения (ожидание свободного + подключение нового),
+    выдачи сверх pool_size и таймауты, длительность запросов — всего и по каждому тексту запроса.
+    Окна — последние WINDOW замеров; разных текстов запросов не больше MAX_STATEMENTS, остальные идут в "прочие".
+    """
+
+    WINDOW = 1000
+    MAX_STATEMENTS = 200
+    # длина ключа запроса: дальше обычно идут только VALUES/параметры
+    STATEMENT_KEY_LEN = 120
+
+    def __init__(self):
+        self._checkouts = deque(maxlen=self.WINDOW)
+        self._queries = deque(maxlen=self.WINDOW)
+        # текст запроса -> [выполнений, суммарно сек, максимум сек]
+        self._statements: dict[str, list] = {}
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.max_checked_out = 0
+        self.slow_queries = 0
+
+    @classmethod
+    def statement_key(cls, statement: str) -> str:
+        return " ".join(statement.split())[:cls.STATEMENT_KEY_LEN]
+
+    def record_checkout(self, seconds: float, checked_out: int, overflow: bool):
+        self._checkouts.append(seconds)
+        self.checkouts += 1
+        self.overflow_checkouts += overflow
+        self.max_checked_out = max(self.max_checked_out, checked_out)
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def record_query(self, statement: str, seconds: float):
+        self._queries.append(seconds)
+        key = self.statement_key(statement)
+        if key not in self._statements and len(self._statements) >= self.MAX_STATEMENTS:
+            key = "прочие"
+        entry = self._statements.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        if settings.DB_SLOW_QUERY_MS and seconds * 1000 >= settings.DB_SLOW_QUERY_MS:
+            self.slow_queries += 1
+            print(f"DEBUG: медленный запрос {seconds * 1000:.0f} мс: {key}")
+
+    def top_statements(self, limit: int = 5) -> list[dict]:
+        """Запросы с наибольшим суммарным временем."""
+        ranked = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [
+            {"statement": key, "count": count, "total": total, "avg": total / count, "max": longest}
+            for key, (count, total, longest) in ranked
+        ]
+
+    @staticmethod
+    def _quantile(values, q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+    def stats(self, pool=None) -> dict:
+        """Сводка (время в секундах); с pool — ещё и текущее состояние очереди соединений."""
+        result = {
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "max_checked_out": self.max_checked_out,
+            "checkout_p50": self._quantile(self._checkouts, 0.5),
+            "checkout_p95": self._quantile(self._checkouts, 0.95),
+            "queries": sum(entry[0] for entry in self._statements.values()),
+            "query_p50": self._quantile(self._queries, 0.5),
+            "query_p95": self._quantile(self._queries, 0.95),
+            "slow_queries": self.slow_queries,
+        }
+        if pool is not None and hasattr(pool, "checkedout"):
+            result.update({
+                "pool_size": pool.size(),
+                "active": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        return result
+
+
+_db_stats = DBStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Очередь соединений asyncio, которая замеряет время выдачи соединения."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            _db_stats.record_timeout()
+            raise
+        _db_stats.record_checkout(time.perf_counter() - started, self.checkedout(), self.checkedout() > self.size())
+        return conn
+
+
+def _engine_kwargs(url: str) -> dict:
+    """Параметры пула и драйвера из settings (у SQLite своя схема пула — оставляем её)."""
+    if url.startswith("sqlite"):
+        return {}
+    kwargs = {
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if "asyncpg" in url:
+        # кэш подготовленных запросов: у адаптера SQLAlchemy и у самого asyncpg (0 — для pgbouncer в режиме transaction)
+        kwargs["connect_args"] = {
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    return kwargs
+
+
+def instrument(target_engine):
+    """Замер длительности запросов: время между before_ и after_cursor_execute, по тексту запроса."""
+    sync_engine = target_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        _db_stats.record_query(statement, time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _query_failed(exception_context):
+        stack = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if stack:
+            stack.pop()
+
+
 # engine для asyncpg
-engine = create_async_engine(settings.DATABASE_URL, echo=False, future=True)
+engine = create_async_engine(settings.DATABASE_URL, echo=False, future=True, **_engine_kwargs(settings.DATABASE_URL))
+instrument(engine)
 
 # фабрика асинхронных сессий
 AsyncSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
 
+
+def db_pool_stats() -> dict:
+    return _db_stats.stats(engine.pool)
+
+
+def db_top_statements(limit: int = 5) -> list[dict]:
+    return _db_stats.top_statements(limit)
+
+
+async def warm_db_pool():
+    """Открывает DB_POOL_WARM соединений заранее, чтобы первые апдейты не ждали подключения к БД."""
+    count = min(settings.DB_POOL_WARM, settings.DB_POOL_SIZE)
+    if count <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        # соединения держим одновременно, иначе пул отдавал бы одно и то же
+        async with AsyncExitStack() as stack:
+            opened = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(count)),
+                                          return_exceptions=True)
+            errors = [r for r in opened if isinstance(r, BaseException)]
+            if errors:
+                raise errors[0]
+            conns = opened
+            await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+        print(f"DEBUG: пул БД прогрет: {count} соединений за {(time.perf_counter() - started) * 1000:.0f} мс")
+    except Exception as e:
+        print(f"DEBUG: не удалось прогреть пул БД: {e}")
+
+
+async def close_db_pool():
+    await engine.dispose()
@@ -0,0 +1,92 @@
+#пулы для тяжёлой синхронной работы: разбор pandas — в процессах, остальное (промпты и т.п.) — в потоках
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .config import settings
+
+_process_pool: ProcessPoolExecutor | None = None
+_thread_pool: ThreadPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor | None:
+    """Пул процессов для pandas-разбора; None — если PARSE_PROCESS_WORKERS=0 (выполняем inline)."""
+    global _process_pool
+    if settings.PARSE_PROCESS_WORKERS <= 0:
+        return None
+    if _process_pool is None:
+        # spawn, а не fork: форкать процесс с запущенным event loop и потоками небезопасно
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.PARSE_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor | None:
+    """Пул потоков для лёгкой синхронной работы; None — если CPU_THREAD_WORKERS=0 (выполняем inline)."""
+    global _thread_pool
+    if settings.CPU_THREAD_WORKERS <= 0:
+        return None
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=settings.CPU_THREAD_WORKERS, thread_name_prefix="bci-cpu")
+    return _thread_pool
+
+
+def cpu_parallelism() -> int:
+    """Сколько задач имеет смысл держать в пуле процессов одновременно."""
+    return max(settings.PARSE_PROCESS_WORKERS, 1)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Выполняет fn в пуле процессов. fn и аргументы должны пиклиться, поэтому возвращать
+    лучше компактные данные (NumPy-массивы), а не списки словарей.
+    Если пул выключен или сломан — выполняет inline.
+    """
+    global _process_pool
+    pool = get_process_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        # воркер упал (например, OOM) — пересоздадим пул при следующем вызове, а этот кусок посчитаем здесь
+        _process_pool = None
+        return fn(*args, **kwargs)
+
+
+async def run_light(fn, *args, **kwargs):
+    """Выполняет fn в пуле потоков (или inline, если пул выключен)."""
+    pool = get_thread_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+
+async def warm_pools():
+    """Поднимает воркеры заранее, чтобы первая загрузка не ждала запуска процессов и импорта pandas."""
+    from .utils import parse_metrics_csv_block
+
+    pool = get_process_pool()
+    get_thread_pool()
+    if pool is None:
+        return
+    loop = asyncio.get_running_loop()
+    warmups = [loop.run_in_executor(pool, parse_metrics_csv_block, b"timestamp\n", True)
+               for _ in range(settings.PARSE_PROCESS_WORKERS)]
+    await asyncio.gather(*warmups, return_exceptions=True)
+
+
+def shutdown_pools():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
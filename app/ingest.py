@@ -0,0 +1,176 @@
+#скачивание загруженных в Telegram файлов и разбор CSV прямо по ходу скачивания
+import asyncio
+import hashlib
+from collections import deque
+
+import aiohttp
+
+from .config import settings
+from .crud import save_metrics_stream
+from .executors import cpu_parallelism, run_cpu
+from .utils import MetricRows, MetricsStreamState, parse_metrics_csv_block, parse_metrics_excel_bytes
+
+# Общая HTTP-сессия на всё приложение (создаётся при старте бота, закрывается при остановке)
+_http_session: aiohttp.ClientSession | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую aiohttp-сессию, при необходимости создаёт её (нужен запущенный event loop)."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=settings.DOWNLOAD_TIMEOUT),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+class _QueuedChunks:
+    """
+    Асинхронный итератор по кускам, которые producer кладёт в очередь.
+    Итерация заканчивается, когда producer завершился (успешно или с ошибкой) и очередь пуста;
+    .status берётся у состояния разбора.
+    """
+
+    def __init__(self, chunks: asyncio.Queue, producer: asyncio.Task, state: MetricsStreamState):
+        self._chunks = chunks
+        self._producer = producer
+        self._state = state
+
+    @property
+    def status(self):
+        return self._state.status
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._chunks.empty() and self._producer.done():
+            raise StopAsyncIteration
+        get = asyncio.ensure_future(self._chunks.get())
+        await asyncio.wait({get, self._producer}, return_when=asyncio.FIRST_COMPLETED)
+        if get.done():
+            return get.result()
+        get.cancel()
+        if not self._chunks.empty():
+            return self._chunks.get_nowait()
+        raise StopAsyncIteration
+
+
+async def ingest_upload(session, user_id: int, file_url: str, file_name: str,
+                        known_hashes: set[str] | None = None) -> tuple[int, int, MetricsStreamState]:
+    """
+    Конвейер загрузки: скачивание (event loop) → разбор блоков CSV (пул процессов, см. executors) → запись в БД.
+    Скачанные байты режутся на блоки ~PARSE_BLOCK_BYTES по границе строки, к каждому блоку
+    приписывается заголовок, и блоки разбираются параллельно; результаты идут в БД в исходном порядке.
+    Многострочные значения в кавычках внутри CSV не поддерживаются. XLSX разбирается целиком после скачивания.
+
+    sha256 содержимого (state.content_hash) считается по ходу скачивания. Если у пользователя уже есть
+    загрузки (known_hashes не пуст), блоки по-прежнему разбираются параллельно со скачиванием, но в БД
+    уходят только после того, как хеш известен: при совпадении с known_hashes статус — "duplicate: ...",
+    и ничего не записывается. Первая загрузка пишется в БД сразу.
+
+    Возвращает (новых строк, уже известных строк, состояние разбора); итоговый статус — state.status.
+    Ошибки скачивания (aiohttp.ClientError) пробрасываются после отката записи.
+    """
+    state = MetricsStreamState(tail_rows=max(settings.METRICS_TAIL_ROWS, 1))
+    # небольшая очередь: если БД не успевает, разбор и скачивание ждут, а не копят куски в памяти
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=2)
+    is_csv = file_name.lower().endswith(".csv")
+
+    async def produce():
+        pending: deque = deque()
+        # разобранные куски, которые ждут проверки хеша (None — писать в БД сразу)
+        held = [] if known_hashes else None
+
+        async def emit(keep: int) -> bool:
+            # отдаём готовые куски по порядку, пока в работе больше keep блоков
+            while len(pending) > keep:
+                columns, filled, error = await pending.popleft()
+                if error:
+                    state.fail(error)
+                    return False
+                state.add(columns, filled)
+                if not len(columns):
+                    continue
+                if held is not None:
+                    held.append(MetricRows(columns))
+                else:
+                    await chunks.put(MetricRows(columns))
+            return True
+
+        submitted = 0
+
+        def submit_csv(data: bytes):
+            nonlocal submitted
+            pending.append(asyncio.ensure_future(run_cpu(parse_metrics_csv_block, data, submitted == 0)))
+            submitted += 1
+
+        try:
+            async with get_http_session().get(file_url) as response:
+                response.raise_for_status()
+                buf = bytearray()
+                header = None
+                digest = hashlib.sha256()
+                async for data in response.content.iter_chunked(settings.DOWNLOAD_CHUNK_BYTES):
+                    digest.update(data)
+                    buf += data
+                    if not is_csv:
+                        continue
+                    if header is None:
+                        end = buf.find(b"\n")
+                        if end < 0:
+                            continue
+                        header = bytes(buf[:end + 1])
+                        del buf[:end + 1]
+                    if len(buf) >= settings.PARSE_BLOCK_BYTES:
+                        cut = buf.rfind(b"\n") + 1
+                        if cut:
+                            submit_csv(header + bytes(buf[:cut]))
+                            del buf[:cut]
+                            if not await emit(cpu_parallelism()):
+                                # файл уже отвергнут (например, нет нужных колонок) — докачивать незачем
+                                return
+            state.content_hash = digest.hexdigest()
+            if held is not None:
+                # повторная отправка того же файла с новым file_unique_id — обычное дело:
+                # разобранное выбрасываем, в БД ничего не ушло
+                if state.content_hash in known_hashes:
+                    state.fail("duplicate: Файл уже загружен")
+                    return
+                rows, held = held, None
+                for part in rows:
+                    await chunks.put(part)
+            if not is_csv:
+                pending.append(asyncio.ensure_future(run_cpu(parse_metrics_excel_bytes, bytes(buf))))
+            elif header is None:
+                # файл без перевода строки — только заголовок
+                submit_csv(bytes(buf))
+            elif buf or not submitted:
+                submit_csv(header + bytes(buf))
+            if await emit(0):
+                state.finish()
+        except BaseException as e:
+            state.fail(f"file_error: Скачивание прервано: {e}")
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+    producer = asyncio.create_task(produce())
+    try:
+        new, known = await save_metrics_stream(session, user_id, _QueuedChunks(chunks, producer, state))
+    except BaseException:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        raise
+
+    # если скачивание сорвалось, save_metrics_stream уже откатил запись — отдаём ошибку скачивания
+    await producer
+    return new, known, state
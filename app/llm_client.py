@@ -1,14 +1,222 @@
 #если DEEPSEEK_API_KEY пустой — будет мок-ответ. Это удобно чтобы разворачивать и тестировать.
+import asyncio
 import httpx
+import hashlib
+import importlib.util
 import json
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from .cache import SQLiteCache, TTLCache
 from .config import settings
+from .executors import run_light
+from .schemas import parse_llm_json, response_format as schema_response_format
+from .utils import estimate_tokens
 
 # По умолчанию используем OpenRouter, если задан OPENROUTER_API_KEY, иначе DeepSeek API.
-OPENROUTER_ENDPOINT = "https://openrouter.ai/api/v1/chat/completions"
-DEEPSEEK_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
+# Адреса берутся из настроек: их можно направить на локальный mock_llm_server.py
+OPENROUTER_ENDPOINT = settings.OPENROUTER_ENDPOINT
+DEEPSEEK_ENDPOINT = settings.DEEPSEEK_ENDPOINT
 DEFAULT_MODEL = "deepseek/deepseek-chat-v3.1"
 
-async def _call_openrouter(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2) -> str:
+# Общий клиент на всё приложение: TCP+TLS соединения переиспользуются между запросами
+# (создаётся при старте бота, закрывается при остановке)
+_llm_client: httpx.AsyncClient | None = None
+
+def _new_llm_client(**overrides) -> httpx.AsyncClient:
+    """Клиент с пулом соединений и таймаутами из настроек; overrides — для тестов и бенчмарков."""
+    http2 = settings.LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+    options = dict(
+        http2=http2,
+        timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        ),
+    )
+    options.update(overrides)
+    return httpx.AsyncClient(**options)
+
+def get_llm_client() -> httpx.AsyncClient:
+    global _llm_client
+    if _llm_client is None or _llm_client.is_closed:
+        _llm_client = _new_llm_client()
+    return _llm_client
+
+async def _warm_endpoint(endpoint: str):
+    parts = urlsplit(endpoint)
+    try:
+        await get_llm_client().head(f"{parts.scheme}://{parts.netloc}/")
+    except httpx.HTTPError as e:
+        print(f"DEBUG: не удалось прогреть соединение с {parts.netloc}: {e}")
+
+async def warm_llm_client():
+    """Заранее открывает соединения (TCP+TLS, а с h2 — и HTTP/2) ко всем настроенным API, чтобы первый запрос их не ждал."""
+    await asyncio.gather(*(_warm_endpoint(b.endpoint) for b in _BACKENDS if b.configured()))
+
+async def close_llm_client():
+    global _llm_client
+    if _llm_client is not None and not _llm_client.is_closed:
+        await _llm_client.aclose()
+    _llm_client = None
+
+# Кэш ответов: одинаковый запрос (тот же файл, тот же вопрос) не идёт в сеть повторно.
+# Память — LRU на LLM_CACHE_SIZE записей, при LLM_CACHE_PATH ещё и SQLite-файл, переживающий рестарт.
+_response_cache = TTLCache(settings.LLM_CACHE_SIZE, settings.LLM_CACHE_TTL)
+_disk_cache: SQLiteCache | None = None
+_cache_counters = {"disk_hits": 0, "bypassed": 0, "rejected": 0}
+
+def _get_disk_cache() -> SQLiteCache | None:
+    global _disk_cache
+    if _disk_cache is None and settings.LLM_CACHE_PATH:
+        _disk_cache = SQLiteCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL, table="llm_responses")
+    return _disk_cache
+
+def _cache_key(model: str, messages: list, temperature: float, max_tokens: int, response_format: dict | None = None) -> str:
+    request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+    if response_format is not None:
+        request["response_format"] = response_format
+    raw = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def llm_cache_stats() -> dict:
+    """Счётчики кэша ответов: hits — из памяти, disk_hits — из файла, misses — ушло в сеть, rejected — не прошло проверку."""
+    stats = _response_cache.stats()
+    stats["misses"] -= _cache_counters["disk_hits"]
+    return {**stats, **_cache_counters}
+
+class LLMQueueFull(Exception):
+    """Очередь запросов к LLM переполнена (или ждать слишком долго) — запрос отклонён, повторить позже."""
+
+
+# Приоритеты: меньше — важнее. Вопросы пользователя обслуживаются раньше анализа метрик.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+class LLMScheduler:
+    """
+    Планировщик запросов к LLM: не больше max_concurrency запросов в сети одновременно,
+    остальные ждут в очередях по пользователям. Свободный слот получает первый по приоритету
+    уровень, а внутри уровня пользователи обслуживаются по кругу — один активный пользователь
+    не может занять все слоты. Очереди ограничены: сверх max_per_user запросов одного пользователя
+    или max_queued всего — LLMQueueFull; дольше timeout секунд в очереди — тоже LLMQueueFull.
+    """
+
+    def __init__(self, max_concurrency: int, max_per_user: int, max_queued: int, timeout: float = 0):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._active = 0
+        # приоритет -> {пользователь -> очередь ожидающих future}; порядок ключей — очередь обхода по кругу
+        self._queues: dict[int, OrderedDict] = {}
+        self._queued = 0
+        self._waits = deque(maxlen=1000)
+        self.served = 0
+        self.rejected = 0
+
+    def _user_queued(self, user_key) -> int:
+        return sum(len(users.get(user_key, ())) for users in self._queues.values())
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_key, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user_key)
+                else:
+                    del users[user_key]
+                self._queued -= 1
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            # слот передаётся ожидающему сразу, чтобы его не перехватил новый запрос
+            self._active += 1
+            waiter.set_result(None)
+
+    async def _acquire(self, user_key, priority: int):
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            self._waits.append(0.0)
+            return
+        if self._queued >= self.max_queued or self._user_queued(user_key) >= self.max_per_user:
+            self.rejected += 1
+            raise LLMQueueFull("Слишком много запросов к ИИ, попробуйте через минуту.")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(user_key, deque()).append(waiter)
+        self._queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # слот успели выдать в момент отмены — возвращаем его
+                self._release()
+            else:
+                self._remove(waiter, priority, user_key)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise LLMQueueFull("ИИ сейчас перегружен, попробуйте через минуту.") from None
+            raise
+        self._waits.append(time.monotonic() - started)
+
+    def _remove(self, waiter: asyncio.Future, priority: int, user_key):
+        users = self._queues.get(priority, {})
+        waiters = users.get(user_key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del users[user_key]
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_key=None, priority: int = PRIORITY_INTERACTIVE):
+        """Держит слот на время запроса к API: async with scheduler.slot(tg_id): ..."""
+        await self._acquire(user_key, priority)
+        self.served += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        """Загрузка и время ожидания в очереди (сек) по последним 1000 запросам."""
+        waits = sorted(self._waits)
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "served": self.served,
+            "rejected": self.rejected,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+_scheduler = LLMScheduler(
+    settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUED_PER_USER, settings.LLM_MAX_QUEUED, settings.LLM_QUEUE_TIMEOUT
+)
+
+def llm_scheduler_stats() -> dict:
+    return _scheduler.stats()
+
+async def _call_openrouter(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2,
+                           response_format: dict | None = None) -> str:
     headers = {
         "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -19,13 +227,15 @@ async def _call_openrouter(messages: list, model: str, max_tokens: int = 800, te
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(OPENROUTER_ENDPOINT, headers=headers, json=payload)
+    if response_format is not None:
+        payload["response_format"] = response_format
+    r = await get_llm_client().post(OPENROUTER_ENDPOINT, headers=headers, json=payload)
     r.raise_for_status()
     data = r.json()
     return data["choices"][0]["message"]["content"]
 
-async def _call_deepseek(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2) -> str:
+async def _call_deepseek(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2,
+                         response_format: dict | None = None) -> str:
     headers = {
         "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
         "Content-Type": "application/json",
@@ -36,16 +246,368 @@ async def _call_deepseek(messages: list, model: str, max_tokens: int = 800, temp
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(DEEPSEEK_ENDPOINT, headers=headers, json=payload)
+    if response_format is not None:
+        payload["response_format"] = response_format
+    r = await get_llm_client().post(DEEPSEEK_ENDPOINT, headers=headers, json=payload)
     r.raise_for_status()
     data = r.json()
     return data["choices"][0]["message"]["content"]
 
-async def analyze_metrics(prompt_text: str) -> str:
+async def _stream_sse(endpoint: str, api_key: str, messages: list, model: str, max_tokens: int, temperature: float):
+    """Потоковый запрос (stream: true): отдаёт куски ответа по мере генерации из Server-Sent Events."""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+    async with get_llm_client().stream("POST", endpoint, headers=headers, json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            # пустые строки разделяют события, строки с ":" — комментарии-keepalive (OpenRouter шлёт их, пока думает)
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if "error" in event:
+                raise RuntimeError(f"LLM API вернул ошибку в потоке: {event['error']}")
+            choices = event.get("choices") or []
+            piece = (choices[0].get("delta") or {}).get("content") if choices else None
+            if piece:
+                yield piece
+
+async def _stream_openrouter(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2):
+    async for piece in _stream_sse(OPENROUTER_ENDPOINT, settings.OPENROUTER_API_KEY, messages, model, max_tokens, temperature):
+        yield piece
+
+async def _stream_deepseek(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2):
+    async for piece in _stream_sse(DEEPSEEK_ENDPOINT, settings.DEEPSEEK_API_KEY, messages, model, max_tokens, temperature):
+        yield piece
+
+class LLMBackend:
+    """
+    Провайдер API и его здоровье: задержки последних успешных запросов и исходы последних запросов.
+    Автомат (circuit breaker): после LLM_BREAKER_FAILURES ошибок подряд или доли ошибок не меньше
+    LLM_BREAKER_ERROR_RATE бэкенд выключается на LLM_BREAKER_COOLDOWN секунд. Потом он снова пробуется,
+    и первая же ошибка выключает его обратно (счётчик ошибок подряд сбрасывает только успех).
+    """
+
+    WINDOW = 100
+    MIN_SAMPLES = 10
+
+    def __init__(self, name: str, endpoint: str, key_setting: str):
+        self.name = name
+        self.endpoint = endpoint
+        self.key_setting = key_setting
+        self._latencies = deque(maxlen=self.WINDOW)
+        self._outcomes = deque(maxlen=self.WINDOW)
+        self._failures_in_row = 0
+        self._open_until = 0.0
+
+    def configured(self) -> bool:
+        return bool(getattr(settings, self.key_setting, ""))
+
+    def model_for(self, model: str) -> str:
+        # у DeepSeek API свои имена моделей, у OpenRouter — "провайдер/модель"
+        return settings.DEEPSEEK_MODEL if self.name == "deepseek" else model
+
+    def format_for(self, response_format: dict) -> dict:
+        # DeepSeek API понимает только JSON-режим без схемы; схему модель видит в промпте
+        if self.name == "deepseek" and response_format.get("type") == "json_schema":
+            return {"type": "json_object"}
+        return response_format
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._open_until
+
+    def latency(self, q: float) -> float | None:
+        """Квантиль q задержки успешных запросов (сек); None, пока замеров меньше MIN_SAMPLES."""
+        if len(self._latencies) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def record_success(self, seconds: float | None = None):
+        if seconds is not None:
+            self._latencies.append(seconds)
+        self._outcomes.append(True)
+        self._failures_in_row = 0
+
+    def record_failure(self):
+        self._outcomes.append(False)
+        self._failures_in_row += 1
+        tripped = self._failures_in_row >= settings.LLM_BREAKER_FAILURES or (
+            len(self._outcomes) >= self.MIN_SAMPLES and self.error_rate() >= settings.LLM_BREAKER_ERROR_RATE
+        )
+        if tripped:
+            self._open_until = time.monotonic() + settings.LLM_BREAKER_COOLDOWN
+            print(f"DEBUG: {self.name} выключен на {settings.LLM_BREAKER_COOLDOWN} с (ошибок подряд: {self._failures_in_row})")
+
+    async def call(self, messages: list, model: str, max_tokens: int, temperature: float,
+                   response_format: dict | None = None) -> str:
+        call = _call_openrouter if self.name == "openrouter" else _call_deepseek
+        extra = {} if response_format is None else {"response_format": self.format_for(response_format)}
+        return await call(messages, model=self.model_for(model), max_tokens=max_tokens, temperature=temperature, **extra)
+
+    def stream(self, messages: list, model: str, max_tokens: int, temperature: float):
+        stream = _stream_openrouter if self.name == "openrouter" else _stream_deepseek
+        return stream(messages, model=self.model_for(model), max_tokens=max_tokens, temperature=temperature)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "available": self.available(),
+            "p50": self.latency(0.5),
+            "p95": self.latency(0.95),
+            "error_rate": self.error_rate(),
+        }
+
+# Порядок — предпочтение по умолчанию (как раньше: OpenRouter, если задан ключ, иначе DeepSeek)
+_BACKENDS = [
+    LLMBackend("openrouter", OPENROUTER_ENDPOINT, "OPENROUTER_API_KEY"),
+    LLMBackend("deepseek", DEEPSEEK_ENDPOINT, "DEEPSEEK_API_KEY"),
+]
+
+def llm_backend_stats() -> list[dict]:
+    return [b.stats() for b in _BACKENDS if b.configured()]
+
+def _ranked_backends() -> list[LLMBackend]:
+    """
+    Настроенные бэкенды в порядке попыток: сначала исправные — по медиане задержки, когда замеров
+    хватает у всех, иначе в порядке _BACKENDS; в конце выключенные автоматом (вдруг уже ожили).
+    """
+    configured = [b for b in _BACKENDS if b.configured()]
+    healthy = [b for b in configured if b.available()]
+    if len(healthy) > 1 and all(b.latency(0.5) is not None for b in healthy):
+        healthy.sort(key=lambda b: b.latency(0.5))
+    broken = sorted((b for b in configured if not b.available()), key=lambda b: b._open_until)
+    return healthy + broken
+
+def _retriable(error: Exception) -> bool:
+    """Сбой провайдера (сеть, таймаут, 429/5xx, битый ответ) — можно повторить или уйти на другой бэкенд."""
+    if isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+        return code in (408, 429) or code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ValueError, KeyError, IndexError, RuntimeError))
+
+def _backoff(attempt: int) -> float:
+    # экспоненциальная задержка с полным джиттером, чтобы повторы разных запросов не шли залпом
+    return random.uniform(0, settings.LLM_RETRY_BACKOFF * 2 ** attempt)
+
+async def _attempt(backend: LLMBackend, messages: list, model: str, max_tokens: int, temperature: float,
+                   response_format: dict | None = None) -> str:
+    started = time.monotonic()
+    try:
+        answer = await backend.call(messages, model, max_tokens, temperature, response_format)
+    except Exception as e:
+        if _retriable(e):
+            backend.record_failure()
+        raise
+    backend.record_success(time.monotonic() - started)
+    return answer
+
+async def _hedged(primary: LLMBackend, secondary: LLMBackend, messages: list, model: str, max_tokens: int,
+                  temperature: float, response_format: dict | None = None, failed: list | None = None) -> str:
+    """
+    Запрос к primary; если он не ответил за свою p95 (пока замеров мало — за LLM_HEDGE_DELAY) или упал
+    раньше (например, быстрый 503), тот же запрос уходит в secondary. Берём первый успешный ответ, второй отменяем.
+    В failed дописываются бэкенды, которые действительно вернули ошибку.
+    """
+    delay = primary.latency(0.95) or settings.LLM_HEDGE_DELAY
+    tasks = {asyncio.create_task(_attempt(primary, messages, model, max_tokens, temperature, response_format)): primary}
+    try:
+        pending, error, hedged = set(tasks), None, False
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=None if hedged else delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+                if failed is not None:
+                    failed.append(tasks[task])
+            if hedged:
+                continue
+            if done:
+                if not _retriable(error):
+                    raise error
+                print(f"DEBUG: {primary.name} упал ({error!r}) — сразу пробуем {secondary.name}")
+            else:
+                print(f"DEBUG: {primary.name} не ответил за {delay:.1f} с — дублируем запрос в {secondary.name}")
+            task = asyncio.create_task(_attempt(secondary, messages, model, max_tokens, temperature, response_format))
+            tasks[task] = secondary
+            pending.add(task)
+            hedged = True
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _routed_call(messages: list, model: str, max_tokens: int, temperature: float,
+                       response_format: dict | None = None) -> str:
+    """
+    Запрос через роутер: бэкенды по _ranked_backends, при сбое — другой бэкенд сразу, тот же — после паузы
+    (_backoff), не больше LLM_RETRIES повторов и LLM_TIMEOUT_BUDGET секунд на всё. С LLM_HEDGE — через _hedged.
+    """
+    deadline = time.monotonic() + settings.LLM_TIMEOUT_BUDGET
+    failed, last_error = [], None
+    for attempt in range(settings.LLM_RETRIES + 1):
+        ranked = _ranked_backends()
+        if not ranked:
+            raise RuntimeError("Не задан ни один API-ключ LLM")
+        candidates = [b for b in ranked if b not in failed] or ranked
+        if candidates is ranked and failed:
+            await asyncio.sleep(_backoff(attempt - 1))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        backend = candidates[0]
+        hedge_with = candidates[1] if settings.LLM_HEDGE and len(candidates) > 1 else None
+        try:
+            if hedge_with is not None:
+                call = _hedged(backend, hedge_with, messages, model, max_tokens, temperature, response_format, failed)
+            else:
+                call = _attempt(backend, messages, model, max_tokens, temperature, response_format)
+            return await asyncio.wait_for(call, remaining)
+        except asyncio.TimeoutError:
+            # бюджет исчерпан — ждать дальше нельзя
+            backend.record_failure()
+            raise asyncio.TimeoutError(f"LLM не ответил за {settings.LLM_TIMEOUT_BUDGET} с") from None
+        except Exception as e:
+            if not _retriable(e):
+                raise
+            last_error = e
+            if hedge_with is None:
+                # _hedged сам дописывает в failed те бэкенды, что упали
+                failed.append(backend)
+            print(f"DEBUG: сбой LLM ({backend.name}, попытка {attempt + 1}): {e!r}")
+    raise last_error or asyncio.TimeoutError(f"LLM не ответил за {settings.LLM_TIMEOUT_BUDGET} с")
+
+async def _routed_stream(messages: list, model: str, max_tokens: int, temperature: float):
+    """
+    Потоковый запрос через роутер: сбой до первого куска — повтор на другом бэкенде, как в _routed_call;
+    после первого куска ответ уже показывается пользователю, поэтому ошибка просто пробрасывается.
+    """
+    failed, last_error = [], None
+    for attempt in range(settings.LLM_RETRIES + 1):
+        ranked = _ranked_backends()
+        if not ranked:
+            raise RuntimeError("Не задан ни один API-ключ LLM")
+        candidates = [b for b in ranked if b not in failed] or ranked
+        if candidates is ranked and failed:
+            await asyncio.sleep(_backoff(attempt - 1))
+        backend = candidates[0]
+        started = False
+        try:
+            async for piece in backend.stream(messages, model, max_tokens, temperature):
+                started = True
+                yield piece
+            backend.record_success()
+            return
+        except Exception as e:
+            if not _retriable(e):
+                raise
+            backend.record_failure()
+            if started:
+                raise
+            last_error = e
+            failed.append(backend)
+            print(f"DEBUG: сбой потока LLM ({backend.name}, попытка {attempt + 1}): {e!r}")
+    raise last_error
+
+async def _cached_response(key: str, bypass_cache: bool) -> str | None:
+    """Ответ из кэша (память, затем файл); None — если его нет или bypass_cache=True."""
+    if bypass_cache:
+        _cache_counters["bypassed"] += 1
+        return None
+    cached = _response_cache.get(key)
+    disk = _get_disk_cache()
+    if cached is None and disk is not None:
+        cached = await run_light(disk.get, key)
+        if cached is not None:
+            _cache_counters["disk_hits"] += 1
+            _response_cache.set(key, cached)
+    return cached
+
+async def _store_response(key: str, answer: str):
+    _response_cache.set(key, answer)
+    disk = _get_disk_cache()
+    if disk is not None:
+        await run_light(disk.set, key, answer)
+
+async def _complete(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2,
+                    bypass_cache: bool = False, user_key=None, priority: int = PRIORITY_INTERACTIVE,
+                    response_format: dict | None = None, validate=None) -> str:
+    """
+    Запрос к активному API через кэш; bypass_cache=True — не читать кэш (свежий ответ всё равно сохраняется).
+    В сеть запрос идёт через планировщик: user_key — чья очередь (tg_id), priority — PRIORITY_*.
+    response_format — структурированный ответ (см. schemas.response_format).
+    validate(answer) — проверка ответа перед кэшированием: если она бросает исключение, ответ всё равно
+    возвращается (разбирает и сообщает об ошибке вызывающий), но в кэш не попадает.
+    """
+    key = _cache_key(model, messages, temperature, max_tokens, response_format)
+    cached = await _cached_response(key, bypass_cache)
+    if cached is not None:
+        return cached
+
+    async with _scheduler.slot(user_key, priority):
+        answer = await _routed_call(messages, model, max_tokens, temperature, response_format)
+    if validate is not None:
+        try:
+            validate(answer)
+        except Exception as e:
+            _cache_counters["rejected"] += 1
+            print(f"DEBUG: ответ LLM не прошёл проверку и не кэшируется: {e!r}")
+            return answer
+    await _store_response(key, answer)
+    return answer
+
+async def _stream_complete(messages: list, model: str, max_tokens: int = 800, temperature: float = 0.2,
+                           bypass_cache: bool = False, user_key=None, priority: int = PRIORITY_INTERACTIVE):
+    """Потоковый вариант _complete: тот же кэш; ответ из кэша отдаётся одним куском, недочитанный поток не кэшируется."""
+    key = _cache_key(model, messages, temperature, max_tokens)
+    cached = await _cached_response(key, bypass_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    # слот занят, пока читается поток
+    async with _scheduler.slot(user_key, priority):
+        async for piece in _routed_stream(messages, model, max_tokens, temperature):
+            parts.append(piece)
+            yield piece
+    await _store_response(key, "".join(parts))
+
+def _log_prompt_size(messages: list):
+    """Оценка размера промпта до отправки — чтобы видеть, во что обходится запрос."""
+    text = "\n".join(str(m.get("content", "")) for m in messages)
+    print(f"DEBUG: промпт LLM: {len(text)} символов, ~{estimate_tokens(text)} токенов")
+
+async def analyze_metrics(prompt_text: str, bypass_cache: bool = False, user_key=None,
+                          priority: int = PRIORITY_BACKGROUND, max_tokens: int = 800, schema=None) -> str:
     """
     Аналитические запросы: просим строгий JSON.
+    schema — модель из schemas.py: ответ запрашивается по её JSON-схеме (response_format),
+    разбирать его — schemas.parse_llm_json с той же моделью.
+    bypass_cache=True — не брать ответ из кэша, а спросить модель заново.
+    max_tokens — лимит ответа (для анализа загрузки целиком нужен ANALYSIS_MAX_TOKENS).
+    user_key (tg_id) и priority — очередь и приоритет в планировщике; при перегрузке — LLMQueueFull.
     """
+    _log_prompt_size([{"content": prompt_text}])
     # Мок-ответ, если нет ни одного ключа
     if not settings.DEEPSEEK_API_KEY and not getattr(settings, "OPENROUTER_API_KEY", ""):
         mock = {
@@ -53,6 +615,7 @@ async def analyze_metrics(prompt_text: str) -> str:
                 {"start_time": "10:00", "end_time": "11:30", "recommended_activity": "Deep work: complex tasks"},
                 {"start_time": "14:30", "end_time": "15:00", "recommended_activity": "Light tasks / admin"}
             ],
+            "full_report": "Mock full report: focus peaks at 10:00-11:30, stress rises after 16:00.",
             "day_plan": "10:00-11:30 deep work; 12:30-13:00 lunch; 14:30-15:00 light tasks; sleep before 23:00",
             "improvement_suggestions": [
                 "Do 5-min breathing every hour in the morning",
@@ -68,22 +631,77 @@ async def analyze_metrics(prompt_text: str) -> str:
     ]
 
     model = getattr(settings, "LLM_MODEL", DEFAULT_MODEL)
-    if getattr(settings, "OPENROUTER_API_KEY", ""):
-        return await _call_openrouter(messages, model=model)
-    return await _call_deepseek(messages, model=model)
+    if schema is None:
+        return await _complete(messages, model=model, max_tokens=max_tokens, bypass_cache=bypass_cache,
+                               user_key=user_key, priority=priority)
+    # в кэш идут только ответы, которые разбираются по схеме
+    return await _complete(messages, model=model, max_tokens=max_tokens, bypass_cache=bypass_cache,
+                           user_key=user_key, priority=priority, response_format=schema_response_format(schema),
+                           validate=lambda answer: parse_llm_json(answer, schema, count=False))
 
 
-async def chat_with_llm(messages: list, model: str | None = None, max_tokens: int = 800, temperature: float = 0.2) -> str:
+async def chat_with_llm(messages: list, model: str | None = None, max_tokens: int = 800, temperature: float = 0.2,
+                       bypass_cache: bool = False, user_key=None, priority: int = PRIORITY_INTERACTIVE) -> str:
     """
     Универсальный чат без навязывания JSON-формата. Сообщения должны включать системное сообщение при необходимости.
+    bypass_cache=True — не брать ответ из кэша, а спросить модель заново.
+    user_key (tg_id) и priority — очередь и приоритет в планировщике; при перегрузке — LLMQueueFull.
+    """
+    _log_prompt_size(messages)
+    if not settings.DEEPSEEK_API_KEY and not getattr(settings, "OPENROUTER_API_KEY", ""):
+        return _mock_chat_answer(messages)
+
+    use_model = model or getattr(settings, "LLM_MODEL", DEFAULT_MODEL)
+    return await _complete(messages, model=use_model, max_tokens=max_tokens, temperature=temperature,
+                           bypass_cache=bypass_cache, user_key=user_key, priority=priority)
+
+
+async def stream_chat_with_llm(messages: list, model: str | None = None, max_tokens: int = 800, temperature: float = 0.2,
+                               bypass_cache: bool = False, user_key=None, priority: int = PRIORITY_INTERACTIVE):
+    """
+    То же, что chat_with_llm, но async-генератор: отдаёт ответ кусками по мере генерации (stream: true),
+    чтобы бот мог показывать текст, не дожидаясь конца ответа.
     """
+    _log_prompt_size(messages)
     if not settings.DEEPSEEK_API_KEY and not getattr(settings, "OPENROUTER_API_KEY", ""):
-        # мок для Q&A: возвращаем простой текст
-        # берем последнее пользовательское сообщение и возвращаем заглушку
-        user_last = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "Ваш вопрос принят." )
-        return f"(мок) Я понял ваш вопрос: {user_last[:100]}... Дам развернутый ответ при наличии API-ключа."
+        yield _mock_chat_answer(messages)
+        return
 
     use_model = model or getattr(settings, "LLM_MODEL", DEFAULT_MODEL)
-    if getattr(settings, "OPENROUTER_API_KEY", ""):
-        return await _call_openrouter(messages, model=use_model, max_tokens=max_tokens, temperature=temperature)
-    return await _call_deepseek(messages, model=use_model, max_tokens=max_tokens, temperature=temperature)
+    async for piece in _stream_complete(messages, model=use_model, max_tokens=max_tokens, temperature=temperature,
+                                        bypass_cache=bypass_cache, user_key=user_key, priority=priority):
+        yield piece
+
+
+async def summarize_dialog(summary: str, turns: list, user_key=None) -> str:
+    """
+    Сворачивает старые реплики диалога (вместе с прежним кратким содержанием) в новое краткое содержание
+    для ChatHistory. Идёт с фоновым приоритетом; без API-ключей — простая выжимка без LLM.
+    """
+    if not settings.DEEPSEEK_API_KEY and not getattr(settings, "OPENROUTER_API_KEY", ""):
+        return _mock_summary(summary, turns)
+
+    dialog = "\n".join(f"{'Пользователь' if t['role'] == 'user' else 'Ассистент'}: {t['content']}" for t in turns)
+    messages = [
+        {"role": "system", "content": (
+            "Ты сжимаешь историю диалога пользователя с ассистентом по нейрофизиологии. "
+            "Сохрани факты о пользователе, его вопросы и главные выводы ответов. "
+            "Пиши на русском, обычным текстом, не длиннее 5 предложений."
+        )},
+        {"role": "user", "content": (f"Прежнее краткое содержание:\n{summary}\n\n" if summary else "") + f"Новые реплики:\n{dialog}"},
+    ]
+    return await chat_with_llm(messages, max_tokens=settings.CHAT_SUMMARY_TOKENS, temperature=0.0,
+                               user_key=user_key, priority=PRIORITY_BACKGROUND)
+
+
+def _mock_summary(summary: str, turns: list) -> str:
+    questions = [t["content"][:100] for t in turns if t.get("role") == "user"]
+    text = " ".join(filter(None, [summary, "Пользователь спрашивал: " + "; ".join(questions) + "."]))
+    return text[-600:]
+
+
+def _mock_chat_answer(messages: list) -> str:
+    # мок для Q&A: возвращаем простой текст
+    # берем последнее пользовательское сообщение и возвращаем заглушку
+    user_last = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "Ваш вопрос принят." )
+    return f"(мок) Я понял ваш вопрос: {user_last[:100]}... Дам развернутый ответ при наличии API-ключа."
@@ -2,8 +2,8 @@ from datetime import datetime, date, time, timezone
 from typing import List
 
 from sqlalchemy import (
-    Integer, String, Text, Date, Time, DateTime, Numeric,
-    BigInteger, ForeignKey
+    Integer, SmallInteger, String, Text, Date, Time, DateTime, Numeric, Float,
+    BigInteger, ForeignKey, UniqueConstraint, Index, Table, Column
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -33,6 +33,10 @@ class User(Base):
 # 🔹 Метрики (соответствуют NUMERIC_MAP в utils.py и обращениям в боте)
 class Metric(Base):
     __tablename__ = "metrics"
+    # одна строка на пользователя и момент времени: повторные выгрузки с перекрытием не дублируют данные.
+    # Этот же индекс обслуживает все чтения "метрики пользователя по времени" (WHERE user_id ORDER BY timestamp),
+    # в т.ч. на секционированной таблице (см. create_tables.py --partition-monthly)
+    __table_args__ = (Index("uq_metrics_user_timestamp", "user_id", "timestamp", unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"))
@@ -60,6 +64,62 @@ class Metric(Base):
     user: Mapped["User"] = relationship(back_populates="metrics")
 
 
+# 🔹 Агрегаты метрик по пользователю за час и за день: для длинной истории вместо сырых строк.
+# Пересчитываются при записи метрик (crud.refresh_metric_rollups) и скриптом backfill_rollups.py.
+# На каждую метрику: сумма, минимум, максимум и число непустых значений (среднее = sum / n);
+# rows — сколько строк метрик попало в интервал
+ROLLUP_METRICS = [col.name for col in Metric.__table__.columns if col.name not in ("id", "user_id", "timestamp")]
+
+
+def _rollup_columns() -> list:
+    columns = [Column("rows", Integer, nullable=False, default=0)]
+    for key in ROLLUP_METRICS:
+        columns += [
+            Column(f"{key}_sum", Float, nullable=True),
+            Column(f"{key}_min", Float, nullable=True),
+            Column(f"{key}_max", Float, nullable=True),
+            Column(f"{key}_n", Integer, nullable=False, default=0),
+        ]
+    return columns
+
+
+class MetricHourly(Base):
+    __table__ = Table(
+        "metrics_hourly", Base.metadata,
+        Column("user_id", ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True),
+        Column("bucket", DateTime, primary_key=True),  # начало часа
+        *_rollup_columns(),
+    )
+
+
+class MetricDaily(Base):
+    __table__ = Table(
+        "metrics_daily", Base.metadata,
+        Column("user_id", ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True),
+        Column("bucket", Date, primary_key=True),
+        *_rollup_columns(),
+    )
+
+
+# 🔹 Загруженные файлы метрик (для распознавания повторной отправки того же файла)
+class MetricUpload(Base):
+    __tablename__ = "metric_uploads"
+    __table_args__ = (UniqueConstraint("user_id", "content_hash", name="uq_metric_uploads_user_hash"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"))
+    file_unique_id: Mapped[str] = mapped_column(String(64), nullable=True, index=True)  # file_unique_id из Telegram
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # sha256 содержимого файла
+    file_name: Mapped[str] = mapped_column(String(255), nullable=True)
+    rows_count: Mapped[int] = mapped_column(Integer, default=0)
+    first_timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    report_text: Mapped[str] = mapped_column(Text, nullable=True)  # готовый отчёт, отдаётся при повторной загрузке
+    # результат анализа одним запросом (JSON): productivity_periods, full_report, day_plan, improvement_suggestions
+    analysis_json: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now())
+
+
 # 🔹 Периоды продуктивности
 class ProductivityPeriod(Base):
     __tablename__ = "productivity_periods"
@@ -94,3 +154,29 @@ class ImprovementSuggestion(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"))
     suggestion_text: Mapped[str] = mapped_column(Text)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now())
+
+
+# 🔹 Счётчики строк для /db_stats (режим "counters", см. app/stats.py): ведутся триггерами PostgreSQL,
+# которые ставит create_tables.py --stats-counters. У таблицы несколько строк-слотов (по соединению),
+# чтобы параллельные загрузки не ждали блокировку одной строки; число строк — сумма по слотам
+COUNTER_SLOTS = 16
+# таблицы, которые показывает /db_stats
+STATS_COUNTED_TABLES = ("users", "metrics", "productivity_periods", "daily_recommendations", "improvement_suggestions")
+
+
+class TableCounter(Base):
+    __tablename__ = "table_counters"
+
+    table_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    slot: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    rows: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+# 🔹 Метрики по пользователям без сканирования metrics (тоже ведётся триггером)
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    metrics_rows: Mapped[int] = mapped_column(BigInteger, default=0)
+    first_timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True)
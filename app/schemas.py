@@ -0,0 +1,133 @@
+#типизированные ответы LLM: JSON-схема для response_format и разбор ответа за один проход (orjson) с починкой как запасным путём
+import json
+import re
+import time
+from typing import List
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json, медленнее
+    orjson = None
+
+
+# разбор загрузки метрик (периоды считаются локально, см. analytics.py); пропущенное поле — пустое.
+# Докстринги у моделей не пишем: pydantic отправил бы их в схему как description
+class UploadAnalysis(BaseModel):
+    full_report: str = ""
+    day_plan: str = ""
+    improvement_suggestions: List[str] = []
+
+
+class DayPlanResponse(BaseModel):
+    day_plan: str
+
+
+class ImprovementSuggestionsResponse(BaseModel):
+    improvement_suggestions: List[str]
+
+
+def _strict(schema: dict) -> dict:
+    """Строгая схема (strict: true у OpenAI-совместимых API): все поля обязательны, лишние запрещены."""
+    if schema.get("type") == "object" and "properties" in schema:
+        schema["required"] = list(schema["properties"])
+        schema["additionalProperties"] = False
+        for prop in schema["properties"].values():
+            prop.pop("title", None)
+            prop.pop("default", None)
+            _strict(prop)
+    if isinstance(schema.get("items"), dict):
+        _strict(schema["items"])
+    for sub in schema.get("$defs", {}).values():
+        _strict(sub)
+    schema.pop("title", None)
+    return schema
+
+
+def response_format(model: type[BaseModel]) -> dict:
+    """response_format для chat/completions: ответ по JSON-схеме модели."""
+    schema = model.model_json_schema() if hasattr(model, "model_json_schema") else model.schema()
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "strict": True, "schema": _strict(schema)},
+    }
+
+
+# parsed — разобрано с первого прохода, repaired — понадобилась починка, failed — не разобрано совсем;
+# repair_seconds — сколько всего времени ушло на починку
+_json_counters = {"parsed": 0, "repaired": 0, "failed": 0, "repair_seconds": 0.0}
+
+
+def llm_json_stats() -> dict:
+    return dict(_json_counters)
+
+
+def _loads(text: str):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def _repair_json(raw: str):
+    """
+    Починка ответа, который не разобрался как есть: markdown-блоки, текст вокруг объекта,
+    многоточия, висящие запятые, «умные» и одинарные кавычки. Бросает json.JSONDecodeError.
+    """
+    cleaned = raw.strip()
+
+    # убираем markdown-блоки ```json ... ```
+    if cleaned.startswith("```json"):
+        cleaned = cleaned[7:]
+    if cleaned.startswith("```"):
+        cleaned = cleaned[3:]
+    if cleaned.endswith("```"):
+        cleaned = cleaned[:-3]
+
+    # вырезаем от первой { до последней }
+    start = cleaned.find("{")
+    end = cleaned.rfind("}")
+    if start == -1 or end == -1:
+        raise json.JSONDecodeError("JSON object not found", raw, 0)
+    cleaned = cleaned[start:end + 1]
+
+    # многоточия, которые LLM вставляет при обрезке ответа
+    cleaned = re.sub(r"\.{2,5}", "", cleaned)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+
+    # частые ошибки: запятая перед } или ], лишние escape, «умные» и одинарные кавычки
+    fixed = re.sub(r",\s*([}\]])", r"\1", cleaned)
+    fixed = fixed.replace('\\"', '"')
+    fixed = fixed.replace("“", '"').replace("”", '"')
+    fixed = fixed.replace("'", '"')
+    return json.loads(fixed)
+
+
+def parse_llm_json(raw: str, model: type[BaseModel] | None = None, count: bool = True) -> dict:
+    """
+    JSON из ответа LLM: сначала один проход orjson (ответ по response_format обычно валиден),
+    и только если он не удался — _repair_json. С model результат проверяется по схеме
+    (pydantic ValidationError, если поля не те). count=False — не учитывать разбор в llm_json_stats
+    (проверка ответа перед кэшированием, вызывающий всё равно разберёт его сам).
+    """
+    counters = _json_counters if count else dict(_json_counters)
+    try:
+        data = _loads(raw)
+        counters["parsed"] += 1
+    except ValueError:
+        started = time.perf_counter()
+        try:
+            data = _repair_json(raw)
+        except json.JSONDecodeError:
+            counters["failed"] += 1
+            raise
+        finally:
+            counters["repair_seconds"] += time.perf_counter() - started
+        counters["repaired"] += 1
+        if count:
+            print(f"DEBUG: JSON от LLM пришлось чинить ({counters['repaired']} раз с запуска)")
+    if model is not None:
+        validated = model.model_validate(data) if hasattr(model, "model_validate") else model.parse_obj(data)
+        data = {**data, **(validated.model_dump() if hasattr(validated, "model_dump") else validated.dict())}
+    return data
@@ -0,0 +1,147 @@
+#статистика для /db_stats без полного чтения metrics: точный подсчёт одним запросом,
+#оценка по pg_class.reltuples или счётчики, которые ведут триггеры (create_tables.py --stats-counters)
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, case, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .models import User, UserStats, MetricUpload, TableCounter, STATS_COUNTED_TABLES
+
+# exact — count(*) по всем таблицам одним запросом (metrics читается целиком);
+# estimate — оценка планировщика из pg_class (обновляется ANALYZE/autovacuum);
+# counters — точные числа из table_counters, без чтения самих таблиц
+STATS_MODES = ("exact", "estimate", "counters")
+
+# окна для скорости загрузки, часов
+INGEST_WINDOWS = (24, 7 * 24)
+
+# по секциям metrics тоже; у таблицы, которую ещё ни разу не анализировали, reltuples = -1 — берём n_live_tup
+_ESTIMATE_SQL = text("""
+    SELECT coalesce(parent.relname, c.relname) AS table_name,
+           sum(CASE WHEN c.reltuples >= 0 THEN c.reltuples ELSE coalesce(s.n_live_tup, 0) END)::bigint AS row_count
+    FROM pg_class c
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+    LEFT JOIN pg_class parent ON parent.oid = i.inhparent
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.relkind = 'r'
+      AND coalesce(parent.oid, c.oid) IN (SELECT to_regclass(t) FROM unnest(CAST(:tables AS text[])) AS t)
+    GROUP BY 1
+""")
+
+
+async def _exact_counts(session: AsyncSession) -> dict:
+    counts = ", ".join(f"(SELECT count(*) FROM {table}) AS {table}" for table in STATS_COUNTED_TABLES)
+    res = await session.execute(text(f"SELECT {counts}"))
+    return {table: int(value or 0) for table, value in res.one()._mapping.items()}
+
+
+async def _estimated_counts(session: AsyncSession) -> dict:
+    res = await session.execute(_ESTIMATE_SQL, {"tables": list(STATS_COUNTED_TABLES)})
+    found = {name: int(value) for name, value in res.all()}
+    return {table: found.get(table, 0) for table in STATS_COUNTED_TABLES}
+
+
+async def _counter_values(session: AsyncSession) -> dict | None:
+    """Суммы по слотам table_counters; None, если счётчики не установлены."""
+    res = await session.execute(
+        select(TableCounter.table_name, func.sum(TableCounter.rows)).group_by(TableCounter.table_name)
+    )
+    found = {name: int(value or 0) for name, value in res.all()}
+    if not set(STATS_COUNTED_TABLES) <= set(found):
+        return None
+    return {table: found[table] for table in STATS_COUNTED_TABLES}
+
+
+async def table_counts(session: AsyncSession, mode: str | None = None) -> tuple[dict, str]:
+    """
+    Число строк по таблицам STATS_COUNTED_TABLES и режим, которым оно получено.
+    Без PostgreSQL estimate и counters сводятся к exact; counters без установленных счётчиков — к estimate.
+    """
+    mode = mode or settings.DB_STATS_MODE
+    if mode not in STATS_MODES:
+        raise ValueError(f"Неизвестный режим статистики: {mode!r} (ожидается одно из {', '.join(STATS_MODES)})")
+    conn = await session.connection()
+    if conn.dialect.name != "postgresql":
+        mode = "exact"
+    if mode == "counters":
+        counts = await _counter_values(session)
+        if counts is not None:
+            return counts, mode
+        print("DEBUG: счётчики строк не установлены (create_tables.py --stats-counters) — беру оценку")
+        mode = "estimate"
+    if mode == "estimate":
+        return await _estimated_counts(session), mode
+    return await _exact_counts(session), mode
+
+
+async def _counted_users(session: AsyncSession, limit: int) -> list[dict]:
+    res = await session.execute(
+        select(User.telegram_id, User.name, UserStats.metrics_rows, UserStats.first_timestamp, UserStats.last_timestamp)
+        .join(UserStats, UserStats.user_id == User.user_id)
+        .order_by(UserStats.metrics_rows.desc())
+        .limit(limit)
+    )
+    return [
+        {"telegram_id": tg_id, "name": name, "rows": int(rows), "first": first, "last": last}
+        for tg_id, name, rows, first, last in res.all()
+    ]
+
+
+async def _uploaded_users(session: AsyncSession, limit: int) -> list[dict]:
+    rows = func.sum(MetricUpload.rows_count).label("rows")
+    res = await session.execute(
+        select(User.telegram_id, User.name, rows, func.min(MetricUpload.first_timestamp), func.max(MetricUpload.last_timestamp))
+        .join(MetricUpload, MetricUpload.user_id == User.user_id)
+        .group_by(User.user_id, User.telegram_id, User.name)
+        .order_by(rows.desc())
+        .limit(limit)
+    )
+    return [
+        {"telegram_id": tg_id, "name": name, "rows": int(rows or 0), "first": first, "last": last}
+        for tg_id, name, rows, first, last in res.all()
+    ]
+
+
+async def user_breakdown(session: AsyncSession, limit: int | None = None) -> tuple[list[dict], str]:
+    """
+    Пользователи с наибольшим числом метрик и источник чисел: "counters" — строки metrics по user_stats
+    (если счётчики установлены), иначе "uploads" — сумма строк в загруженных файлах
+    (metric_uploads; повторы меток в ней не вычтены).
+    """
+    limit = limit or settings.DB_STATS_TOP_USERS
+    users = await _counted_users(session, limit)
+    if users:
+        return users, "counters"
+    return await _uploaded_users(session, limit), "uploads"
+
+
+async def ingest_rate(session: AsyncSession, now: datetime | None = None) -> dict:
+    """Загрузки и строки в них за последние INGEST_WINDOWS часов (по metric_uploads, одним запросом)."""
+    now = now or datetime.now()
+    columns = []
+    for hours in INGEST_WINDOWS:
+        recent = MetricUpload.created_at >= bindparam(f"since_{hours}", now - timedelta(hours=hours))
+        columns += [
+            func.sum(case((recent, 1), else_=0)),
+            func.sum(case((recent, MetricUpload.rows_count), else_=0)),
+        ]
+    values = (await session.execute(select(*columns))).one()
+    result = {}
+    for i, hours in enumerate(INGEST_WINDOWS):
+        uploads, rows = int(values[2 * i] or 0), int(values[2 * i + 1] or 0)
+        result[hours] = {"uploads": uploads, "rows": rows, "rows_per_hour": rows / hours}
+    return result
+
+
+async def collect_stats(session: AsyncSession, mode: str | None = None) -> dict:
+    """Всё для /db_stats: число строк по таблицам, пользователи с наибольшим объёмом метрик, скорость загрузки."""
+    counts, used_mode = await table_counts(session, mode)
+    users, users_source = await user_breakdown(session)
+    return {
+        "mode": used_mode,
+        "counts": counts,
+        "users": users,
+        "users_source": users_source,
+        "ingest": await ingest_rate(session),
+    }
@@ -0,0 +1,115 @@
+#потоковый вывод ответа LLM в Telegram: сообщение правится по мере генерации, не чаще лимитов Telegram на правки
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+from .config import settings
+
+# Telegram ограничивает сообщение 4096 символами, причём считает в UTF-16 (эмодзи — за два),
+# поэтому режем с запасом
+MESSAGE_LIMIT = 4000
+CURSOR = " ▌"
+FINAL_RETRIES = 3
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Режет текст на куски не длиннее limit, по возможности по переводу строки или пробелу."""
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        pages.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    pages.append(text)
+    return pages
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    # в PTB 22 retry_after — секунды или timedelta, в зависимости от настроек библиотеки
+    delay = error.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+async def _edit(message, text: str, reply_markup=None):
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # текст не изменился (например, после transform) — для Telegram это ошибка, для нас нет
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def stream_to_message(message, chunks, prefix: str = "", transform=None, reply_markup=None,
+                            interval: float | None = None) -> str:
+    """
+    Показывает ответ из async-генератора chunks в сообщении message (обычно «Обрабатываю...»),
+    дописывая его правками не чаще раза в interval секунд (STREAM_EDIT_INTERVAL).
+    Текст длиннее лимита продолжается в новых сообщениях. transform — чистка текста перед показом
+    (применяется ко всему накопленному тексту), reply_markup ставится на последнее сообщение в конце.
+    Возвращает весь полученный текст без prefix и transform.
+    """
+    interval = settings.STREAM_EDIT_INTERVAL if interval is None else interval
+    messages = [message]
+    shown = [getattr(message, "text", None)]
+    parts = []
+
+    async def render(final: bool):
+        body = "".join(parts)
+        if transform is not None:
+            body = transform(body)
+        if not body and not final:
+            return
+        pages = split_message(prefix + (body or "(пустой ответ)"), MESSAGE_LIMIT)
+        if not final and len(pages[-1]) + len(CURSOR) <= MESSAGE_LIMIT:
+            pages[-1] += CURSOR
+        for i, page in enumerate(pages):
+            markup = reply_markup if final and i == len(pages) - 1 else None
+            if i < len(messages):
+                if page != shown[i] or markup is not None:
+                    await _edit(messages[i], page, markup)
+            else:
+                messages.append(await message.get_bot().send_message(
+                    chat_id=message.chat_id, text=page, reply_markup=markup
+                ))
+                shown.append(None)
+            shown[i] = page
+        if final:
+            # после transform текст мог стать короче — лишние продолжения удаляем
+            for extra in messages[len(pages):]:
+                try:
+                    await extra.delete()
+                except Exception:
+                    pass
+
+    next_edit = 0.0
+    try:
+        async for piece in chunks:
+            parts.append(piece)
+            now = time.monotonic()
+            if now < next_edit:
+                continue
+            try:
+                await render(final=False)
+                next_edit = time.monotonic() + interval
+            except RetryAfter as e:
+                # упёрлись в лимит правок — просто копим текст дальше
+                next_edit = now + _retry_seconds(e)
+    finally:
+        # если правка упала посреди ответа — сразу закрываем генератор (и освобождаем слот LLM)
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    for attempt in range(FINAL_RETRIES):
+        try:
+            await render(final=True)
+            break
+        except RetryAfter as e:
+            if attempt == FINAL_RETRIES - 1:
+                raise
+            await asyncio.sleep(_retry_seconds(e))
+    return "".join(parts)
@@ -1,5 +1,9 @@
 #парсим файл в строки и собираем текст-промпт для LLM
+import io
+import re
+import numpy as np
 import pandas as pd
+from collections.abc import Sequence
 from datetime import datetime, timezone
 from typing import List, Dict
 
@@ -37,9 +41,186 @@ CSV_MAP = {
     "anger": "anger"
 }
 
-def parse_metrics_file(path: str) -> tuple[List[Dict], str]:
+def _normalize_header(col) -> str:
+    """Нормализует заголовок колонки: нижний регистр, '_'/'-' → пробел, без BOM и лишних пробелов."""
+    raw = str(col).replace("\ufeff", "").strip().lower()
+    raw = raw.replace("_", " ").replace("-", " ")
+    return " ".join(raw.split())
+
+
+# Нормализованный заголовок → внутренний ключ (ключи CSV_MAP прогоняем через ту же нормализацию,
+# иначе 'self-control' никогда не совпадёт с нормализованным 'self control')
+_NORM_CSV_MAP = {_normalize_header(k): v for k, v in CSV_MAP.items()}
+# Внутренний ключ → нормализованный заголовок
+_KEY_TO_HEADER = {v: k for k, v in _NORM_CSV_MAP.items()}
+
+
+class MetricsColumns:
+    """
+    Колоночное представление метрик: timestamps — массив datetime64[ns],
+    values — {ключ NUMERIC_MAP: NumPy-массив int64/float64}, nulls — {ключ: bool-маска пустых значений}.
+    Маска нужна потому, что int-массив не умеет хранить NaN.
+    """
+
+    __slots__ = ("timestamps", "values", "nulls")
+
+    def __init__(self, timestamps: np.ndarray, values: Dict[str, np.ndarray], nulls: Dict[str, np.ndarray]):
+        self.timestamps = timestamps
+        self.values = values
+        self.nulls = nulls
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def take(self, index) -> "MetricsColumns":
+        """Срез / bool-маска / массив индексов по всем колонкам сразу."""
+        return MetricsColumns(
+            self.timestamps[index],
+            {k: v[index] for k, v in self.values.items()},
+            {k: m[index] for k, m in self.nulls.items()},
+        )
+
+    def unique_timestamps(self, keep_last: bool = False) -> "MetricsColumns":
+        """Оставляет по одной строке на временную метку (первую или последнюю), с точностью до мкс, как в БД."""
+        ts = self.timestamps.astype("datetime64[us]")
+        if keep_last:
+            _, index = np.unique(ts[::-1], return_index=True)
+            index = len(ts) - 1 - index
+        else:
+            _, index = np.unique(ts, return_index=True)
+        if len(index) == len(ts):
+            return self
+        return self.take(np.sort(index))
+
+    def column(self, key: str) -> np.ndarray:
+        """Колонка как float64 с NaN вместо пустых значений (удобно для расчётов)."""
+        arr = self.values[key].astype(np.float64)
+        arr[self.nulls[key]] = np.nan
+        return arr
+
+    def to_lists(self, start: int = 0, stop: int | None = None) -> Dict[str, list]:
+        """Python-списки по колонкам (None вместо пустых), timestamp → datetime."""
+        stop = len(self) if stop is None else stop
+        out = {"timestamp": self.timestamps[start:stop].astype("datetime64[us]").tolist()}
+        for key in NUMERIC_MAP:
+            vals = self.values[key][start:stop].tolist()
+            mask = self.nulls[key][start:stop].tolist()
+            out[key] = [None if m else v for v, m in zip(vals, mask)]
+        return out
+
+    @classmethod
+    def concat(cls, parts: List["MetricsColumns | None"]) -> "MetricsColumns":
+        """Склеивает несколько кусков (None пропускаются)."""
+        parts = [p for p in parts if p is not None]
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            np.concatenate([p.timestamps for p in parts]),
+            {k: np.concatenate([p.values[k] for p in parts]) for k in NUMERIC_MAP},
+            {k: np.concatenate([p.nulls[k] for p in parts]) for k in NUMERIC_MAP},
+        )
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict]) -> "MetricsColumns":
+        """Собирает колонки из списка словарей (формат старого parse_metrics_file)."""
+        df = pd.DataFrame(list(rows), columns=ALL_COLS)
+        return cls._from_frame(df, {key: key for key in NUMERIC_MAP})
+
+    @classmethod
+    def _from_frame(cls, df: pd.DataFrame, sources: Dict[str, str]) -> "MetricsColumns":
+        """sources: ключ NUMERIC_MAP → имя колонки в df. Отсутствующие колонки становятся пустыми."""
+        n = len(df)
+        values, nulls = {}, {}
+        for key, cast in NUMERIC_MAP.items():
+            col = sources.get(key)
+            if col is None or col not in df.columns:
+                values[key] = np.zeros(n, dtype=np.int64 if cast is int else np.float64)
+                nulls[key] = np.ones(n, dtype=bool)
+                continue
+            num = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            if cast is int:
+                # int(inf) невозможен — такие значения тоже считаем пустыми
+                mask = ~np.isfinite(num)
+                values[key] = np.where(mask, 0, num).astype(np.int64)
+            else:
+                mask = np.isnan(num)
+                values[key] = num
+            nulls[key] = mask
+        timestamps = pd.to_datetime(df["timestamp"], errors="coerce")
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+        return cls(timestamps.to_numpy(dtype="datetime64[ns]"), values, nulls)
+
+
+class MetricRows(Sequence):
     """
-    Парсит CSV/XLSX с метриками и возвращает (данные, статус)
+    Ленивое представление MetricsColumns в виде списка словарей
+    {"timestamp": datetime, "cognitive_score": int | None, ...}.
+    Словари строятся только при обращении, срез возвращает новое представление без копирования.
+    """
+
+    _BLOCK = 4096
+
+    def __init__(self, columns: MetricsColumns):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MetricRows(self.columns.take(index))
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("MetricRows index out of range")
+        lists = self.columns.to_lists(index, index + 1)
+        return {k: v[0] for k, v in lists.items()}
+
+    def __iter__(self):
+        # конвертируем блоками: .tolist() по колонке намного быстрее поэлементного доступа
+        for start in range(0, len(self), self._BLOCK):
+            lists = self.columns.to_lists(start, start + self._BLOCK)
+            keys = list(lists.keys())
+            for values in zip(*lists.values()):
+                yield dict(zip(keys, values))
+
+
+# Обязательные метрики: без них анализ не строим
+REQUIRED_METRICS = ["cognitive_score", "focus", "chill", "stress"]
+
+
+def _prepare_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, str | None]:
+    """Нормализует заголовки и приводит 'time' к 'timestamp'. Возвращает (df, ошибка или None)."""
+    normalized_columns = {_normalize_header(c): c for c in df.columns}
+    df = df.rename(columns={v: k for k, v in normalized_columns.items()})
+
+    if "timestamp" not in df.columns and "time" in df.columns:
+        df = df.rename(columns={"time": "timestamp"})
+
+    if "timestamp" not in df.columns:
+        return df, "file_error: Отсутствует колонка 'timestamp' или 'time'"
+    return df, None
+
+
+def _missing_required(df: pd.DataFrame) -> List[str]:
+    present_metrics = [_NORM_CSV_MAP.get(col, col) for col in df.columns if _NORM_CSV_MAP.get(col, col) in NUMERIC_MAP]
+    return [metric for metric in REQUIRED_METRICS if metric not in present_metrics]
+
+
+def _filled_required(df: pd.DataFrame, valid: np.ndarray) -> int:
+    """Число заполненных ячеек обязательных метрик в строках с корректным временем (notna, как и раньше)."""
+    return sum(
+        int(df[col].notna().to_numpy()[valid].sum())
+        for col in df.columns if _NORM_CSV_MAP.get(col, col) in REQUIRED_METRICS
+    )
+
+
+def parse_metrics_file(path: str) -> tuple[Sequence[Dict], str]:
+    """
+    Парсит CSV/XLSX с метриками и возвращает (данные, статус).
+    Данные — MetricRows (ленивый список словарей), колонки доступны через .columns.
     Конвертирует 'time'/'timestamp' в datetime (offset-naive, UTC).
     Поддерживает CSV с пробелами/дефисами в названиях колонок.
     """
@@ -51,109 +232,293 @@ def parse_metrics_file(path: str) -> tuple[List[Dict], str]:
     except Exception as e:
         return [], f"file_error: Ошибка чтения файла: {str(e)}"
 
-    # Нормализуем заголовки
-    def _norm(col: str) -> str:
-        raw = str(col).replace("\ufeff", "").strip().lower()
-        raw = raw.replace("_", " ").replace("-", " ")
-        raw = " ".join(raw.split())
-        return raw
-
-    normalized_columns = {_norm(c): c for c in df.columns}
-    df = df.rename(columns={v: k for k, v in normalized_columns.items()})
-
-    if "timestamp" not in df.columns and "time" in df.columns:
-        df = df.rename(columns={"time": "timestamp"})
-
-    if "timestamp" not in df.columns:
-        return [], "file_error: Отсутствует колонка 'timestamp' или 'time'"
+    df, error = _prepare_frame(df)
+    if error:
+        return [], error
 
     if len(df) == 0:
         return [], "file_error: Файл пустой"
 
-    # Парсим timestamp и делаем его timezone-naive (без часового пояса)
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    # Убираем timezone info если есть, делаем naive datetime
-    if df["timestamp"].dt.tz is not None:
-        df["timestamp"] = df["timestamp"].dt.tz_localize(None)
-    valid_timestamps = df.dropna(subset=["timestamp"])
-    if len(valid_timestamps) == 0:
+    # Векторный разбор: pd.to_numeric по колонкам, timestamp → naive datetime64
+    columns = MetricsColumns._from_frame(df, _KEY_TO_HEADER)
+    valid = ~np.isnat(columns.timestamps)
+    n_valid = int(valid.sum())
+    if n_valid == 0:
         return [], "file_error: Нет корректных временных меток"
 
     # Проверка обязательных метрик
-    required_metrics = ["cognitive_score", "focus", "chill", "stress"]
-    present_metrics = [CSV_MAP.get(col, col) for col in df.columns if CSV_MAP.get(col, col) in NUMERIC_MAP]
-    missing_metrics = [metric for metric in required_metrics if metric not in present_metrics]
+    missing_metrics = _missing_required(df)
     if missing_metrics:
         return [], f"incomplete_data: Отсутствуют обязательные метрики: {', '.join(missing_metrics)}"
 
-    if valid_timestamps["timestamp"].nunique() < 2:
+    if len(np.unique(columns.timestamps[valid])) < 2:
         return [], "incomplete_data: Недостаточно временных интервалов (минимум 2)"
 
-    total_cells = len(valid_timestamps) * len(required_metrics)
-    filled_cells = sum(valid_timestamps[col].notna().sum() for col in df.columns if CSV_MAP.get(col, col) in required_metrics)
-    if filled_cells / total_cells < 0.5:
+    total_cells = n_valid * len(REQUIRED_METRICS)
+    if _filled_required(df, valid) / total_cells < 0.5:
         return [], "incomplete_data: Слишком много пустых значений в метриках"
 
-    # Формируем итоговые строки
-    rows = []
-    for _, r in df.iterrows():
-        ts_naive = r["timestamp"]  # теперь offset-naive
-        item = {"timestamp": ts_naive}
-        for csv_col, key in CSV_MAP.items():
-            if csv_col in df.columns:
-                val = r[csv_col]
-                if pd.isna(val):
-                    item[key] = None
-                else:
-                    try:
-                        item[key] = NUMERIC_MAP[key](val)
-                    except Exception:
-                        try:
-                            item[key] = NUMERIC_MAP[key](float(val))
-                        except Exception:
-                            item[key] = None
-            else:
-                item[key] = None
-        rows.append(item)
+    # Строки без корректной временной метки не сохраняем
+    if n_valid < len(columns):
+        columns = columns.take(valid)
 
-    return rows, "success"
+    return MetricRows(columns), "success"
 
 
-def build_prompt_for_llm(user_name: str, metrics_rows: list, instruction: str, display_utc: bool = False, iaf_hz: float | None = None) -> str:
+def parse_metrics_chunk(df: pd.DataFrame, first: bool) -> tuple[MetricsColumns | None, int, str | None]:
     """
-    Формирует текст-подсказку для LLM на основе всех метрик пользователя.
-    display_utc: если True — выводит UTC, иначе локальное время.
+    Разбор одного куска файла. Возвращает (колонки строк с корректным временем,
+    число заполненных ячеек обязательных метрик, ошибка или None).
+    Заголовки и обязательные метрики проверяются только для первого куска.
+    """
+    df, error = _prepare_frame(df)
+    if first:
+        if error:
+            return None, 0, error
+        if len(df) == 0:
+            return None, 0, "file_error: Файл пустой"
+        missing_metrics = _missing_required(df)
+        if missing_metrics:
+            return None, 0, f"incomplete_data: Отсутствуют обязательные метрики: {', '.join(missing_metrics)}"
+
+    columns = MetricsColumns._from_frame(df, _KEY_TO_HEADER)
+    valid = ~np.isnat(columns.timestamps)
+    filled = _filled_required(df, valid)
+    if not valid.all():
+        columns = columns.take(valid)
+    return columns, filled, None
+
+
+def parse_metrics_csv_block(data: bytes, first: bool) -> tuple[MetricsColumns | None, int, str | None]:
+    """
+    Разбор куска CSV из байтов (строка заголовка + целые строки данных).
+    Функция уровня модуля — её можно отправить в пул процессов: обратно уходят только NumPy-массивы.
+    """
+    try:
+        df = pd.read_csv(io.BytesIO(data))
+    except Exception as e:
+        return None, 0, f"file_error: Ошибка чтения файла: {str(e)}"
+    return parse_metrics_chunk(df, first)
+
+
+def parse_metrics_excel_bytes(data: bytes) -> tuple[MetricsColumns | None, int, str | None]:
+    """XLSX потоково не читается — разбираем скачанный файл целиком (тоже в пуле процессов)."""
+    try:
+        df = pd.read_excel(io.BytesIO(data))
+    except Exception as e:
+        return None, 0, f"file_error: Ошибка чтения файла: {str(e)}"
+    return parse_metrics_chunk(df, first=True)
+
+
+class MetricsStreamState:
+    """
+    Накопительная проверка потокового разбора: заполненность обязательных метрик и число
+    различных временных меток считаются по мере поступления кусков, хвост файла хранится для промпта.
+    Итоговый статус ("success" / "file_error: ..." / "incomplete_data: ...") выставляет finish().
     """
-    lines = []
 
-    for m in metrics_rows:
-        ts = m["timestamp"]
+    def __init__(self, tail_rows: int | None = 0):
+        self.tail_rows = tail_rows
+        self.status: str | None = None
+        self.chunks = 0
+        self.rows_total = 0
+        self._filled = 0
+        self._first_ts = None
+        self._distinct = False
+        self._tail: MetricsColumns | None = None
+        self._ts_min = None
+        self._ts_max = None
+        # sha256 содержимого файла, если его считал тот, кто подавал байты (см. ingest)
+        self.content_hash: str | None = None
+
+    @property
+    def first_timestamp(self) -> datetime | None:
+        return pd.Timestamp(self._ts_min).to_pydatetime() if self._ts_min is not None else None
+
+    @property
+    def last_timestamp(self) -> datetime | None:
+        return pd.Timestamp(self._ts_max).to_pydatetime() if self._ts_max is not None else None
+
+    @property
+    def tail(self) -> Sequence[Dict]:
+        """Последние tail_rows корректных строк файла (для промпта); tail_rows=None — все строки."""
+        return MetricRows(self._tail) if self._tail is not None else []
 
-        # гарантируем что это Python datetime, а не pandas.Timestamp
-        if hasattr(ts, "to_pydatetime"):
-            ts = ts.to_pydatetime()
+    def fail(self, status: str):
+        self.status = status
 
-        if display_utc:
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=timezone.utc)  # считаем naive как UTC
-            t = ts.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    def add(self, columns: MetricsColumns, filled: int):
+        self.chunks += 1
+        self._filled += filled
+        if not len(columns):
+            return
+        self.rows_total += len(columns)
+        ts_min, ts_max = columns.timestamps.min(), columns.timestamps.max()
+        self._ts_min = ts_min if self._ts_min is None else min(self._ts_min, ts_min)
+        self._ts_max = ts_max if self._ts_max is None else max(self._ts_max, ts_max)
+
+        if not self._distinct:
+            if self._first_ts is None:
+                self._first_ts = columns.timestamps[0]
+            self._distinct = bool((columns.timestamps != self._first_ts).any())
+
+        if self.tail_rows is None:
+            self._tail = MetricsColumns.concat([self._tail, columns])
+        elif self.tail_rows > 0:
+            self._tail = MetricsColumns.concat([self._tail, columns]).take(slice(-self.tail_rows, None))
+
+    def finish(self) -> str:
+        if self.status is not None:
+            return self.status
+        if self.chunks == 0:
+            self.status = "file_error: Файл пустой"
+        elif self.rows_total == 0:
+            self.status = "file_error: Нет корректных временных меток"
+        elif not self._distinct:
+            self.status = "incomplete_data: Недостаточно временных интервалов (минимум 2)"
+        elif self._filled / (self.rows_total * len(REQUIRED_METRICS)) < 0.5:
+            self.status = "incomplete_data: Слишком много пустых значений в метриках"
         else:
-            if ts.tzinfo is None:
-                t = ts.strftime("%Y-%m-%d %H:%M")  # naive -> как есть
-            else:
-                t = ts.astimezone().strftime("%Y-%m-%d %H:%M")
+            self.status = "success"
+        return self.status
+
+
+def _format_timestamp(ts, display_utc: bool, fmt: str) -> str:
+    # гарантируем что это Python datetime, а не pandas.Timestamp
+    if hasattr(ts, "to_pydatetime"):
+        ts = ts.to_pydatetime()
 
-        pairs = [f"{k}:{m.get(k)}" for k in NUMERIC_MAP.keys()]
-        lines.append(f"{t} | " + ", ".join(pairs))
+    if display_utc:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)  # считаем naive как UTC
+        return ts.astimezone(timezone.utc).strftime(fmt)
+    if ts.tzinfo is None:
+        return ts.strftime(fmt)  # naive -> как есть
+    return ts.astimezone().strftime(fmt)
+
+
+def _format_compact_value(value, float_digits: int) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)  # Decimal из БД тоже сюда
+    if value != value:  # NaN
+        return ""
+    text = f"{value:.{float_digits}f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def encode_metrics_compact(metrics_rows, display_utc: bool = False, float_digits: int = 2) -> str:
+    """
+    Компактная таблица метрик для промпта: заголовок один раз, дальше TSV.
+    Дата выносится в строку "# YYYY-MM-DD" при смене дня, в строках только время HH:MM;
+    float округляются до float_digits знаков, пустые значения — пустая ячейка,
+    колонки, пустые во всех строках, не выводятся.
+    По сравнению с "время | ключ:значение, ..." это в разы меньше токенов.
+    """
+    rows = list(metrics_rows)
+    keys = [k for k in NUMERIC_MAP if any(m.get(k) is not None for m in rows)]
+    lines = ["time\t" + "\t".join(keys)]
+    day = None
+    for m in rows:
+        stamp = _format_timestamp(m["timestamp"], display_utc, "%Y-%m-%d %H:%M")
+        if stamp[:10] != day:
+            day = stamp[:10]
+            lines.append(f"# {day}")
+        values = [_format_compact_value(m.get(k), float_digits) for k in keys]
+        lines.append(stamp[11:] + "\t" + "\t".join(values))
+    return "\n".join(lines)
+
+
+def encode_rollups_compact(rollup_rows, grain: str, display_utc: bool = False, float_digits: int = 1) -> str:
+    """
+    Агрегаты (crud.get_metric_rollups) для промпта в том же виде, что encode_metrics_compact:
+    средние значения метрик за час или день плюс колонка n — сколько строк метрик в интервале.
+    У часов дата выносится в строку "# YYYY-MM-DD", у дней дата стоит в самой строке.
+    """
+    rows = list(rollup_rows)
+    keys = [k for k in NUMERIC_MAP if any(r.get(k) is not None for r in rows)]
+    lines = [("hour" if grain == "hour" else "day") + "\tn\t" + "\t".join(keys)]
+    day = None
+    for r in rows:
+        stamp = _format_timestamp(r["timestamp"], display_utc, "%Y-%m-%d %H:%M")
+        values = "\t".join(_format_compact_value(r.get(k), float_digits) for k in keys)
+        if grain == "hour":
+            if stamp[:10] != day:
+                day = stamp[:10]
+                lines.append(f"# {day}")
+            stamp = stamp[11:]
+        else:
+            stamp = stamp[:10]
+        lines.append(f"{stamp}\t{r['rows']}\t{values}")
+    return "\n".join(lines)
+
+
+# числа, слова, отдельные знаки и табуляции/переводы строк (в TSV они тоже стоят токенов)
+_TOKEN_RE = re.compile(r"\d+|[^\W\d_]+|[^\s]|[\t\n]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора: числа и слова режутся примерно по 3-4 символа
+    (кириллица дороже латиницы), каждый знак препинания, табуляция и перевод строки — отдельный токен.
+    Годится для сравнения вариантов промпта между собой, а не для точного биллинга.
+    """
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif piece[0].isalpha():
+            per_token = 4 if piece.isascii() else 3
+            tokens += (len(piece) + per_token - 1) // per_token
+        else:
+            tokens += 1
+    return tokens
+
+PROMPT_ENCODINGS = ("verbose", "compact")
+
+
+def build_prompt_for_llm(user_name: str, metrics_rows: list, instruction: str, display_utc: bool = False,
+                         iaf_hz: float | None = None, encoding: str = "verbose", history: dict | None = None) -> str:
+    """
+    Формирует текст-подсказку для LLM на основе всех метрик пользователя.
+    display_utc: если True — выводит UTC, иначе локальное время.
+    encoding: "verbose" — строка "время | ключ:значение, ..." на каждую запись,
+    "compact" — таблица encode_metrics_compact (заметно меньше токенов).
+    history: длинная история агрегатами {"hour": [...], "day": [...]} (crud.get_rollup_history) —
+    идёт отдельными таблицами encode_rollups_compact перед сырыми строками.
+    """
+    if encoding == "compact":
+        table_text = encode_metrics_compact(metrics_rows, display_utc=display_utc)
+        table_title = "Metrics (TSV with header; a '# YYYY-MM-DD' line starts each day, time is HH:MM, empty cell = no data):"
+    elif encoding == "verbose":
+        fmt = "%Y-%m-%d %H:%M UTC" if display_utc else "%Y-%m-%d %H:%M"
+        lines = []
+        for m in metrics_rows:
+            t = _format_timestamp(m["timestamp"], display_utc, fmt)
+            pairs = [f"{k}:{m.get(k)}" for k in NUMERIC_MAP.keys()]
+            lines.append(f"{t} | " + ", ".join(pairs))
+        table_text = "\n".join(lines)
+        table_title = "Metrics (time | key:value):"
+    else:
+        raise ValueError(f"Неизвестная кодировка промпта: {encoding!r} (ожидается одно из {', '.join(PROMPT_ENCODINGS)})")
 
-    table_text = "\n".join(lines)
+    history_text = ""
+    for grain, title in (("day", "Daily averages"), ("hour", "Hourly averages")):
+        rollups = (history or {}).get(grain)
+        if rollups:
+            history_text += (
+                f"{title} over the longer history (TSV; n = number of samples, values are means):\n"
+                + encode_rollups_compact(rollups, grain, display_utc=display_utc) + "\n\n"
+            )
 
     iaf_line = f"Individual Alpha Frequency (IAF): {iaf_hz:.2f} Hz\n" if iaf_hz is not None else ""
     prompt = f"""
 You analyze EEG/BCI metrics and produce actionable schedules.
 User: {user_name}
 {iaf_line}
-Metrics (time | key:value):
+{history_text}{table_title}
 {table_text}
 
 {instruction}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Заполнение часовых и дневных агрегатов (metrics_hourly / metrics_daily) по уже сохранённым метрикам:
+нужно один раз после обновления (новые загрузки бот агрегирует сам) и после ручных правок metrics.
+Запуск: python backfill_rollups.py [--user TELEGRAM_ID] [--since 2025-01-01] [--days-per-step 7]
+Нужен DATABASE_URL (PostgreSQL) в .env. Идёт по пользователям и окнам по --days-per-step дней,
+каждое окно — отдельная транзакция, так что скрипт можно прервать и запустить снова:
+агрегаты пересчитываются целиком, повторный прогон ничего не удваивает.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.crud import refresh_metric_rollups
+from app.models import User, Metric
+
+# Загружаем переменные окружения
+load_dotenv()
+
+
+async def backfill_user(session_factory, user_id: int, since: date | None, step: timedelta) -> int:
+    """Пересчитывает агрегаты пользователя окнами по step; возвращает число окон."""
+    async with session_factory() as session:
+        first, last = (await session.execute(
+            select(func.min(Metric.timestamp), func.max(Metric.timestamp)).where(Metric.user_id == user_id)
+        )).one()
+    if first is None:
+        return 0
+    if since is not None:
+        first = max(first, datetime.combine(since, datetime.min.time()))
+    window = datetime.combine(first.date(), datetime.min.time())
+    windows = 0
+    while window <= last:
+        async with session_factory() as session:
+            # конец окна включительно: последняя микросекунда перед следующим окном
+            await refresh_metric_rollups(session, user_id, window, window + step - timedelta(microseconds=1))
+            await session.commit()
+        window += step
+        windows += 1
+    return windows
+
+
+async def main(telegram_id: int | None, since: date | None, days_per_step: int):
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ Ошибка: DATABASE_URL не найден в .env файле")
+        return
+    if not database_url.startswith("postgresql"):
+        print("❌ Агрегаты ведутся только в PostgreSQL")
+        return
+
+    engine = create_async_engine(database_url, echo=False)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    step = timedelta(days=max(days_per_step, 1))
+    try:
+        async with session_factory() as session:
+            query = select(User.user_id, User.telegram_id, User.name).order_by(User.user_id)
+            if telegram_id is not None:
+                query = query.where(User.telegram_id == telegram_id)
+            users = (await session.execute(query)).all()
+        if not users:
+            print("⚠️ Пользователи не найдены")
+            return
+
+        started = time.perf_counter()
+        for user_id, tg_id, name in users:
+            t0 = time.perf_counter()
+            windows = await backfill_user(session_factory, user_id, since, step)
+            if windows:
+                print(f"📊 {name or tg_id}: {windows} окон по {step.days} дн. за {time.perf_counter() - t0:.1f} с")
+        print(f"✅ Агрегаты пересчитаны для {len(users)} пользователей за {time.perf_counter() - started:.1f} с")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заполнение часовых и дневных агрегатов метрик")
+    parser.add_argument("--user", type=int, default=None, help="telegram_id пользователя (по умолчанию — все)")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="пересчитывать начиная с даты (YYYY-MM-DD)")
+    parser.add_argument("--days-per-step", type=int, default=7, help="дней в одной транзакции")
+    args = parser.parse_args()
+    print("🚀 Заполняю агрегаты метрик...")
+    asyncio.run(main(args.user, args.since, args.days_per_step))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки запросов к LLM API: новый httpx.AsyncClient на каждый запрос (как было)
+и общий клиент с пулом соединений (llm_client.get_llm_client).
+Запуск: python bench_llm_client.py [запросов] [параллельно]   (по умолчанию 200 и 1)
+
+Запросы идут в локальный мок OpenAI-совместимого API (aiohttp) по HTTP и, если в системе
+есть openssl, по HTTPS с временным самоподписанным сертификатом — там особенно видна
+цена TLS-рукопожатия на каждом запросе. Настоящий API не вызывается, но настройки
+клиента (LLM_*) читаются из .env, поэтому нужен заполненный .env, как для бота.
+"""
+
+import asyncio
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from aiohttp import web
+
+from app.llm_client import _new_llm_client
+
+DEFAULT_REQUESTS = 200
+PAYLOAD = {
+    "model": "mock",
+    "messages": [{"role": "user", "content": "Проанализируй метрики"}],
+    "temperature": 0.4,
+}
+RESPONSE = {"choices": [{"message": {"role": "assistant", "content": "{\"productivity_periods\": []}"}}]}
+
+
+async def chat_completions(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response(RESPONSE)
+
+
+async def start_mock(ssl_context=None) -> tuple[web.AppRunner, int]:
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=ssl_context)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+def make_certificate(tmpdir: str) -> tuple[str, str] | None:
+    """Самоподписанный сертификат для 127.0.0.1; None — если openssl недоступен."""
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = os.path.join(tmpdir, "cert.pem"), os.path.join(tmpdir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+async def timed_post(client: httpx.AsyncClient, url: str) -> float:
+    t0 = time.perf_counter()
+    r = await client.post(url, json=PAYLOAD)
+    r.raise_for_status()
+    r.json()
+    return (time.perf_counter() - t0) * 1000
+
+
+async def per_request_client(url: str, verify) -> float:
+    # так было в _call_openrouter/_call_deepseek: новое соединение (и TLS) на каждый запрос
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(timeout=60, verify=verify) as client:
+        await timed_post(client, url)
+    return (time.perf_counter() - t0) * 1000
+
+
+async def run(n: int, concurrency: int, make_call) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await make_call()
+
+    return await asyncio.gather(*(one() for _ in range(n)))
+
+
+def describe(times: list[float]) -> str:
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    return f"{statistics.median(times):>8.2f} | {p95:>8.2f} | {sum(times) / len(times):>8.2f}"
+
+
+async def bench(name: str, url: str, verify, n: int, concurrency: int):
+    # прогрев: импорт, первый запрос к мок-серверу
+    await per_request_client(url, verify)
+
+    fresh = await run(n, concurrency, lambda: per_request_client(url, verify))
+
+    shared = _new_llm_client(verify=verify)
+    try:
+        await timed_post(shared, url)
+        pooled = await run(n, concurrency, lambda: timed_post(shared, url))
+        http_version = (await shared.post(url, json=PAYLOAD)).http_version
+    finally:
+        await shared.aclose()
+
+    print(f"{name:<6} | {'новый клиент':<22} | {describe(fresh)}")
+    print(f"{name:<6} | {'общий клиент, ' + http_version:<22} | {describe(pooled)}")
+
+
+async def main(n: int, concurrency: int):
+    print(f"{'схема':<6} | {'вариант':<22} | {'p50, мс':>8} | {'p95, мс':>8} | {'сред, мс':>8}")
+    print("-" * 66)
+
+    runner, port = await start_mock()
+    try:
+        await bench("http", f"http://127.0.0.1:{port}/v1/chat/completions", True, n, concurrency)
+    finally:
+        await runner.cleanup()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pair = make_certificate(tmpdir)
+        if pair is None:
+            print("⚠️ openssl не найден — HTTPS пропущен")
+            return
+        cert, key = pair
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(cert, key)
+        client_ctx = ssl.create_default_context(cafile=cert)
+        runner, port = await start_mock(server_ctx)
+        try:
+            await bench("https", f"https://127.0.0.1:{port}/v1/chat/completions", client_ctx, n, concurrency)
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS
+    parallel = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    print(f"🚀 Бенчмарк HTTP-клиента LLM: {requests_count} запросов, параллельно {parallel}...")
+    asyncio.run(main(requests_count, parallel))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записи метрик: бинарный COPY (asyncpg copy_records_to_table) против executemany.
+Запуск: python bench_metrics_insert.py [кол-во строк ...]   (по умолчанию 10000 100000 1000000)
+Нужен DATABASE_URL (PostgreSQL + asyncpg) в .env. Все вставки откатываются,
+временный пользователь удаляется в конце.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.models import User
+from app.utils import NUMERIC_MAP, MetricsColumns
+from app.crud import _copy_metric_rows, _executemany_metric_rows
+
+# Загружаем переменные окружения
+load_dotenv()
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def make_columns(n: int, step_seconds: int = 1, start: str = "2025-01-01T00:00:00") -> MetricsColumns:
+    """Синтетические метрики: раз в step_seconds секунд начиная со start, ~5% пустых значений."""
+    rng = np.random.default_rng(42)
+    timestamps = np.datetime64(start, "ns") + np.arange(n) * np.timedelta64(step_seconds, "s")
+    values, nulls = {}, {}
+    for key, cast in NUMERIC_MAP.items():
+        if cast is int:
+            values[key] = rng.integers(0, 100, n, dtype=np.int64)
+        else:
+            values[key] = rng.random(n).round(3)
+        nulls[key] = rng.random(n) < 0.05
+    return MetricsColumns(timestamps, values, nulls)
+
+
+async def timed_insert(session_factory, user_id: int, writer, columns: MetricsColumns) -> float:
+    async with session_factory() as session:
+        t0 = time.perf_counter()
+        await writer(session, user_id, columns)
+        elapsed = time.perf_counter() - t0
+        await session.rollback()
+    return elapsed
+
+
+async def main(sizes):
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ Ошибка: DATABASE_URL не найден в .env файле")
+        return
+    if "asyncpg" not in database_url:
+        print("❌ Для COPY нужен драйвер asyncpg (postgresql+asyncpg://...)")
+        return
+
+    engine = create_async_engine(database_url, echo=False)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async with session_factory() as session:
+        user = User(telegram_id=-int(time.time()), name="bench")
+        session.add(user)
+        await session.commit()
+        user_id = user.user_id
+
+    print(f"{'строк':>10} | {'COPY, с':>9} | {'executemany, с':>14} | {'ускорение':>9} | {'COPY строк/с':>12}")
+    print("-" * 66)
+    try:
+        for n in sizes:
+            columns = make_columns(n)
+            t_copy = await timed_insert(session_factory, user_id, _copy_metric_rows, columns)
+            t_many = await timed_insert(session_factory, user_id, _executemany_metric_rows, columns)
+            print(f"{n:>10} | {t_copy:>9.2f} | {t_many:>14.2f} | {t_many / t_copy:>8.1f}x | {n / t_copy:>12.0f}")
+    finally:
+        async with session_factory() as session:
+            await session.execute(delete(User).where(User.user_id == user_id))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    print("🚀 Бенчмарк записи метрик...")
+    asyncio.run(main(sizes))
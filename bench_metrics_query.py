@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк чтения метрик одного пользователя: без составного индекса (user_id, timestamp) и с ним.
+Запуск: python bench_metrics_query.py [строк у пользователя]   (по умолчанию 2000000)
+Нужен DATABASE_URL (PostgreSQL + asyncpg) в .env. Работает с обычной и с секционированной
+таблицей metrics (create_tables.py --partition-monthly) — что есть в БД, то и меряем.
+
+Всё выполняется в одной транзакции и откатывается в конце, но на время прогона индекс
+удаляется и таблица metrics заблокирована — не запускайте на рабочей БД под нагрузкой.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.models import User
+from app.crud import _copy_metric_rows
+from bench_metrics_insert import make_columns
+
+# Загружаем переменные окружения
+load_dotenv()
+
+DEFAULT_ROWS = 2_000_000
+# метрика раз в 10 секунд: 2 млн строк ≈ 8 месяцев, т.е. несколько помесячных секций
+STEP_SECONDS = 10
+# данные второго пользователя пишутся вперемешку, как при реальных загрузках
+LOAD_PARTS = 10
+REPEATS = 3
+
+QUERIES = [
+    ("последние 120 строк", "SELECT * FROM metrics WHERE user_id = :uid ORDER BY timestamp DESC LIMIT 120"),
+    ("один день", "SELECT * FROM metrics WHERE user_id = :uid AND timestamp >= :day AND timestamp < :day_end ORDER BY timestamp"),
+    ("вся история (get_user_metrics)", "SELECT * FROM metrics WHERE user_id = :uid ORDER BY timestamp"),
+]
+
+
+def scan_nodes(plan: dict) -> set[str]:
+    """Способы чтения таблицы в плане (Seq Scan / Index Scan / ...), по всем секциям."""
+    nodes = {plan["Node Type"]} if "Scan" in plan["Node Type"] else set()
+    for child in plan.get("Plans", []):
+        nodes |= scan_nodes(child)
+    return nodes
+
+
+async def explain_ms(session, sql: str, params: dict) -> tuple[float, str]:
+    """Медиана серверного времени выполнения (EXPLAIN ANALYZE, без передачи строк клиенту) и способ чтения."""
+    times, nodes = [], set()
+    for _ in range(REPEATS):
+        res = await session.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params)
+        plan = res.scalar()[0]
+        times.append(plan["Execution Time"])
+        nodes = scan_nodes(plan["Plan"])
+    return statistics.median(times), ", ".join(sorted(nodes))
+
+
+async def run_queries(session, params: dict) -> list[tuple[float, str]]:
+    await session.execute(text("ANALYZE metrics"))
+    return [await explain_ms(session, sql, params) for _, sql in QUERIES]
+
+
+async def main(n: int):
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ Ошибка: DATABASE_URL не найден в .env файле")
+        return
+    if "asyncpg" not in database_url:
+        print("❌ Для бенчмарка нужен PostgreSQL с драйвером asyncpg (postgresql+asyncpg://...)")
+        return
+
+    engine = create_async_engine(database_url, echo=False)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async with session_factory() as session:
+        try:
+            partitioned = (await session.execute(
+                text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('metrics')")
+            )).scalar()
+            print(f"📋 Таблица metrics: {'секционированная' if partitioned else 'обычная'}")
+
+            stamp = -int(time.time())
+            target = User(telegram_id=stamp, name="bench")
+            other = User(telegram_id=stamp - 1, name="bench-other")
+            session.add_all([target, other])
+            await session.flush()
+
+            t0 = time.perf_counter()
+            # с начала текущего месяца — туда же create_tables.py --partition-monthly создаёт секции
+            start_ts = date.today().replace(day=1).isoformat() + "T00:00:00"
+            target_columns = make_columns(n, step_seconds=STEP_SECONDS, start=start_ts)
+            other_columns = make_columns(n, step_seconds=STEP_SECONDS, start=start_ts)
+            part = -(-n // LOAD_PARTS)
+            for start in range(0, n, part):
+                await _copy_metric_rows(session, target.user_id, target_columns.take(slice(start, start + part)))
+                await _copy_metric_rows(session, other.user_id, other_columns.take(slice(start, start + part)))
+            print(f"📥 Загружено {2 * n} строк (2 пользователя) за {time.perf_counter() - t0:.1f} с")
+
+            first_ts = target_columns.timestamps[0].astype("datetime64[us]").item()
+            day = first_ts + timedelta(days=(n * STEP_SECONDS // 86400) // 2)
+            params = {"uid": target.user_id, "day": day, "day_end": day + timedelta(days=1)}
+
+            await session.execute(text("DROP INDEX uq_metrics_user_timestamp"))
+            before = await run_queries(session, params)
+            t0 = time.perf_counter()
+            await session.execute(text("CREATE UNIQUE INDEX uq_metrics_user_timestamp ON metrics (user_id, timestamp)"))
+            print(f"🔧 Индекс (user_id, timestamp) построен за {time.perf_counter() - t0:.1f} с")
+            after = await run_queries(session, params)
+
+            print(f"\n{'запрос':<32} | {'без индекса, мс':>15} | {'с индексом, мс':>14} | {'ускорение':>9}")
+            print("-" * 80)
+            for (name, _), (t_before, plan_before), (t_after, plan_after) in zip(QUERIES, before, after):
+                print(f"{name:<32} | {t_before:>15.1f} | {t_after:>14.1f} | {t_before / t_after:>8.1f}x")
+                print(f"{'':<32}   {plan_before} → {plan_after}")
+        finally:
+            await session.rollback()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    print("🚀 Бенчмарк чтения метрик...")
+    asyncio.run(main(rows))
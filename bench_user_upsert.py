@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк обращений к БД в get_or_create_user / update_user_iaf: прежний вариант
+(SELECT, затем INSERT + commit + refresh; SELECT + UPDATE + refresh) против одного запроса
+INSERT ... ON CONFLICT ... RETURNING / UPDATE ... RETURNING.
+Запуск: python bench_user_upsert.py [повторов]   (по умолчанию 200)
+Нужен DATABASE_URL (PostgreSQL + asyncpg) в .env. Кэш пользователей на время замера не используется;
+созданные бенчмарком пользователи (отрицательные telegram_id) удаляются в конце.
+
+Обращения к серверу считаются по событиям движка: каждый SQL-запрос плюс BEGIN / COMMIT / ROLLBACK.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import event, select, delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import crud
+from app.models import User
+
+# Загружаем переменные окружения
+load_dotenv()
+
+DEFAULT_REPEATS = 200
+
+
+async def legacy_get_or_create_user(session, telegram_id: int, name: str | None) -> User:
+    """get_or_create_user до перехода на upsert (без кэша)."""
+    res = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    user = res.scalars().first()
+    if not user:
+        user = User(telegram_id=int(telegram_id), name=name, created_at=datetime.now())
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+    return user
+
+
+async def legacy_update_user_iaf(session, telegram_id: int, iaf: float) -> User:
+    """update_user_iaf до перехода на UPDATE ... RETURNING."""
+    res = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    user = res.scalars().first()
+    if not user:
+        raise ValueError("User not found")
+    user.iaf = iaf
+    await session.commit()
+    await session.refresh(user)
+    return user
+
+
+async def current_get_or_create_user(session, telegram_id: int, name: str | None):
+    crud._user_cache.pop(int(telegram_id))
+    return await crud.get_or_create_user(session, telegram_id, name)
+
+
+class RoundTrips:
+    """Счётчик обращений к серверу по событиям движка."""
+
+    def __init__(self, engine):
+        self.count = 0
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._bump)
+        for name in ("begin", "commit", "rollback"):
+            event.listen(sync_engine, name, self._bump)
+
+    def _bump(self, *args, **kwargs):
+        self.count += 1
+
+
+async def measure(session_factory, trips: RoundTrips, handler, telegram_ids: list[int]) -> tuple[float, float]:
+    """Среднее число обращений и медиана времени (мс) на один вызов handler(session, telegram_id)."""
+    times = []
+    start_count = trips.count
+    for telegram_id in telegram_ids:
+        t0 = time.perf_counter()
+        async with session_factory() as session:
+            await handler(session, telegram_id)
+        times.append((time.perf_counter() - t0) * 1000)
+    return (trips.count - start_count) / len(telegram_ids), statistics.median(times)
+
+
+async def race(session_factory, get_or_create, telegram_id: int, sessions: int = 2) -> str:
+    """Одновременные первые сообщения одного пользователя из нескольких сессий."""
+
+    async def one():
+        async with session_factory() as session:
+            return await get_or_create(session, telegram_id, "bench")
+
+    results = await asyncio.gather(*(one() for _ in range(sessions)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if not errors:
+        return "ок"
+    return ", ".join(sorted({type(e).__name__ for e in errors}))
+
+
+async def main(repeats: int):
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ Ошибка: DATABASE_URL не найден в .env файле")
+        return
+    if "asyncpg" not in database_url:
+        print("❌ Для бенчмарка нужен PostgreSQL с драйвером asyncpg (postgresql+asyncpg://...)")
+        return
+
+    engine = create_async_engine(database_url, echo=False)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    trips = RoundTrips(engine)
+    base = -int(time.time()) * 1000
+
+    # у каждого варианта свои пользователи: первый проход — новые, второй — уже существующие
+    variants = [
+        ("SELECT + INSERT + refresh", legacy_get_or_create_user, legacy_update_user_iaf, base),
+        ("upsert ... RETURNING", current_get_or_create_user, crud.update_user_iaf, base - 2 * repeats),
+    ]
+    rows = []
+    try:
+        for label, get_or_create, update_iaf, first_id in variants:
+            ids = [first_id - i for i in range(repeats)]
+            new_user = await measure(session_factory, trips, lambda s, t: get_or_create(s, t, "bench"), ids)
+            existing = await measure(session_factory, trips, lambda s, t: get_or_create(s, t, "bench"), ids)
+            iaf = await measure(session_factory, trips, lambda s, t: update_iaf(s, t, 10.25), ids)
+            racing = []
+            for i in range(min(repeats, 20)):
+                racing.append(await race(session_factory, get_or_create, first_id - repeats - i))
+            failed = sum(r != "ок" for r in racing)
+            rows.append((label, new_user, existing, iaf, f"{failed}/{len(racing)}" + (f" ({next(r for r in racing if r != 'ок')})" if failed else "")))
+    finally:
+        async with session_factory() as session:
+            await session.execute(delete(User).where(User.telegram_id <= base, User.telegram_id > base - 4 * repeats))
+            await session.commit()
+        crud._user_cache.clear()
+        await engine.dispose()
+
+    print(f"\n{'вариант':<26} | {'новый польз.':>16} | {'существующий':>16} | {'IAF':>16} | гонка: ошибок")
+    print(f"{'':<26} | {'обращ. / мс':>16} | {'обращ. / мс':>16} | {'обращ. / мс':>16} |")
+    print("-" * 100)
+    for label, new_user, existing, iaf, racing in rows:
+        cells = " | ".join(f"{n:>6.1f} / {ms:>7.2f}" for n, ms in (new_user, existing, iaf))
+        print(f"{label:<26} | {cells} | {racing}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REPEATS
+    print("🚀 Бенчмарк upsert пользователей...")
+    asyncio.run(main(n))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Сравнение размера промпта для LLM при разных кодировках таблицы метрик (verbose / compact).
+Запуск: python compare_prompt_encodings.py [файл.csv ...] [--rows N] [--synthetic N]
+  файлы       — CSV/XLSX с метриками (по умолчанию sample_metrics.csv)
+  --rows N    — брать только последние N строк файла, как бот (0 — все строки)
+  --synthetic — добавить синтетический набор из N строк (раз в минуту, ~5% пустых значений)
+Токены оцениваются utils.estimate_tokens — это приближение, но для сравнения кодировок его хватает.
+"""
+
+import argparse
+from pathlib import Path
+
+from app.utils import MetricRows, PROMPT_ENCODINGS, build_prompt_for_llm, estimate_tokens, parse_metrics_file
+
+INSTRUCTION = "Проанализируй метрики и верни JSON с productivity_periods, day_plan и improvement_suggestions."
+
+
+def load_datasets(args) -> list[tuple[str, list]]:
+    datasets = []
+    for path in args.files:
+        rows, status = parse_metrics_file(path)
+        if status != "success":
+            print(f"⚠️ {path}: {status}")
+            continue
+        datasets.append((Path(path).name, rows))
+    if args.synthetic:
+        from bench_metrics_insert import make_columns
+
+        datasets.append((f"synthetic-{args.synthetic}", MetricRows(make_columns(args.synthetic, step_seconds=60))))
+    return datasets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение кодировок таблицы метрик в промпте")
+    parser.add_argument("files", nargs="*", default=["sample_metrics.csv"])
+    parser.add_argument("--rows", type=int, default=0, help="последние N строк (0 — все)")
+    parser.add_argument("--synthetic", type=int, default=0, help="добавить синтетический набор из N строк")
+    args = parser.parse_args()
+
+    print(f"{'набор':<24} | {'строк':>7} | {'кодировка':<9} | {'символов':>9} | {'~токенов':>9} | {'доля':>5}")
+    print("-" * 78)
+    for name, rows in load_datasets(args):
+        if args.rows:
+            rows = rows[-args.rows:]
+        baseline = None
+        for encoding in PROMPT_ENCODINGS:
+            prompt = build_prompt_for_llm("User", rows, INSTRUCTION, encoding=encoding)
+            tokens = estimate_tokens(prompt)
+            baseline = baseline or tokens
+            print(f"{name:<24} | {len(rows):>7} | {encoding:<9} | {len(prompt):>9} | {tokens:>9} | {tokens / baseline:>5.2f}")
+
+
+if __name__ == "__main__":
+    main()
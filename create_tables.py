@@ -4,16 +4,189 @@
 Запускай его на сервере после настройки .env файла
 """
 
+import argparse
 import asyncio
 import os
+from datetime import date
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine
-from app.models import Base
+from app.models import Base, Metric, COUNTER_SLOTS, STATS_COUNTED_TABLES
 
 # Загружаем переменные окружения
 load_dotenv()
 
-async def create_tables():
+async def upgrade_metrics_unique(conn):
+    """
+    create_all не добавляет ограничения в уже существующие таблицы: для старой БД
+    удаляем повторы (user_id, timestamp), оставляя первую строку, и строим уникальный индекс.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    result = await conn.exec_driver_sql(
+        "SELECT 1 FROM pg_indexes WHERE tablename = 'metrics' AND indexname = 'uq_metrics_user_timestamp'"
+    )
+    if result.first():
+        return
+    result = await conn.exec_driver_sql(
+        """
+        DELETE FROM metrics a USING metrics b
+        WHERE a.user_id = b.user_id AND a.timestamp = b.timestamp AND a.id > b.id
+        """
+    )
+    print(f"🧹 Удалено повторяющихся строк метрик: {result.rowcount}")
+    await conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_metrics_user_timestamp ON metrics (user_id, timestamp)"
+    )
+
+async def upgrade_metric_uploads(conn):
+    """create_all не добавляет колонки в существующие таблицы: добавляем analysis_json в старую metric_uploads."""
+    if conn.dialect.name != "postgresql":
+        return
+    await conn.exec_driver_sql("ALTER TABLE metric_uploads ADD COLUMN IF NOT EXISTS analysis_json TEXT")
+
+def _add_months(d: date, months: int) -> date:
+    """Первое число месяца, отстоящего от d на months месяцев."""
+    year, month = divmod(d.month - 1 + months, 12)
+    return date(d.year + year, month + 1, 1)
+
+async def ensure_metrics_partitions(conn, start: date, end: date):
+    """
+    Помесячные секции metrics на [start, end) и секция DEFAULT для всего остального.
+    Секцию нельзя создать, если подходящие строки уже лежат в DEFAULT, поэтому запас
+    месяцев вперёд стоит продлевать заранее (повторным запуском скрипта).
+    """
+    month = date(start.year, start.month, 1)
+    while month < end:
+        following = _add_months(month, 1)
+        await conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS metrics_y{month:%Y}m{month:%m} PARTITION OF metrics "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+    await conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS metrics_default PARTITION OF metrics DEFAULT")
+
+async def partition_metrics_monthly(conn, months_ahead: int = 12):
+    """
+    Переводит metrics на помесячное секционирование по timestamp (только PostgreSQL).
+    Обычная таблица переименовывается, создаётся секционированная с теми же колонками,
+    данные переносятся, старая таблица удаляется. Первичный ключ становится (id, timestamp):
+    в секционированной таблице уникальные ключи обязаны включать ключ секционирования.
+    Если таблица уже секционирована — только добавляются секции на months_ahead месяцев вперёд.
+    """
+    if conn.dialect.name != "postgresql":
+        print("⚠️ Секционирование поддерживается только для PostgreSQL — пропускаю")
+        return
+
+    today = date.today()
+    result = await conn.exec_driver_sql("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('metrics')")
+    if result.scalar():
+        await ensure_metrics_partitions(conn, date(today.year, today.month, 1), _add_months(today, months_ahead + 1))
+        print("📅 metrics уже секционирована, секции продлены")
+        return
+
+    result = await conn.exec_driver_sql("SELECT min(timestamp), max(timestamp), pg_get_serial_sequence('metrics', 'id') FROM metrics")
+    first_ts, last_ts, sequence = result.first()
+    start = first_ts.date() if first_ts else today
+    end = _add_months(max(last_ts.date() if last_ts else today, today), months_ahead + 1)
+
+    columns = []
+    for col in Metric.__table__.columns:
+        ddl = f"{col.name} {col.type.compile(dialect=conn.dialect)}"
+        if col.name == "id":
+            ddl += f" NOT NULL DEFAULT nextval('{sequence}')"
+        elif not col.nullable:
+            ddl += " NOT NULL"
+        columns.append(ddl)
+    names = ", ".join(col.name for col in Metric.__table__.columns)
+
+    await conn.exec_driver_sql("ALTER TABLE metrics RENAME TO metrics_unpartitioned")
+    await conn.exec_driver_sql(
+        f"CREATE TABLE metrics ({', '.join(columns)}, "
+        f"FOREIGN KEY (user_id) REFERENCES users (user_id)) PARTITION BY RANGE (timestamp)"
+    )
+    await ensure_metrics_partitions(conn, start, end)
+    result = await conn.exec_driver_sql(f"INSERT INTO metrics ({names}) SELECT {names} FROM metrics_unpartitioned")
+    print(f"📦 Перенесено строк метрик: {result.rowcount}")
+    # последовательность id переходит к новой таблице, иначе удалится вместе со старой
+    await conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY metrics.id")
+    await conn.exec_driver_sql("DROP TABLE metrics_unpartitioned")
+    # ключи строим после переноса данных — так быстрее
+    await conn.exec_driver_sql("ALTER TABLE metrics ADD PRIMARY KEY (id, timestamp)")
+    await conn.exec_driver_sql("CREATE UNIQUE INDEX uq_metrics_user_timestamp ON metrics (user_id, timestamp)")
+    print(f"📅 metrics секционирована помесячно: {start:%Y-%m} … {_add_months(end, -1):%Y-%m} + DEFAULT")
+
+async def install_stats_counters(conn):
+    """
+    Счётчики строк для /db_stats в режиме "counters" (только PostgreSQL): триггеры на уровне оператора
+    с таблицами переходов прибавляют число вставленных строк (и вычитают удалённые) к table_counters,
+    а для metrics — ещё и к user_stats по пользователям. Слот счётчика — номер соединения по модулю
+    COUNTER_SLOTS, чтобы параллельные загрузки не ждали одну строку. Затем счётчики заполняются точным
+    подсчётом — это одно полное чтение metrics; триггеры уже стоят и держат блокировку до конца транзакции,
+    так что записи, идущие параллельно, не потеряются. TRUNCATE счётчики не видят — после него запустите снова.
+    Повторный запуск пересчитывает счётчики заново; после --partition-monthly триггеры ставятся на новую таблицу.
+    """
+    if conn.dialect.name != "postgresql":
+        print("⚠️ Счётчики строк поддерживаются только для PostgreSQL — пропускаю")
+        return
+
+    await conn.exec_driver_sql(f"""
+        CREATE OR REPLACE FUNCTION stats_count_rows() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE delta bigint;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT count(*) INTO delta FROM new_rows;
+            ELSE
+                SELECT -count(*) INTO delta FROM old_rows;
+            END IF;
+            IF delta <> 0 THEN
+                INSERT INTO table_counters (table_name, slot, rows)
+                VALUES (TG_TABLE_NAME, pg_backend_pid() % {COUNTER_SLOTS}, delta)
+                ON CONFLICT (table_name, slot) DO UPDATE SET rows = table_counters.rows + EXCLUDED.rows;
+            END IF;
+            RETURN NULL;
+        END $$
+    """)
+    await conn.exec_driver_sql("""
+        CREATE OR REPLACE FUNCTION stats_user_metrics() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO user_stats (user_id, metrics_rows, first_timestamp, last_timestamp)
+                SELECT user_id, count(*), min(timestamp), max(timestamp) FROM new_rows GROUP BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    metrics_rows = user_stats.metrics_rows + EXCLUDED.metrics_rows,
+                    first_timestamp = LEAST(user_stats.first_timestamp, EXCLUDED.first_timestamp),
+                    last_timestamp = GREATEST(user_stats.last_timestamp, EXCLUDED.last_timestamp);
+            ELSE
+                -- границы по времени при удалении не пересчитываем: для этого пришлось бы читать metrics
+                UPDATE user_stats SET metrics_rows = user_stats.metrics_rows - gone.n
+                FROM (SELECT user_id, count(*) AS n FROM old_rows GROUP BY user_id) gone
+                WHERE user_stats.user_id = gone.user_id;
+            END IF;
+            RETURN NULL;
+        END $$
+    """)
+
+    triggers = [(table, "stats_count_rows") for table in STATS_COUNTED_TABLES] + [("metrics", "stats_user_metrics")]
+    for table, function in triggers:
+        for op, ref in (("INSERT", "NEW TABLE AS new_rows"), ("DELETE", "OLD TABLE AS old_rows")):
+            name = f"{function}_{op.lower()}"
+            await conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            await conn.exec_driver_sql(
+                f"CREATE TRIGGER {name} AFTER {op} ON {table} REFERENCING {ref} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+            )
+
+    await conn.exec_driver_sql("DELETE FROM table_counters")
+    counts = " UNION ALL ".join(f"SELECT '{table}', 0, count(*) FROM {table}" for table in STATS_COUNTED_TABLES)
+    await conn.exec_driver_sql(f"INSERT INTO table_counters (table_name, slot, rows) {counts}")
+    await conn.exec_driver_sql("DELETE FROM user_stats")
+    result = await conn.exec_driver_sql(
+        "INSERT INTO user_stats (user_id, metrics_rows, first_timestamp, last_timestamp) "
+        "SELECT user_id, count(*), min(timestamp), max(timestamp) FROM metrics GROUP BY user_id"
+    )
+    print(f"🔢 Счётчики строк установлены (пользователей с метриками: {result.rowcount})")
+
+async def create_tables(partition_monthly: bool = False, months_ahead: int = 12, stats_counters: bool = False):
     """Создает все таблицы в базе данных"""
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
@@ -29,6 +202,12 @@ async def create_tables():
         # Создаем все таблицы
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await upgrade_metrics_unique(conn)
+            await upgrade_metric_uploads(conn)
+            if partition_monthly:
+                await partition_metrics_monthly(conn, months_ahead)
+            if stats_counters:
+                await install_stats_counters(conn)
         
         print("✅ Все таблицы успешно созданы!")
         
@@ -53,5 +232,16 @@ async def create_tables():
         await engine.dispose()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Создание таблиц BCI бота")
+    parser.add_argument(
+        "--partition-monthly", action="store_true",
+        help="секционировать metrics помесячно по timestamp (PostgreSQL); повторный запуск продлевает секции",
+    )
+    parser.add_argument("--months-ahead", type=int, default=12, help="на сколько месяцев вперёд создавать секции")
+    parser.add_argument(
+        "--stats-counters", action="store_true",
+        help="поставить триггеры-счётчики строк для /db_stats (PostgreSQL); повторный запуск пересчитывает их",
+    )
+    args = parser.parse_args()
     print("🚀 Запускаю создание таблиц...")
-    asyncio.run(create_tables())
+    asyncio.run(create_tables(args.partition_monthly, args.months_ahead, args.stats_counters))
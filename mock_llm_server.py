@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Локальный мок chat/completions API в формате OpenRouter/DeepSeek (OpenAI-совместимый) — для нагрузочных
+тестов и замеров задержки бота без настоящей модели и без трат.
+
+Запуск: python mock_llm_server.py --latency lognormal --median-ms 800 --p95-ms 4000 --error-rate 0.05 --tokens-per-sec 40
+
+В .env бота:
+    DEEPSEEK_API_KEY=mock    (любой непустой ключ, иначе llm_client отдаёт встроенный мок-ответ без HTTP)
+    DEEPSEEK_ENDPOINT=http://127.0.0.1:8089/v1/chat/completions
+OPENROUTER_ENDPOINT (и ключ) — так же; второй экземпляр с другими параметрами на другом порту
+позволяет проверить роутер (переключение, автомат, дублирующие запросы).
+
+Что умеет:
+- обычные ответы и stream: true (SSE, куски по токену со скоростью --tokens-per-sec);
+- response_format json_schema — ответ JSON по схеме, строки заполняются словами;
+- json_object (так DeepSeek получает схему: только в промпте) — схема ответа бота, чьи ключи названы
+  в промпте (app.schemas), или заданная --json-object-schema; если не нашлась — {"answer": ...};
+- задержка до первого токена: fixed (ровно --median-ms), uniform (0…2×median), lognormal (медиана и p95);
+- ошибки с долей --error-rate и кодами из --error-codes (отвечаются сразу, как 429/503 у провайдеров);
+- GET /stats — счётчики запросов.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+
+from aiohttp import web
+
+from app import schemas
+
+# схемы ответов бота для JSON-режима без схемы
+JSON_OBJECT_SCHEMAS = {
+    model.__name__: schemas.response_format(model)["json_schema"]["schema"]
+    for model in (schemas.UploadAnalysis, schemas.DayPlanResponse, schemas.ImprovementSuggestionsResponse)
+}
+
+WORDS = ["фокус", "стресс", "усталость", "альфа-ритм", "концентрация", "отдых", "план", "работа", "сон", "пауза"]
+# куски потока: слово с пробелами после него — примерно один токен
+PIECE_RE = re.compile(r"\S+\s*")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Мок OpenAI-совместимого chat/completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal",
+                        help="распределение задержки до первого токена")
+    parser.add_argument("--median-ms", type=float, default=800, help="медиана задержки до первого токена, мс")
+    parser.add_argument("--p95-ms", type=float, default=3000, help="p95 задержки (для lognormal), мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, завершающихся ошибкой")
+    parser.add_argument("--error-codes", default="429,500,503", help="коды ошибок через запятую")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="скорость генерации")
+    parser.add_argument("--response-tokens", type=int, default=300,
+                        help="длина ответа в токенах (не больше max_tokens запроса)")
+    parser.add_argument("--seed", type=int, default=None, help="seed генератора случайных чисел")
+    parser.add_argument("--json-object-schema", choices=sorted(JSON_OBJECT_SCHEMAS), default=None,
+                        help="схема ответа на json_object (по умолчанию — по ключам, названным в промпте)")
+    return parser.parse_args(argv)
+
+
+def first_token_delay(args) -> float:
+    """Задержка до первого токена, сек."""
+    if args.latency == "fixed":
+        return args.median_ms / 1000
+    if args.latency == "uniform":
+        return random.uniform(0, 2 * args.median_ms) / 1000
+    # логнормальное: медиана median_ms, 95-й перцентиль p95_ms (z(0.95) = 1.645)
+    sigma = math.log(args.p95_ms / args.median_ms) / 1.645 if args.p95_ms > args.median_ms else 0.0
+    return random.lognormvariate(math.log(args.median_ms), sigma) / 1000
+
+
+def _words(n: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(max(n, 1)))
+
+
+def fake_value(schema: dict, defs: dict, words: int):
+    """Значение по JSON-схеме; words — сколько слов класть в строки."""
+    if "$ref" in schema:
+        return fake_value(defs[schema["$ref"].rsplit("/", 1)[-1]], defs, words)
+    kind = schema.get("type")
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {key: fake_value(sub, defs, max(words // max(len(props), 1), 1)) for key, sub in props.items()}
+    if kind == "array":
+        return [fake_value(schema.get("items", {}), defs, max(words // 3, 1)) for _ in range(3)]
+    if kind == "integer":
+        return random.randint(0, 100)
+    if kind == "number":
+        return round(random.uniform(0, 100), 2)
+    if kind == "boolean":
+        return random.random() < 0.5
+    return _words(words)
+
+
+def json_object_schema(payload: dict, args) -> dict | None:
+    """Схема для ответа в JSON-режиме: заданная явно или та, все ключи которой промпт называет в кавычках."""
+    if args.json_object_schema:
+        return JSON_OBJECT_SCHEMAS[args.json_object_schema]
+    prompt = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+    matched = [schema for schema in JSON_OBJECT_SCHEMAS.values()
+               if all(f'"{key}"' in prompt for key in schema["properties"])]
+    return max(matched, key=lambda schema: len(schema["properties"]), default=None)
+
+
+def completion_text(payload: dict, args) -> str:
+    tokens = min(args.response_tokens, payload.get("max_tokens") or args.response_tokens)
+    response_format = payload.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        return json.dumps(fake_value(schema, schema.get("$defs", {}), tokens), ensure_ascii=False)
+    if response_format.get("type") == "json_object":
+        schema = json_object_schema(payload, args)
+        if schema is None:
+            return json.dumps({"answer": _words(tokens)}, ensure_ascii=False)
+        return json.dumps(fake_value(schema, schema.get("$defs", {}), tokens), ensure_ascii=False)
+    return _words(tokens)
+
+
+class MockLLM:
+    def __init__(self, args):
+        self.args = args
+        self.error_codes = [int(code) for code in args.error_codes.split(",") if code.strip()]
+        self.stats = {"requests": 0, "streams": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.stats["requests"] += 1
+        if self.error_codes and random.random() < self.args.error_rate:
+            self.stats["errors"] += 1
+            code = random.choice(self.error_codes)
+            return web.json_response({"error": {"message": "mock error", "code": code}}, status=code)
+
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            pieces = PIECE_RE.findall(completion_text(payload, self.args))
+            delay = first_token_delay(self.args)
+            if payload.get("stream"):
+                self.stats["streams"] += 1
+                return await self._stream(request, payload, pieces, delay)
+            await asyncio.sleep(delay + len(pieces) / self.args.tokens_per_sec)
+            return web.json_response({
+                "id": f"mock-{self.stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)},
+                             "finish_reason": "stop"}],
+                "usage": {"completion_tokens": len(pieces)},
+            })
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _stream(self, request: web.Request, payload: dict, pieces: list, delay: float) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        # пока "модель думает", OpenRouter шлёт комментарии-keepalive — шлём и мы
+        deadline = time.monotonic() + delay
+        while (left := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(min(left, 1.0))
+            if deadline - time.monotonic() > 0:
+                await response.write(b": OPENROUTER PROCESSING\n\n")
+
+        def event(delta: dict, finish_reason=None) -> bytes:
+            chunk = {"object": "chat.completion.chunk", "model": payload.get("model", "mock"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        await response.write(event({"role": "assistant", "content": ""}))
+        for piece in pieces:
+            await response.write(event({"content": piece}))
+            await asyncio.sleep(1 / self.args.tokens_per_sec)
+        await response.write(event({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def root(self, request: web.Request) -> web.Response:
+        # сюда приходит прогрев соединения (llm_client.warm_llm_client делает HEAD /)
+        return web.Response(text="ok")
+
+
+def make_app(args) -> web.Application:
+    if args.seed is not None:
+        random.seed(args.seed)
+    mock = MockLLM(args)
+    app = web.Application()
+    # пути как у DeepSeek (/v1/...) и OpenRouter (/api/v1/...)
+    app.router.add_post("/v1/chat/completions", mock.chat_completions)
+    app.router.add_post("/api/v1/chat/completions", mock.chat_completions)
+    app.router.add_get("/stats", mock.get_stats)
+    app.router.add_get("/", mock.root)
+    return app
+
+
+async def start(args, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, int]:
+    """Запуск внутри уже работающего event loop (тесты, бенчмарки); port=0 — свободный порт."""
+    runner = web.AppRunner(make_app(args), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    print(f"🚀 Мок LLM: http://{options.host}:{options.port}/v1/chat/completions "
+          f"(задержка {options.latency}, медиана {options.median_ms:.0f} мс, ошибок {options.error_rate:.0%}, "
+          f"{options.tokens_per_sec:.0f} ток/с)")
+    web.run_app(make_app(options), host=options.host, port=options.port, access_log=None, print=None)
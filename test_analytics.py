@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_rows(days: int = 2):
+    """Поминутные метрики 08:00–19:00: пик фокуса 10:00–11:30, усталость 14:00–15:00, стресс 16:00–16:30"""
+    rows = []
+    for day in range(days):
+        t = datetime(2025, 1, 1 + day, 8, 0)
+        end = t.replace(hour=19)
+        i = 0
+        while t < end:
+            h = t.hour + t.minute / 60
+            wobble = (i % 5) - 2
+            focus = 50 + (35 if 10 <= h < 11.5 else 0) + wobble
+            stress = 30 + (50 if 16 <= h < 16.5 else 0) + wobble
+            fatigue = 2.0 + (4.0 if 14 <= h < 15 else 0.0) + wobble / 10
+            rows.append({
+                "timestamp": t, "cognitive_score": 50, "focus": focus, "chill": 40, "stress": stress,
+                "self_control": 50, "anger": 0, "relaxation_index": 1.0, "concentration_index": focus / 10,
+                "fatique_score": fatigue, "reverse_fatique": 1.0, "alpha_gravity": 1.0, "heart_rate": 70,
+            })
+            t += timedelta(minutes=1)
+            i += 1
+    return rows
+
+
+def test_periods():
+    """Тест: окна продуктивности, восстановления и критические периоды находятся по профилю метрик"""
+    from app.analytics import analyze_periods
+
+    result = analyze_periods(make_rows(), bin_minutes=15, window_bins=3, max_periods=3)
+    assert set(result) == {"productivity_periods", "recovery_periods", "critical_alert_periods"}
+
+    best = result["productivity_periods"]
+    assert best, "нет периодов продуктивности"
+    assert any(p["start_time"] <= "10:15" and p["end_time"] >= "11:15" for p in best)
+    assert all(not ("14:15" <= p["start_time"] < "15:00") for p in best)
+
+    assert any(p["start_time"] <= "14:15" and p["end_time"] >= "14:45" for p in result["recovery_periods"])
+
+    alerts = result["critical_alert_periods"]
+    assert any(a["issue"].startswith("Высокий стресс") and a["start_time"] <= "16:00" < a["end_time"] for a in alerts)
+    assert any(a["issue"].startswith("Высокая усталость") for a in alerts)
+    assert all(a["alert_level"] in ("средний", "высокий") for a in alerts)
+    print(f"✅ Найдено периодов: {len(best)} продуктивных, {len(alerts)} критических")
+
+
+def test_columns_and_report_shape():
+    """Тест: MetricRows даёт тот же результат, что и список словарей, а формат подходит для отчёта"""
+    import json
+    from app.analytics import analyze_periods
+    from app.bot import format_full_report_json
+    from app.utils import MetricRows, MetricsColumns
+
+    rows = make_rows(days=1)
+    expected = analyze_periods(rows)
+    assert analyze_periods(MetricRows(MetricsColumns.from_rows(rows))) == expected
+
+    text = format_full_report_json(json.dumps(expected))
+    assert "Периоды максимальной продуктивности:" in text and "Критические периоды:" in text
+    print("✅ Колоночный ввод и формат отчёта совпадают")
+
+
+def test_empty_and_iaf():
+    """Тест: пустые данные не ломают расчёт, низкая IAF усиливает вес усталости"""
+    from app.analytics import analyze_periods, iaf_weights
+
+    empty = analyze_periods([])
+    assert empty == {"productivity_periods": [], "recovery_periods": [], "critical_alert_periods": []}
+    assert analyze_periods(make_rows(days=1)[:1]) == empty
+
+    assert iaf_weights(None)["fatique_score"] == 1.0
+    assert iaf_weights(8.0)["fatique_score"] > 1.0 > iaf_weights(12.0)["fatique_score"]
+    assert iaf_weights(20.0) == iaf_weights(12.0)   # поправка ограничена
+    print("✅ Пустые данные и поправка на IAF")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты локального расчёта периодов")
+    print("=" * 50)
+
+    tests = [
+        ("Тест периодов", test_periods),
+        ("Тест формата", test_columns_and_report_shape),
+        ("Тест пустых данных и IAF", test_empty_and_iaf),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import tempfile
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_ttl_cache():
+    """Тест LRU-вытеснения и времени жизни записей"""
+    import time
+    from app.cache import TTLCache
+
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1          # "a" становится самой свежей
+    cache.set("c", 3)                   # вытесняет "b"
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1}
+
+    short = TTLCache(maxsize=10, ttl=0.05)
+    short.set("k", "v")
+    assert short.get("k") == "v"
+    time.sleep(0.06)
+    assert short.get("k") is None and len(short) == 0
+    print("✅ LRU и TTL работают")
+
+
+def test_sqlite_cache():
+    """Тест постоянного кэша в файле SQLite"""
+    from app.cache import SQLiteCache
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "sub", "cache.sqlite")
+        cache = SQLiteCache(path, ttl=3600)
+        assert cache.get("k") is None
+        cache.set("k", "ответ")
+        # новый объект на тот же файл — как после перезапуска бота
+        assert SQLiteCache(path, ttl=3600).get("k") == "ответ"
+        assert SQLiteCache(path, ttl=1e-9).get("k") is None
+    print("✅ Постоянный кэш переживает пересоздание")
+
+
+def test_llm_response_cache():
+    """Тест кэша ответов LLM: повторный запрос не идёт в сеть, bypass_cache идёт"""
+    import asyncio
+    from app import llm_client
+
+    calls = []
+
+    async def fake_backend(messages, model, max_tokens=800, temperature=0.2):
+        calls.append(messages)
+        return f"ответ {len(calls)}"
+
+    original = llm_client._call_deepseek, llm_client._call_openrouter, llm_client.settings.DEEPSEEK_API_KEY
+    llm_client._call_deepseek = llm_client._call_openrouter = fake_backend
+    llm_client.settings.DEEPSEEK_API_KEY = "test"
+    llm_client._response_cache.clear()
+    try:
+        messages = [{"role": "user", "content": "Что такое IAF?"}]
+        first = asyncio.run(llm_client._complete(messages, model="m"))
+        again = asyncio.run(llm_client._complete(messages, model="m"))
+        other = asyncio.run(llm_client._complete(messages, model="m", temperature=0.7))
+        fresh = asyncio.run(llm_client._complete(messages, model="m", bypass_cache=True))
+        after = asyncio.run(llm_client._complete(messages, model="m"))
+    finally:
+        llm_client._call_deepseek, llm_client._call_openrouter, llm_client.settings.DEEPSEEK_API_KEY = original
+
+    assert first == again == "ответ 1"
+    assert other == "ответ 2"
+    assert fresh == after == "ответ 3"   # свежий ответ заменяет закэшированный
+    assert len(calls) == 3
+    print("✅ Кэш ответов LLM работает")
+
+
+def test_llm_cache_skips_invalid():
+    """Тест: ответ, который не разбирается по схеме, не кэшируется — следующий запрос снова идёт в сеть"""
+    import asyncio
+    from app import llm_client
+    from app.schemas import DayPlanResponse, parse_llm_json
+
+    answers = ['{"day_plan": "10:00 глубокая ра', '{"day_plan": "10:00-11:30 глубокая работа"}']
+    calls = []
+
+    async def fake_backend(messages, model, max_tokens=800, temperature=0.2, response_format=None):
+        calls.append(messages)
+        return answers[len(calls) - 1]
+
+    original = llm_client._call_deepseek, llm_client._call_openrouter, llm_client.settings.DEEPSEEK_API_KEY
+    llm_client._call_deepseek = llm_client._call_openrouter = fake_backend
+    llm_client.settings.DEEPSEEK_API_KEY = "test"
+    llm_client._response_cache.clear()
+    rejected = llm_client.llm_cache_stats()["rejected"]
+    try:
+        broken = asyncio.run(llm_client.analyze_metrics("План на день", schema=DayPlanResponse))
+        fixed = asyncio.run(llm_client.analyze_metrics("План на день", schema=DayPlanResponse))
+        again = asyncio.run(llm_client.analyze_metrics("План на день", schema=DayPlanResponse))
+    finally:
+        llm_client._call_deepseek, llm_client._call_openrouter, llm_client.settings.DEEPSEEK_API_KEY = original
+
+    # оборванный ответ отдан вызывающему как есть, но в кэш не попал
+    assert broken == answers[0] and fixed == again == answers[1]
+    assert len(calls) == 2
+    assert llm_client.llm_cache_stats()["rejected"] == rejected + 1
+    assert parse_llm_json(again, DayPlanResponse)["day_plan"].startswith("10:00")
+    print("✅ Неразобранный ответ не кэшируется")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты кэшей")
+    print("=" * 50)
+
+    tests = [
+        ("Тест LRU/TTL", test_ttl_cache),
+        ("Тест SQLite-кэша", test_sqlite_cache),
+        ("Тест кэша ответов LLM", test_llm_response_cache),
+        ("Тест некэшируемых ответов LLM", test_llm_cache_skips_invalid),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
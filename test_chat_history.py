@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_budget_and_pinned_system():
+    """Тест: история укладывается в бюджет токенов, системный промпт не вытесняется"""
+    from app.chat_history import ChatHistory
+
+    async def scenario():
+        history = ChatHistory("Ты — эксперт.", budget=120)
+        for i in range(20):
+            history.add_turn(f"вопрос номер {i} " + "про альфа-ритм " * 5, f"ответ {i} " + "слово " * 10)
+            assert history.tokens() <= 120 or len(history.turns) == 2
+        messages = history.messages()
+        assert messages[0] == {"role": "system", "content": "Ты — эксперт."}
+        assert messages[-1]["content"].startswith("ответ 19")
+        assert 2 <= len(history.turns) < 40
+        # без summarize вытесненное просто отбрасывается
+        assert history.summary == "" and not history._folding
+
+        # одна огромная пара всё равно остаётся — последний ответ нужен для продолжения разговора
+        history.add_turn("длинный вопрос " * 200, "ок")
+        assert [m["content"] for m in history.turns][-1] == "ок" and len(history.turns) == 2
+
+    asyncio.run(scenario())
+    print("✅ Бюджет токенов соблюдается")
+
+
+def test_background_summary():
+    """Тест: вытесненные реплики сворачиваются в краткое содержание фоновой задачей"""
+    from app.chat_history import ChatHistory
+
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def summarize(summary, turns):
+            calls.append([t["content"] for t in turns])
+            await release.wait()
+            return (summary + " " if summary else "") + f"свёрнуто {len(turns)}"
+
+        history = ChatHistory("sys", budget=60, summarize=summarize)
+        for i in range(4):
+            history.add_turn(f"вопрос {i} " + "текст " * 10, f"ответ {i}")
+        # ответ пользователю не ждёт сворачивания: задача только запланирована
+        assert history.summary == "" and history._folding
+        await asyncio.sleep(0)
+        assert calls and history.summary == ""
+        release.set()
+        await history.wait_summary()
+        assert history.summary.startswith("свёрнуто")
+        assert "Краткое содержание предыдущего разговора: свёрнуто" in history.messages()[0]["content"]
+        assert not history._folding
+
+    asyncio.run(scenario())
+    assert calls[0][0].startswith("вопрос 0")
+    print("✅ Краткое содержание строится в фоне")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты истории диалога")
+    print("=" * 50)
+
+    tests = [
+        ("Тест бюджета токенов", test_budget_and_pinned_system),
+        ("Тест краткого содержания", test_background_summary),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
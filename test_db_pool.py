@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_engine_kwargs():
+    """Тест: параметры пула и кэша запросов asyncpg берутся из settings"""
+    from app.config import settings
+    from app.database import _engine_kwargs, InstrumentedPool
+
+    kwargs = _engine_kwargs("postgresql+asyncpg://u:p@localhost/db")
+    assert kwargs["poolclass"] is InstrumentedPool
+    assert kwargs["pool_size"] == settings.DB_POOL_SIZE
+    assert kwargs["max_overflow"] == settings.DB_MAX_OVERFLOW
+    assert kwargs["pool_recycle"] == settings.DB_POOL_RECYCLE
+    assert kwargs["pool_pre_ping"] == settings.DB_POOL_PRE_PING
+    assert kwargs["connect_args"]["statement_cache_size"] == settings.DB_STATEMENT_CACHE_SIZE
+    assert kwargs["connect_args"]["prepared_statement_cache_size"] == settings.DB_STATEMENT_CACHE_SIZE
+
+    assert "connect_args" not in _engine_kwargs("postgresql+psycopg://u:p@localhost/db")
+    assert _engine_kwargs("sqlite+aiosqlite:///bot.db") == {}
+    print("✅ Параметры пула из настроек")
+
+
+def test_db_stats():
+    """Тест: выдачи соединений и запросы по тексту считаются, число разных запросов ограничено"""
+    from app.database import DBStats
+
+    stats = DBStats()
+    stats.record_checkout(0.001, checked_out=1, overflow=False)
+    stats.record_checkout(0.2, checked_out=7, overflow=True)
+    stats.record_timeout()
+
+    stats.record_query("SELECT users.user_id\n  FROM users WHERE users.telegram_id = $1", 0.002)
+    stats.record_query("SELECT users.user_id FROM users WHERE users.telegram_id = $1", 0.004)
+    stats.record_query("INSERT INTO metrics (user_id) VALUES ($1)", 0.05)
+
+    top = stats.top_statements()
+    assert top[0]["statement"].startswith("INSERT INTO metrics")
+    assert top[1]["statement"] == "SELECT users.user_id FROM users WHERE users.telegram_id = $1"
+    assert top[1]["count"] == 2 and abs(top[1]["avg"] - 0.003) < 1e-9 and top[1]["max"] == 0.004
+
+    summary = stats.stats()
+    assert (summary["checkouts"], summary["overflow_checkouts"], summary["timeouts"]) == (2, 1, 1)
+    assert summary["max_checked_out"] == 7 and summary["checkout_p95"] == 0.2
+    assert summary["queries"] == 3 and summary["query_p50"] == 0.004
+
+    for n in range(DBStats.MAX_STATEMENTS + 10):
+        stats.record_query(f"SELECT {n}", 0.001)
+    assert len(stats._statements) == DBStats.MAX_STATEMENTS + 1   # + "прочие"
+    assert stats._statements["прочие"][0] == 12   # 2 + 210 запросов, мест 200
+    print("✅ Замеры пула и запросов")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты пула соединений с БД")
+    print("=" * 50)
+
+    tests = [
+        ("Тест параметров пула", test_engine_kwargs),
+        ("Тест замеров", test_db_stats),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+
+import numpy as np
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HEADER = b"timestamp,cognitive_score,focus,chill,stress,heart_rate\n"
+
+
+def _blocks(n_blocks=3, rows_per_block=200):
+    """CSV, разрезанный на блоки с заголовком (как в ingest); в каждой 7-й строке пустой пульс"""
+    blocks = []
+    for b in range(n_blocks):
+        lines = []
+        for i in range(b * rows_per_block, (b + 1) * rows_per_block):
+            heart_rate = "" if i % 7 == 0 else str(60 + i % 30)
+            lines.append(f"2025-03-01 {9 + i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d},"
+                         f"{50 + i % 10},{i * 0.5},{20 + i % 5},{10 + i % 7},{heart_rate}\n")
+        blocks.append(HEADER + "".join(lines).encode())
+    return blocks
+
+
+def _parse_all(workers):
+    """Разбирает блоки через run_cpu с PARSE_PROCESS_WORKERS=workers; возвращает (колонки, pid исполнителя)"""
+    from app import executors
+    from app.config import settings
+    from app.utils import MetricsColumns, parse_metrics_csv_block
+
+    saved = settings.PARSE_PROCESS_WORKERS
+    settings.PARSE_PROCESS_WORKERS = workers
+    executors.shutdown_pools()
+
+    async def scenario():
+        results = await asyncio.gather(*(
+            executors.run_cpu(parse_metrics_csv_block, block, i == 0) for i, block in enumerate(_blocks())
+        ))
+        return results, await executors.run_cpu(os.getpid)
+
+    try:
+        results, pid = asyncio.run(scenario())
+    finally:
+        executors.shutdown_pools()
+        settings.PARSE_PROCESS_WORKERS = saved
+    assert all(error is None for _, _, error in results)
+    return MetricsColumns.concat([columns for columns, _, _ in results]), pid
+
+
+def test_pool_matches_inline():
+    """Тест: разбор в spawn-пуле процессов и inline даёт одинаковые MetricsColumns"""
+    pooled, pool_pid = _parse_all(workers=2)
+    inline, inline_pid = _parse_all(workers=0)
+
+    assert pool_pid != os.getpid() and inline_pid == os.getpid()
+    assert len(pooled) == len(inline) == 600
+    assert np.array_equal(pooled.timestamps, inline.timestamps)
+    assert pooled.values.keys() == inline.values.keys()
+    for key in inline.values:
+        assert pooled.values[key].dtype == inline.values[key].dtype, key
+        assert np.array_equal(pooled.values[key], inline.values[key]), key
+        assert np.array_equal(pooled.nulls[key], inline.nulls[key]), key
+    assert inline.nulls["heart_rate"].sum() == 86
+    print("✅ Пул процессов и inline совпадают")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты пулов разбора")
+    print("=" * 50)
+
+    tests = [
+        ("Тест пула процессов и inline", test_pool_matches_inline),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
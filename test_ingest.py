@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HEADER = b"timestamp,cognitive_score,focus,chill,stress\n"
+
+
+def _csv_lines(n, start=datetime(2025, 3, 1, 9, 0)):
+    """Строки данных CSV (без заголовка) с метками через минуту; focus — номер строки"""
+    return [
+        f"{(start + timedelta(minutes=i)):%Y-%m-%d %H:%M},{50 + i % 10},{i},{20 + i % 5},{10 + i % 7}\n".encode()
+        for i in range(n)
+    ]
+
+
+@contextmanager
+def _settings(**values):
+    """Временно меняет настройки"""
+    from app.config import settings
+
+    saved = {key: getattr(settings, key) for key in values}
+    for key, value in values.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(settings, key, value)
+
+
+@asynccontextmanager
+async def _database():
+    """Пустая БД SQLite во временном файле и пользователь в ней: (фабрика сессий, user_id)"""
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app import crud
+    from app.models import Base
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bci.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+        crud._user_cache.clear()
+        async with session_factory() as session:
+            user = await crud.get_or_create_user(session, telegram_id=1001, name="Анна")
+        try:
+            yield session_factory, user.user_id
+        finally:
+            crud._user_cache.clear()
+            await engine.dispose()
+
+
+@asynccontextmanager
+async def _file_server(handler):
+    """aiohttp-сервер, который отдаёт файл по GET /file; возвращает его URL"""
+    from aiohttp import web
+    from app.ingest import close_http_session
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/file"
+    finally:
+        await close_http_session()
+        await runner.cleanup()
+
+
+def _serve(body: bytes):
+    from aiohttp import web
+
+    async def handler(request):
+        return web.Response(body=body)
+    return handler
+
+
+async def _stored_focus(session_factory, user_id):
+    from app.crud import get_metric_rows
+
+    async with session_factory() as session:
+        return [row["focus"] for row in await get_metric_rows(session, user_id)]
+
+
+def test_blocks_and_order():
+    """Тест: файл режется на блоки по границе строки, у каждого блока заголовок, строки идут в БД по порядку"""
+    from app import ingest
+
+    lines = _csv_lines(300)
+    body = HEADER + b"".join(lines)
+    blocks = []
+    run_cpu = ingest.run_cpu
+
+    async def recording_run_cpu(fn, *args):
+        if fn is ingest.parse_metrics_csv_block:
+            blocks.append(args[0])
+        return await run_cpu(fn, *args)
+
+    async def scenario():
+        async with _database() as (session_factory, user_id), _file_server(_serve(body)) as url:
+            async with session_factory() as session:
+                new, known, state = await ingest.ingest_upload(session, user_id, url, "metrics.csv")
+            return new, known, state, await _stored_focus(session_factory, user_id)
+
+    ingest.run_cpu = recording_run_cpu
+    try:
+        with _settings(PARSE_BLOCK_BYTES=2000, DOWNLOAD_CHUNK_BYTES=700, PARSE_PROCESS_WORKERS=0, METRICS_TAIL_ROWS=120):
+            new, known, state, stored = asyncio.run(scenario())
+    finally:
+        ingest.run_cpu = run_cpu
+
+    assert state.status == "success" and (new, known) == (300, 0)
+    assert len(blocks) > 3
+    assert all(block.startswith(HEADER) and block.endswith(b"\n") for block in blocks)
+    # без заголовков блоки в сумме дают файл байт в байт: ни одна строка не разрезана и не потеряна
+    assert HEADER + b"".join(block[len(HEADER):] for block in blocks) == body
+    # в памяти — только последние METRICS_TAIL_ROWS строк, в БД — весь файл
+    assert [row["focus"] for row in state.tail] == list(range(180, 300))
+    assert stored == list(range(300))
+    assert state.content_hash and state.rows_total == 300
+    print(f"✅ {len(blocks)} блоков, порядок строк сохранён")
+
+
+def test_download_error_rollback():
+    """Тест: обрыв скачивания после записи первых кусков откатывает всё, ошибка пробрасывается"""
+    import aiohttp
+    from aiohttp import web
+    from app import crud, ingest
+
+    lines = _csv_lines(400)
+    writes = []
+    insert_metric_rows = crud._insert_metric_rows
+
+    async def counting_insert(session, user_id, rows, *args):
+        writes.append(len(rows))
+        return await insert_metric_rows(session, user_id, rows, *args)
+
+    async def broken(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(HEADER + b"".join(lines[:300]))
+        # ждём, пока первые блоки дойдут до БД, и обрываем соединение посреди файла
+        for _ in range(100):
+            if writes:
+                break
+            await asyncio.sleep(0.02)
+        request.transport.close()
+        return response
+
+    async def scenario():
+        async with _database() as (session_factory, user_id), _file_server(broken) as url:
+            async with session_factory() as session:
+                try:
+                    await ingest.ingest_upload(session, user_id, url, "metrics.csv")
+                except aiohttp.ClientError as e:
+                    error = e
+                else:
+                    error = None
+            return error, await _stored_focus(session_factory, user_id)
+
+    crud._insert_metric_rows = counting_insert
+    try:
+        with _settings(PARSE_BLOCK_BYTES=2000, DOWNLOAD_CHUNK_BYTES=700, PARSE_PROCESS_WORKERS=0):
+            error, stored = asyncio.run(scenario())
+    finally:
+        crud._insert_metric_rows = insert_metric_rows
+
+    assert isinstance(error, aiohttp.ClientError)
+    assert writes and sum(writes) < 400
+    assert stored == []
+    print(f"✅ Обрыв после {sum(writes)} записанных строк: запись откатилась")
+
+
+def test_resent_file_dedup():
+    """
+    Тест: тот же файл с новым file_unique_id распознаётся по sha256 и не пишется в БД;
+    разбор при этом идёт параллельно со скачиванием, а запись у вернувшегося пользователя — после проверки хеша
+    """
+    from aiohttp import web
+    from app import crud, ingest
+
+    files = {
+        "first": HEADER + b"".join(_csv_lines(400)),
+        "other": HEADER + b"".join(_csv_lines(200, start=datetime(2025, 3, 2, 9, 0))),
+    }
+    files["resent"] = files["first"]
+    events = []
+    run_cpu, insert_metric_rows = ingest.run_cpu, crud._insert_metric_rows
+
+    async def recording_run_cpu(fn, *args):
+        events.append("parse")
+        return await run_cpu(fn, *args)
+
+    async def recording_insert(*args):
+        events.append("write")
+        return await insert_metric_rows(*args)
+
+    async def slow_file(request):
+        # отдаём файл кусками с паузами, чтобы было видно, что происходит до конца скачивания
+        body = files[request.query["f"]]
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for start in range(0, len(body), 1000):
+            await response.write(body[start:start + 1000])
+            events.append("sent")
+            await asyncio.sleep(0.02)
+        await response.write_eof()
+        return response
+
+    async def upload(session_factory, user_id, url, file_unique_id):
+        """Как on_document: поиск по file_unique_id, затем загрузка с хешами прошлых файлов"""
+        async with session_factory() as session:
+            if await crud.find_metric_upload(session, user_id, file_unique_id=file_unique_id) is not None:
+                return "known file_unique_id", None, []
+            known_hashes = await crud.get_upload_hashes(session, user_id)
+        events.clear()
+        async with session_factory() as session:
+            new, _, state = await ingest.ingest_upload(session, user_id, url, "metrics.csv", known_hashes=known_hashes)
+        if state.status == "success":
+            async with session_factory() as session:
+                await crud.save_metric_upload(session, user_id, state.content_hash, file_unique_id=file_unique_id,
+                                              rows_count=new)
+        return state.status, state.content_hash, list(events)
+
+    async def scenario():
+        async with _database() as (session_factory, user_id), _file_server(slow_file) as url:
+            results = {}
+            for name, file_unique_id in (("first", "AgAD1"), ("resent", "AgAD2"), ("other", "AgAD3")):
+                results[name] = await upload(session_factory, user_id, f"{url}?f={name}", file_unique_id)
+            async with session_factory() as session:
+                original = await crud.find_metric_upload(session, user_id, content_hash=results["first"][1])
+            return results, original.file_unique_id, len(await _stored_focus(session_factory, user_id))
+
+    def overlaps(log):
+        """Разбор начался до того, как сервер отдал последний кусок файла"""
+        last_sent = len(log) - 1 - log[::-1].index("sent")
+        return "parse" in log[:last_sent]
+
+    ingest.run_cpu, crud._insert_metric_rows = recording_run_cpu, recording_insert
+    try:
+        with _settings(PARSE_BLOCK_BYTES=2000, DOWNLOAD_CHUNK_BYTES=700, PARSE_PROCESS_WORKERS=0):
+            results, original_id, stored = asyncio.run(scenario())
+    finally:
+        ingest.run_cpu, crud._insert_metric_rows = run_cpu, insert_metric_rows
+
+    first, resent, other = results["first"], results["resent"], results["other"]
+    assert first[0] == "success" and overlaps(first[2]) and "write" in first[2]
+    # тот же файл с новым file_unique_id: разбирался по ходу скачивания, но в БД не ушло ничего
+    assert resent[0].startswith("duplicate") and resent[1] == first[1]
+    assert overlaps(resent[2]) and "write" not in resent[2]
+    assert original_id == "AgAD1"
+    # другой файл вернувшегося пользователя: разбор параллельно со скачиванием, запись — после него
+    log = other[2]
+    assert other[0] == "success" and other[1] != first[1] and overlaps(log)
+    assert "write" in log and log.index("write") > len(log) - 1 - log[::-1].index("sent")
+    assert stored == 600
+    print("✅ Повторный файл распознан по хешу, разбор шёл параллельно со скачиванием")
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты конвейера загрузки")
+    print("=" * 50)
+
+    tests = [
+        ("Тест блоков и порядка строк", test_blocks_and_order),
+        ("Тест отката при обрыве скачивания", test_download_error_rollback),
+        ("Тест повторной отправки файла", test_resent_file_dedup),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
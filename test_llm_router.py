@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+from contextlib import contextmanager
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@contextmanager
+def fake_backends(openrouter, deepseek, **overrides):
+    """Подменяет оба API функциями openrouter/deepseek и даёт роутеру чистую статистику"""
+    from app import llm_client
+    from app.llm_client import LLMBackend, OPENROUTER_ENDPOINT, DEEPSEEK_ENDPOINT
+
+    s = llm_client.settings
+    patched = {"OPENROUTER_API_KEY": "k1", "DEEPSEEK_API_KEY": "k2", "LLM_RETRY_BACKOFF": 0.0, **overrides}
+    saved_settings = {name: getattr(s, name) for name in patched}
+    saved = (llm_client._call_openrouter, llm_client._call_deepseek, llm_client._BACKENDS)
+    for name, value in patched.items():
+        setattr(s, name, value)
+    llm_client._call_openrouter, llm_client._call_deepseek = openrouter, deepseek
+    llm_client._BACKENDS = [
+        LLMBackend("openrouter", OPENROUTER_ENDPOINT, "OPENROUTER_API_KEY"),
+        LLMBackend("deepseek", DEEPSEEK_ENDPOINT, "DEEPSEEK_API_KEY"),
+    ]
+    try:
+        yield llm_client._BACKENDS
+    finally:
+        llm_client._call_openrouter, llm_client._call_deepseek, llm_client._BACKENDS = saved
+        for name, value in saved_settings.items():
+            setattr(s, name, value)
+
+
+def _http_error(code):
+    import httpx
+    request = httpx.Request("POST", "https://llm.test")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(code, request=request))
+
+
+def test_failover_and_breaker():
+    """Тест: сбой OpenRouter — ответ от DeepSeek, после серии сбоев OpenRouter выключается"""
+    from app.llm_client import _routed_call
+
+    calls = []
+
+    async def broken(messages, model, max_tokens, temperature):
+        calls.append(("openrouter", model))
+        raise _http_error(503)
+
+    async def healthy(messages, model, max_tokens, temperature):
+        calls.append(("deepseek", model))
+        return "ok"
+
+    with fake_backends(broken, healthy, LLM_BREAKER_FAILURES=3, DEEPSEEK_MODEL="deepseek-chat") as (router, deepseek):
+        for _ in range(3):
+            assert asyncio.run(_routed_call([], "vendor/model", 100, 0.2)) == "ok"
+        assert not router.available() and deepseek.available()
+        calls.clear()
+        assert asyncio.run(_routed_call([], "vendor/model", 100, 0.2)) == "ok"
+    # выключенный бэкенд больше не пробуется; DeepSeek получает своё имя модели
+    assert calls == [("deepseek", "deepseek-chat")], calls
+    print("✅ Переключение на другой бэкенд и автомат работают")
+
+
+def test_retry_and_client_errors():
+    """Тест: повтор после временного сбоя; ошибка запроса (4xx) не повторяется"""
+    from app.llm_client import _routed_call
+
+    attempts = []
+
+    async def flaky(messages, model, max_tokens, temperature):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _http_error(429)
+        return "ok"
+
+    async def unauthorized(messages, model, max_tokens, temperature):
+        attempts.append(1)
+        raise _http_error(401)
+
+    with fake_backends(flaky, flaky, DEEPSEEK_API_KEY="", LLM_RETRIES=2):
+        assert asyncio.run(_routed_call([], "m", 100, 0.2)) == "ok"
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with fake_backends(unauthorized, unauthorized):
+        try:
+            asyncio.run(_routed_call([], "m", 100, 0.2))
+            raise AssertionError("ожидалась ошибка 401")
+        except Exception as e:
+            assert getattr(e, "response", None) is not None and e.response.status_code == 401
+    assert len(attempts) == 1
+    print("✅ Повторы только для временных сбоев")
+
+
+def test_hedging():
+    """Тест: медленный первый бэкенд — запрос дублируется, берётся быстрый ответ"""
+    from app.llm_client import _routed_call
+
+    cancelled = []
+
+    async def slow(messages, model, max_tokens, temperature):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("openrouter")
+            raise
+        return "slow"
+
+    async def fast(messages, model, max_tokens, temperature):
+        return "fast"
+
+    with fake_backends(slow, fast, LLM_HEDGE=True, LLM_HEDGE_DELAY=0.05) as (router, deepseek):
+        assert asyncio.run(_routed_call([], "m", 100, 0.2)) == "fast"
+        assert deepseek.error_rate() == 0 and router.error_rate() == 0
+    assert cancelled == ["openrouter"]
+    print("✅ Дублирующий запрос обгоняет медленный")
+
+
+def test_hedging_fast_failure():
+    """Тест: первый бэкенд падает сразу — второй запускается без ожидания задержки дублирования"""
+    import time
+    from app.llm_client import _routed_call
+
+    calls = []
+
+    async def broken(messages, model, max_tokens, temperature):
+        calls.append("openrouter")
+        raise _http_error(503)
+
+    async def healthy(messages, model, max_tokens, temperature):
+        calls.append("deepseek")
+        return "ok"
+
+    with fake_backends(broken, healthy, LLM_HEDGE=True, LLM_HEDGE_DELAY=5.0) as (router, deepseek):
+        started = time.monotonic()
+        assert asyncio.run(_routed_call([], "m", 100, 0.2)) == "ok"
+        elapsed = time.monotonic() - started
+        assert router.error_rate() == 1 and deepseek.error_rate() == 0
+    assert calls == ["openrouter", "deepseek"], calls
+    assert elapsed < 1.0, elapsed
+
+    # оба падают: в повторах участвуют оба бэкенда, а не только первый
+    calls.clear()
+    with fake_backends(broken, broken, LLM_HEDGE=True, LLM_HEDGE_DELAY=5.0, LLM_RETRIES=2,
+                       LLM_BREAKER_FAILURES=10):
+        try:
+            asyncio.run(_routed_call([], "m", 100, 0.2))
+            raise AssertionError("ожидалась ошибка 503")
+        except Exception as e:
+            assert getattr(e, "response", None) is not None and e.response.status_code == 503
+    assert len(calls) == 6, calls
+    print("✅ Быстрый сбой сразу уходит на второй бэкенд")
+
+
+def test_stream_failover():
+    """Тест: поток, упавший до первого куска, повторяется на другом бэкенде"""
+    from app import llm_client
+
+    async def collect():
+        return [p async for p in llm_client._routed_stream([], "m", 100, 0.2)]
+
+    async def broken_stream(messages, model, max_tokens=800, temperature=0.2):
+        raise _http_error(502)
+        yield  # делает функцию генератором
+
+    async def good_stream(messages, model, max_tokens=800, temperature=0.2):
+        for piece in ["a", "b"]:
+            yield piece
+
+    saved = llm_client._stream_openrouter, llm_client._stream_deepseek
+    llm_client._stream_openrouter, llm_client._stream_deepseek = broken_stream, good_stream
+    try:
+        with fake_backends(None, None):
+            assert asyncio.run(collect()) == ["a", "b"]
+    finally:
+        llm_client._stream_openrouter, llm_client._stream_deepseek = saved
+    print("✅ Поток переключается на другой бэкенд до первого куска")
+
+
+def test_response_format():
+    """Тест: схема ответа доходит до OpenRouter как есть, DeepSeek получает JSON-режим без схемы"""
+    from app.llm_client import _routed_call
+    from app.schemas import DayPlanResponse, response_format
+
+    seen = {}
+
+    async def broken(messages, model, max_tokens, temperature, response_format=None):
+        seen["openrouter"] = response_format
+        raise _http_error(503)
+
+    async def healthy(messages, model, max_tokens, temperature, response_format=None):
+        seen["deepseek"] = response_format
+        return '{"day_plan": "ok"}'
+
+    schema = response_format(DayPlanResponse)
+    with fake_backends(broken, healthy):
+        assert asyncio.run(_routed_call([], "m", 100, 0.2, schema)) == '{"day_plan": "ok"}'
+    assert seen == {"openrouter": schema, "deepseek": {"type": "json_object"}}, seen
+    print("✅ response_format передаётся с учётом бэкенда")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты роутера LLM")
+    print("=" * 50)
+
+    tests = [
+        ("Тест переключения и автомата", test_failover_and_breaker),
+        ("Тест повторов", test_retry_and_client_errors),
+        ("Тест дублирующих запросов", test_hedging),
+        ("Тест быстрого сбоя при дублировании", test_hedging_fast_failure),
+        ("Тест переключения потока", test_stream_failover),
+        ("Тест response_format", test_response_format),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _run_jobs(scheduler, jobs, hold=0.01):
+    """Запускает jobs [(user, priority)] по порядку; возвращает порядок, в котором они получили слот"""
+    order = []
+
+    async def job(name, user, priority):
+        async with scheduler.slot(user, priority):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    tasks = []
+    for i, (user, priority) in enumerate(jobs):
+        tasks.append(asyncio.create_task(job(f"{user}{i}", user, priority)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_round_robin():
+    """Тест: запросы разных пользователей чередуются, а не идут пачкой от одного"""
+    from app.llm_client import LLMScheduler, PRIORITY_INTERACTIVE as P
+
+    scheduler = LLMScheduler(max_concurrency=1, max_per_user=10, max_queued=100)
+    order = asyncio.run(_run_jobs(scheduler, [("a", P)] * 4 + [("b", P)] * 2))
+    assert order == ["a0", "a1", "b4", "a2", "b5", "a3"], order
+    assert scheduler.stats()["served"] == 6 and scheduler.stats()["active"] == 0
+    print("✅ Пользователи обслуживаются по кругу")
+
+
+def test_priority():
+    """Тест: вопрос пользователя обгоняет фоновый анализ в очереди"""
+    from app.llm_client import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+    scheduler = LLMScheduler(max_concurrency=1, max_per_user=10, max_queued=100)
+    jobs = [("a", PRIORITY_BACKGROUND)] * 3 + [("b", PRIORITY_INTERACTIVE)]
+    order = asyncio.run(_run_jobs(scheduler, jobs))
+    assert order == ["a0", "b3", "a1", "a2"], order
+    print("✅ Интерактивные запросы идут раньше фоновых")
+
+
+def test_concurrency_and_limits():
+    """Тест: не больше max_concurrency одновременно, переполнение и таймаут — LLMQueueFull"""
+    from app.llm_client import LLMScheduler, LLMQueueFull
+
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=2, max_per_user=1, max_queued=2, timeout=0.05)
+        running, peak = 0, 0
+        release = asyncio.Event()
+
+        async def job(user):
+            nonlocal running, peak
+            async with scheduler.slot(user):
+                running += 1
+                peak = max(peak, running)
+                await release.wait()
+                running -= 1
+
+        holders = [asyncio.create_task(job("a")), asyncio.create_task(job("b"))]
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(job("a"))
+        await asyncio.sleep(0)
+        try:
+            await job("a")                      # у "a" уже один в очереди
+            raise AssertionError("ожидался LLMQueueFull")
+        except LLMQueueFull:
+            pass
+        try:
+            await waiting                       # слоты так и не освободились — таймаут
+            raise AssertionError("ожидался LLMQueueFull")
+        except LLMQueueFull:
+            pass
+
+        cancelled = asyncio.create_task(job("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert scheduler.stats()["queued"] == 0
+
+        release.set()
+        await asyncio.gather(*holders)
+        stats = scheduler.stats()
+        assert peak == 2 and stats["active"] == 0 and stats["rejected"] == 2, (peak, stats)
+
+    asyncio.run(scenario())
+    print("✅ Лимиты параллельности и очередей соблюдаются")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты планировщика запросов к LLM")
+    print("=" * 50)
+
+    tests = [
+        ("Тест обхода по кругу", test_round_robin),
+        ("Тест приоритетов", test_priority),
+        ("Тест лимитов", test_concurrency_and_limits),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeDriver:
+    """asyncpg-соединение без сервера: запоминает COPY"""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.events.append(("copy", table, list(columns), list(records)))
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    """Сессия PostgreSQL+asyncpg без сервера: запросы и COPY пишутся в один журнал по порядку"""
+
+    def __init__(self, inserted: int = 0):
+        self.events = []
+        self.inserted = inserted
+        raw = SimpleNamespace(driver_connection=FakeDriver(self.events))
+
+        async def get_raw_connection():
+            return raw
+
+        self.conn = SimpleNamespace(
+            dialect=SimpleNamespace(name="postgresql", driver="asyncpg"),
+            get_raw_connection=get_raw_connection,
+        )
+
+    async def connection(self):
+        return self.conn
+
+    async def execute(self, statement, params=None):
+        self.events.append(("sql", str(statement)))
+        return FakeResult(self.inserted)
+
+
+def _rows(n, start=datetime(2025, 3, 1, 9, 0)):
+    return [{"timestamp": start + timedelta(seconds=i), "focus": float(i), "stress": None} for i in range(n)]
+
+
+def test_copy_opens_transaction():
+    """Тест: перед COPY в сессии выполняется запрос, чтобы COPY попал в транзакцию сессии"""
+    from app.crud import _copy_metric_rows, METRIC_COLUMNS
+    from app.utils import MetricsColumns
+
+    session = FakeSession()
+    n = asyncio.run(_copy_metric_rows(session, 7, MetricsColumns.from_rows(_rows(3))))
+    assert n == 3
+    assert session.events[0] == ("sql", "SELECT 1")
+    kind, table, columns, records = session.events[1]
+    assert (kind, table, columns) == ("copy", "metrics", METRIC_COLUMNS)
+    focus = METRIC_COLUMNS.index("focus")
+    assert [r[0] for r in records] == [7, 7, 7] and [r[focus] for r in records] == [0.0, 1.0, 2.0]
+    assert all(r[METRIC_COLUMNS.index("stress")] is None for r in records)
+    print("✅ COPY внутри транзакции сессии")
+
+
+def test_stage_upsert():
+    """Тест: COPY во временную таблицу и INSERT ... ON CONFLICT, новые строки — по RETURNING, повторы меток в куске убраны"""
+    from app import crud
+    from app.config import settings
+
+    rows = _rows(4)
+    rows.append({**rows[1], "focus": 99.0})
+    rollups = settings.METRICS_ROLLUPS
+    settings.METRICS_ROLLUPS = False
+    try:
+        session = FakeSession(inserted=3)
+        new, known = asyncio.run(crud._insert_metric_rows(session, 7, rows, "ignore"))
+        update = FakeSession(inserted=3)
+        asyncio.run(crud._insert_metric_rows(update, 7, rows, "update"))
+        fresh = FakeSession(inserted=4)
+        asyncio.run(crud._insert_metric_rows(fresh, 7, rows, "update"))
+    finally:
+        settings.METRICS_ROLLUPS = rollups
+
+    # 4 уникальные метки, вставлены 3 (одна уже была в БД), плюс повтор внутри куска
+    assert (new, known) == (3, 2)
+    kinds = [event[0] for event in session.events]
+    assert kinds == ["sql", "sql", "sql", "copy", "sql"]
+    assert session.events[0][1].startswith("CREATE TEMP TABLE IF NOT EXISTS metrics_stage ON COMMIT DROP")
+    assert session.events[1][1] == "TRUNCATE metrics_stage"
+    _, table, _, records = session.events[3]
+    assert table == "metrics_stage" and len(records) == 4
+    upsert = session.events[4][1]
+    assert "INSERT INTO metrics" in upsert and "ON CONFLICT (user_id, timestamp) DO NOTHING" in upsert
+    assert "RETURNING user_id" in upsert and "SELECT count(*) FROM ins" in upsert
+
+    # в режиме update остаётся последнее значение повтора и значения перезаписываются
+    _, _, columns, records = update.events[3]
+    by_time = {r[columns.index("timestamp")]: r[columns.index("focus")] for r in records}
+    assert len(by_time) == 4 and by_time[rows[1]["timestamp"]] == 99
+    # уже известные строки перезаписывает отдельный UPDATE; если вставилось всё, он не нужен
+    assert [event[0] for event in update.events] == ["sql", "sql", "sql", "copy", "sql", "sql"]
+    overwrite = update.events[5][1]
+    assert overwrite.startswith("UPDATE metrics m SET") and "focus = s.focus" in overwrite
+    assert "m.focus IS DISTINCT FROM s.focus" in overwrite
+    assert len(fresh.events) == 5
+    print("✅ Upsert через временную таблицу")
+
+
+def test_postgres_roundtrip():
+    """
+    Тест на настоящем PostgreSQL (TEST_DATABASE_URL, postgresql+asyncpg://...): _insert_metric_rows в режимах
+    ignore и update, откат COPY вместе с сессией и счёт новых строк при параллельных загрузках.
+    Без TEST_DATABASE_URL пропускается. Таблицы должны быть созданы (create_tables.py), временный пользователь удаляется.
+    """
+    database_url = os.getenv("TEST_DATABASE_URL")
+    if not database_url:
+        print("⏭️ TEST_DATABASE_URL не задан — пропущен")
+        return
+    import time
+    from sqlalchemy import delete, select
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.crud import _insert_metric_rows
+    from app.models import Metric, MetricDaily, MetricHourly, User
+
+    rows = _rows(100)
+
+    async def stored(session_factory, user_id):
+        async with session_factory() as session:
+            res = await session.execute(select(Metric.timestamp, Metric.focus).where(Metric.user_id == user_id))
+            return dict(res.all())
+
+    async def scenario():
+        engine = create_async_engine(database_url)
+        session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with session_factory() as session:
+            user = User(telegram_id=-int(time.time() * 1000), name="test_metrics_copy")
+            session.add(user)
+            await session.commit()
+            user_id = user.user_id
+        try:
+            results = {}
+            async with session_factory() as session:
+                results["ignore"] = await _insert_metric_rows(session, user_id, rows[:60], "ignore")
+                await session.commit()
+            # пересекается с первой загрузкой на 20 меток, плюс повтор метки внутри куска
+            changed = [{**row, "focus": row["focus"] + 1000} for row in rows[40:]]
+            changed.append({**changed[0], "focus": -1.0})
+            async with session_factory() as session:
+                results["update"] = await _insert_metric_rows(session, user_id, changed, "update")
+                await session.commit()
+            results["after_update"] = await stored(session_factory, user_id)
+
+            later = _rows(50, start=datetime(2025, 3, 2, 9, 0))
+            async with session_factory() as session:
+                results["rolled_back"] = await _insert_metric_rows(session, user_id, later, "ignore")
+                await session.rollback()
+            results["after_rollback"] = len(await stored(session_factory, user_id))
+
+            async def concurrent(delay):
+                # вторая загрузка ждёт на конфликте, пока первая не закоммитит те же метки
+                async with session_factory() as session:
+                    await asyncio.sleep(delay)
+                    counts = await _insert_metric_rows(session, user_id, later, "ignore")
+                    await asyncio.sleep(0.3)
+                    await session.commit()
+                    return counts
+            results["concurrent"] = await asyncio.gather(concurrent(0), concurrent(0.1))
+            results["total"] = len(await stored(session_factory, user_id))
+            return results
+        finally:
+            async with session_factory() as session:
+                for model in (Metric, MetricHourly, MetricDaily):
+                    await session.execute(delete(model).where(model.user_id == user_id))
+                await session.execute(delete(User).where(User.user_id == user_id))
+                await session.commit()
+            await engine.dispose()
+
+    results = asyncio.run(scenario())
+    assert results["ignore"] == (60, 0)
+    assert results["update"] == (40, 21)
+    values = results["after_update"]
+    assert len(values) == 100 and values[rows[10]["timestamp"]] == 10
+    assert values[rows[40]["timestamp"]] == -1 and values[rows[90]["timestamp"]] == 1090
+    assert results["rolled_back"] == (50, 0) and results["after_rollback"] == 100
+    # обе загрузки писали одни и те же 50 меток: новыми они считаются только у одной
+    assert sorted(results["concurrent"]) == [(0, 50), (50, 0)]
+    assert results["total"] == 150
+    print("✅ COPY и upsert на PostgreSQL")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты записи метрик через COPY")
+    print("=" * 50)
+
+    tests = [
+        ("Тест транзакции COPY", test_copy_opens_transaction),
+        ("Тест upsert через временную таблицу", test_stage_upsert),
+        ("Тест на настоящем PostgreSQL", test_postgres_roundtrip),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
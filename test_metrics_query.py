@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+START = datetime(2025, 3, 1, 9, 0)
+# 100 строк через 30 минут: чуть больше двух суток
+TIMES = [START + timedelta(minutes=30 * i) for i in range(100)]
+
+
+async def _with_metrics(scenario):
+    """
+    SQLite во временном файле: у пользователя 100 строк (focus = номер строки), у соседа — те же метки
+    с другими значениями, две загрузки (последняя — строки 60..79). Вызывает scenario(session, user_id).
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app import crud
+    from app.models import Base
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bci.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+        crud._user_cache.clear()
+        try:
+            async with session_factory() as session:
+                user = await crud.get_or_create_user(session, telegram_id=1001, name="Анна")
+                other = await crud.get_or_create_user(session, telegram_id=1002, name="Борис")
+                await crud.save_metrics_bulk(session, user.user_id, [{"timestamp": t, "focus": i} for i, t in enumerate(TIMES)])
+                await crud.save_metrics_bulk(session, other.user_id, [{"timestamp": t, "focus": -1} for t in TIMES])
+                await crud.save_metric_upload(session, user.user_id, "a" * 64, rows_count=50,
+                                              first_timestamp=TIMES[0], last_timestamp=TIMES[49])
+                await crud.save_metric_upload(session, user.user_id, "b" * 64, rows_count=20,
+                                              first_timestamp=TIMES[60], last_timestamp=TIMES[79])
+            async with session_factory() as session:
+                return await scenario(session, user.user_id)
+        finally:
+            crud._user_cache.clear()
+            await engine.dispose()
+
+
+def _focus(rows):
+    return [row["focus"] for row in rows]
+
+
+def test_window_bounds_and_order():
+    """Тест: границы окна включительно, по возрастанию времени, newest=True берёт последние строки"""
+    from app.crud import get_metric_rows, get_recent_metrics, get_last_upload_metrics
+
+    async def scenario(session, user_id):
+        return {
+            "window": await get_metric_rows(session, user_id, start=TIMES[10], end=TIMES[20]),
+            "first": await get_metric_rows(session, user_id, start=TIMES[10], end=TIMES[20], limit=5),
+            "newest": await get_metric_rows(session, user_id, start=TIMES[10], end=TIMES[20], limit=5, newest=True),
+            "all": await get_metric_rows(session, user_id),
+            "recent": await get_recent_metrics(session, user_id, limit=10),
+            "recent_day": await get_recent_metrics(session, user_id, limit=120, last_days=1),
+            "last_upload": await get_last_upload_metrics(session, user_id),
+            "last_upload_tail": await get_last_upload_metrics(session, user_id, limit=5),
+            "nobody": await get_recent_metrics(session, user_id + 100, limit=10, last_days=1),
+        }
+
+    result = asyncio.run(_with_metrics(scenario))
+    assert _focus(result["window"]) == list(range(10, 21))
+    assert result["window"][0]["timestamp"] == TIMES[10] and set(result["window"][0]) >= {"timestamp", "focus", "stress"}
+    assert _focus(result["first"]) == list(range(10, 15))
+    # последние строки окна, но в ответе по-прежнему по возрастанию времени
+    assert _focus(result["newest"]) == list(range(16, 21))
+    assert _focus(result["all"]) == list(range(100))
+    assert _focus(result["recent"]) == list(range(90, 100))
+    # сутки до последней сохранённой метки, включая границу
+    assert _focus(result["recent_day"]) == list(range(51, 100))
+    assert _focus(result["last_upload"]) == list(range(60, 80))
+    assert _focus(result["last_upload_tail"]) == list(range(75, 80))
+    assert result["nobody"] == []
+    print("✅ Окна, порядок и последние строки")
+
+
+def test_keyset_pages():
+    """Тест: страницы идут подряд без пропусков и повторов, курсор продолжает с места остановки"""
+    from app.crud import get_metric_page, iter_metric_pages
+
+    async def scenario(session, user_id):
+        first, cursor = await get_metric_page(session, user_id, limit=30)
+        second, _ = await get_metric_page(session, user_id, after=cursor, limit=30)
+        pages = [page async for page in iter_metric_pages(session, user_id, page_size=30)]
+        # окно из 60 строк ровно на две страницы: третья пустая, генератор её не отдаёт
+        exact = [page async for page in iter_metric_pages(session, user_id, start=TIMES[20], end=TIMES[79], page_size=30)]
+        last, last_cursor = await get_metric_page(session, user_id, after=TIMES[95], limit=30)
+        return first, cursor, second, pages, exact, last, last_cursor
+
+    first, cursor, second, pages, exact, last, last_cursor = asyncio.run(_with_metrics(scenario))
+    assert _focus(first) == list(range(30)) and cursor == TIMES[29]
+    assert _focus(second) == list(range(30, 60))
+    assert [len(page) for page in pages] == [30, 30, 30, 10]
+    assert [value for page in pages for value in _focus(page)] == list(range(100))
+    assert [_focus(page) for page in exact] == [list(range(20, 50)), list(range(50, 80))]
+    assert _focus(last) == list(range(96, 100)) and last_cursor is None
+    print("✅ Keyset-пагинация")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты чтения метрик")
+    print("=" * 50)
+
+    tests = [
+        ("Тест окон и порядка", test_window_bounds_and_order),
+        ("Тест keyset-пагинации", test_keyset_pages),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
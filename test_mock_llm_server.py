@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+import time
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _with_mock(argv, scenario):
+    """Запускает мок с параметрами argv, направляет на него DeepSeek и выполняет scenario()"""
+    import mock_llm_server
+    from app import llm_client
+
+    runner, port = await mock_llm_server.start(mock_llm_server.parse_args(argv + ["--seed", "1"]))
+    saved = llm_client.DEEPSEEK_ENDPOINT, llm_client.settings.DEEPSEEK_API_KEY
+    llm_client.DEEPSEEK_ENDPOINT = f"http://127.0.0.1:{port}/v1/chat/completions"
+    llm_client.settings.DEEPSEEK_API_KEY = "mock"
+    try:
+        return await scenario()
+    finally:
+        llm_client.DEEPSEEK_ENDPOINT, llm_client.settings.DEEPSEEK_API_KEY = saved
+        await llm_client.close_llm_client()
+        await runner.cleanup()
+
+
+def test_structured_and_stream():
+    """Тест: ответ по схеме разбирается parse_llm_json, поток приходит кусками"""
+    from app.llm_client import _call_deepseek, _stream_deepseek
+    from app.schemas import ImprovementSuggestionsResponse, parse_llm_json, response_format
+
+    messages = [{"role": "user", "content": "Советы"}]
+
+    async def scenario():
+        raw = await _call_deepseek(messages, "m", response_format=response_format(ImprovementSuggestionsResponse))
+        pieces = [p async for p in _stream_deepseek(messages, "m", max_tokens=20)]
+        return raw, pieces
+
+    raw, pieces = asyncio.run(_with_mock(
+        ["--latency", "fixed", "--median-ms", "0", "--tokens-per-sec", "10000", "--response-tokens", "30"], scenario
+    ))
+    data = parse_llm_json(raw, ImprovementSuggestionsResponse)
+    assert len(data["improvement_suggestions"]) == 3
+    assert len(pieces) == 20 and all(pieces)   # max_tokens ограничивает длину ответа
+    print("✅ Ответ по схеме и поток")
+
+
+def test_latency_and_errors():
+    """Тест: задержка до первого токена и доля ошибок соблюдаются"""
+    import httpx
+    from app.llm_client import _call_deepseek
+
+    async def timed():
+        started = time.monotonic()
+        await _call_deepseek([], "m")
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(_with_mock(
+        ["--latency", "fixed", "--median-ms", "200", "--tokens-per-sec", "10000", "--response-tokens", "5"], timed
+    ))
+    assert 0.2 <= elapsed < 1.0, elapsed
+
+    async def failing():
+        try:
+            await _call_deepseek([], "m")
+        except httpx.HTTPStatusError as e:
+            return e.response.status_code
+        return None
+
+    code = asyncio.run(_with_mock(["--latency", "fixed", "--median-ms", "0", "--error-rate", "1",
+                                   "--error-codes", "503"], failing))
+    assert code == 503
+    print(f"✅ Задержка {elapsed * 1000:.0f} мс, ошибки отдаются с заданным кодом")
+
+
+def test_json_object_schema():
+    """Тест: в JSON-режиме без схемы (как у DeepSeek) ответ строится по схеме, ключи которой названы в промпте"""
+    from app.llm_client import LLMBackend, DEEPSEEK_ENDPOINT
+    from app.schemas import (
+        UploadAnalysis, DayPlanResponse, ImprovementSuggestionsResponse, parse_llm_json, response_format,
+    )
+
+    prompts = {
+        UploadAnalysis: 'Верни JSON-объект с ключами "full_report", "day_plan", "improvement_suggestions".',
+        DayPlanResponse: 'Ответ верни СТРОГО в JSON с ключом "day_plan".',
+        ImprovementSuggestionsResponse: 'Ответ верни СТРОГО в JSON с ключом "improvement_suggestions" (массив строк).',
+    }
+    deepseek = LLMBackend("deepseek", DEEPSEEK_ENDPOINT, "DEEPSEEK_API_KEY")
+
+    async def scenario():
+        answers = {}
+        for model, prompt in prompts.items():
+            # бэкенд DeepSeek сам заменяет json_schema на json_object
+            answers[model] = await deepseek.call([{"role": "user", "content": prompt}], "m", 200, 0.2,
+                                                 response_format(model))
+        answers[None] = await deepseek.call([{"role": "user", "content": "JSON"}], "m", 200, 0.2,
+                                            {"type": "json_object"})
+        return answers
+
+    answers = asyncio.run(_with_mock(
+        ["--latency", "fixed", "--median-ms", "0", "--tokens-per-sec", "10000", "--response-tokens", "30"], scenario
+    ))
+    assert parse_llm_json(answers[UploadAnalysis], UploadAnalysis)["full_report"]
+    assert parse_llm_json(answers[DayPlanResponse], DayPlanResponse)["day_plan"]
+    data = parse_llm_json(answers[ImprovementSuggestionsResponse], ImprovementSuggestionsResponse)
+    assert len(data["improvement_suggestions"]) == 3
+    assert list(parse_llm_json(answers[None])) == ["answer"]
+
+    import mock_llm_server
+    args = mock_llm_server.parse_args(["--json-object-schema", "DayPlanResponse"])
+    forced = mock_llm_server.completion_text({"response_format": {"type": "json_object"}, "messages": []}, args)
+    assert list(parse_llm_json(forced, DayPlanResponse)) == ["day_plan"]
+    print("✅ JSON-режим без схемы отвечает по схеме из промпта")
+
+
+def test_lognormal_latency():
+    """Тест: логнормальная задержка — медиана и p95 близки к заданным"""
+    import random
+    import mock_llm_server
+
+    args = mock_llm_server.parse_args(["--median-ms", "800", "--p95-ms", "3000"])
+    random.seed(7)
+    delays = sorted(mock_llm_server.first_token_delay(args) for _ in range(20000))
+    median, p95 = delays[len(delays) // 2], delays[int(len(delays) * 0.95)]
+    assert 0.75 < median < 0.85 and 2.8 < p95 < 3.2, (median, p95)
+    print(f"✅ Медиана {median:.2f} с, p95 {p95:.2f} с")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты мок-сервера LLM")
+    print("=" * 50)
+
+    tests = [
+        ("Тест ответа по схеме и потока", test_structured_and_stream),
+        ("Тест задержки и ошибок", test_latency_and_errors),
+        ("Тест JSON-режима без схемы", test_json_object_schema),
+        ("Тест распределения задержки", test_lognormal_latency),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
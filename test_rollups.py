@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+from datetime import datetime, date
+from types import SimpleNamespace
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeSession:
+    """Сессия без БД: запоминает запросы, скомпилированные для PostgreSQL"""
+
+    def __init__(self, dialect: str = "postgresql"):
+        self.dialect = dialect
+        self.statements = []
+
+    async def connection(self):
+        return SimpleNamespace(dialect=SimpleNamespace(name=self.dialect))
+
+    async def execute(self, statement, params=None):
+        from sqlalchemy.dialects import postgresql
+        self.statements.append(statement.compile(dialect=postgresql.dialect()))
+        return SimpleNamespace(mappings=lambda: [])
+
+
+def test_refresh_statements():
+    """Тест: пересчёт задевает целые часы и дни окна и пишет их upsert'ом, на других БД ничего не делает"""
+    from app.crud import refresh_metric_rollups
+
+    session = FakeSession()
+    asyncio.run(refresh_metric_rollups(session, 7, datetime(2025, 3, 1, 9, 15), datetime(2025, 3, 2, 18, 40)))
+    hourly, daily = session.statements
+    sql = str(hourly)
+    assert sql.startswith("INSERT INTO metrics_hourly") and "date_trunc" in sql and "FROM metrics" in sql
+    assert "ON CONFLICT (user_id, bucket) DO UPDATE" in sql and "focus_sum = excluded.focus_sum" in sql
+    params = hourly.params
+    assert datetime(2025, 3, 1, 9) in params.values() and datetime(2025, 3, 2, 19) in params.values()
+
+    sql = str(daily)
+    assert sql.startswith("INSERT INTO metrics_daily") and "FROM metrics_hourly" in sql
+    assert "min(metrics_hourly.stress_min)" in sql and "sum(metrics_hourly.stress_n)" in sql
+    assert datetime(2025, 3, 1) in daily.params.values() and datetime(2025, 3, 3) in daily.params.values()
+
+    other = FakeSession("sqlite")
+    asyncio.run(refresh_metric_rollups(other, 7, datetime(2025, 3, 1), datetime(2025, 3, 2)))
+    assert other.statements == []
+    print("✅ Пересчёт агрегатов за окно")
+
+
+def test_rollup_rows_and_prompt():
+    """Тест: средние из суммы и числа значений, агрегаты попадают в промпт компактными таблицами"""
+    from app.crud import _rollup_row
+    from app.models import ROLLUP_METRICS
+    from app.utils import build_prompt_for_llm, encode_rollups_compact
+
+    raw = {"user_id": 7, "bucket": date(2025, 3, 1), "rows": 120}
+    for key in ROLLUP_METRICS:
+        raw.update({f"{key}_sum": None, f"{key}_min": None, f"{key}_max": None, f"{key}_n": 0})
+    raw.update({"focus_sum": 6000.0, "focus_min": 10.0, "focus_max": 90.0, "focus_n": 100})
+    day = _rollup_row(raw)
+    assert day["timestamp"] == datetime(2025, 3, 1) and day["rows"] == 120
+    assert day["focus"] == 60.0 and day["focus_max"] == 90.0 and day["stress"] is None
+
+    hour = {**day, "timestamp": datetime(2025, 3, 1, 14), "focus": 61.25}
+    assert encode_rollups_compact([day], "day") == "day\tn\tfocus\n2025-03-01\t120\t60"
+    assert encode_rollups_compact([hour], "hour") == "hour\tn\tfocus\n# 2025-03-01\n14:00\t120\t61.2"
+
+    rows = [{"timestamp": datetime(2025, 3, 2, 9, 0), "focus": 70}]
+    plain = build_prompt_for_llm("Анна", rows, "инструкция", encoding="compact")
+    assert "averages" not in plain
+    assert build_prompt_for_llm("Анна", rows, "инструкция", encoding="compact", history={"hour": [], "day": []}) == plain
+    full = build_prompt_for_llm("Анна", rows, "инструкция", encoding="compact", history={"hour": [hour], "day": [day]})
+    assert full.index("Daily averages") < full.index("Hourly averages") < full.index("Metrics (TSV")
+    print("✅ Агрегаты в промпте")
+
+
+def test_history_until():
+    """Тест: история для загрузки заканчивается на конце файла, а не на последней метке пользователя"""
+    from app.crud import get_rollup_history
+
+    session = FakeSession()
+    until = datetime(2025, 3, 10, 18, 30)
+    history = asyncio.run(get_rollup_history(session, 7, hourly_days=2, daily_days=30, until=until))
+    assert history == {"hour": [], "day": []}
+    # метка пользователя не запрашивается: только два запроса к агрегатам
+    hourly, daily = session.statements
+    assert "FROM metrics_hourly" in str(hourly) and "FROM metrics_daily" in str(daily)
+    assert set(hourly.params.values()) >= {7, datetime(2025, 3, 8, 18, 30), until}
+    assert set(daily.params.values()) >= {7, date(2025, 2, 8), date(2025, 3, 10)}
+    print("✅ История до конца загрузки")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты агрегатов метрик")
+    print("=" * 50)
+
+    tests = [
+        ("Тест пересчёта агрегатов", test_refresh_statements),
+        ("Тест агрегатов в промпте", test_rollup_rows_and_prompt),
+        ("Тест истории до конца загрузки", test_history_until),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_response_format():
+    """Тест: строгая JSON-схема для response_format"""
+    from app.schemas import UploadAnalysis, response_format
+
+    fmt = response_format(UploadAnalysis)
+    assert fmt["type"] == "json_schema" and fmt["json_schema"]["strict"] is True
+    schema = fmt["json_schema"]["schema"]
+    assert schema["required"] == ["full_report", "day_plan", "improvement_suggestions"]
+    assert schema["additionalProperties"] is False
+    assert schema["properties"]["improvement_suggestions"] == {"type": "array", "items": {"type": "string"}}
+    assert "description" not in schema and all("default" not in p for p in schema["properties"].values())
+    print("✅ Схема строгая")
+
+
+def test_single_pass_and_repair():
+    """Тест: валидный JSON разбирается с первого раза, битый — починкой, счётчики это показывают"""
+    import json
+    from app.schemas import DayPlanResponse, ImprovementSuggestionsResponse, UploadAnalysis, parse_llm_json, llm_json_stats
+
+    before = llm_json_stats()
+    assert parse_llm_json('{"day_plan": "Работа 9:00–12:00 «глубокая»"}', DayPlanResponse) == {
+        "day_plan": "Работа 9:00–12:00 «глубокая»"
+    }
+    fenced = '```json\n{"improvement_suggestions": ["Спать до 23:00",],}\n```'
+    assert parse_llm_json(fenced, ImprovementSuggestionsResponse) == {"improvement_suggestions": ["Спать до 23:00"]}
+    # пропущенные поля разбора загрузки — пустые, лишние сохраняются
+    assert parse_llm_json('{"day_plan": "x", "extra": 1}', UploadAnalysis) == {
+        "day_plan": "x", "extra": 1, "full_report": "", "improvement_suggestions": []
+    }
+    try:
+        parse_llm_json("модель ответила текстом")
+        raise AssertionError("ожидалась ошибка разбора")
+    except json.JSONDecodeError:
+        pass
+    after = llm_json_stats()
+    assert after["parsed"] - before["parsed"] == 2
+    assert after["repaired"] - before["repaired"] == 1
+    assert after["failed"] - before["failed"] == 1
+    print("✅ Один проход, починка и счётчики работают")
+
+
+def test_validation():
+    """Тест: ответ не по схеме не проходит проверку"""
+    from pydantic import ValidationError
+    from app.schemas import DayPlanResponse, parse_llm_json
+
+    try:
+        parse_llm_json('{"plan": "x"}', DayPlanResponse)
+        raise AssertionError("ожидалась ошибка проверки")
+    except ValidationError:
+        pass
+    print("✅ Ответ проверяется по модели")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты структурированных ответов LLM")
+    print("=" * 50)
+
+    tests = [
+        ("Тест схемы", test_response_format),
+        ("Тест разбора", test_single_pass_and_repair),
+        ("Тест проверки", test_validation),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
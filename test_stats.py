@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def one(self):
+        return self.rows[0]
+
+
+class FakeSession:
+    """Сессия без БД: запоминает текст запросов и отвечает заготовками по подстроке в SQL"""
+
+    def __init__(self, dialect: str, answers: dict):
+        self.dialect = dialect
+        self.answers = answers
+        self.statements = []
+
+    async def connection(self):
+        return SimpleNamespace(dialect=SimpleNamespace(name=self.dialect))
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        for marker, rows in self.answers.items():
+            if marker in sql:
+                return FakeResult(rows)
+        raise AssertionError(f"неожиданный запрос: {sql}")
+
+
+def test_exact_single_query():
+    """Тест: точный подсчёт — один запрос на все таблицы; без PostgreSQL другие режимы сводятся к нему"""
+    from app.models import STATS_COUNTED_TABLES
+    from app.stats import table_counts
+
+    row = SimpleNamespace(_mapping={table: n for n, table in enumerate(STATS_COUNTED_TABLES, 1)})
+    session = FakeSession("sqlite", {"count(*)": [row]})
+    counts, mode = asyncio.run(table_counts(session, "estimate"))
+    assert mode == "exact" and counts["users"] == 1 and counts["improvement_suggestions"] == 5
+    assert len(session.statements) == 1
+    assert all(f"FROM {table}" in session.statements[0] for table in STATS_COUNTED_TABLES)
+    print("✅ Точный подсчёт одним запросом")
+
+
+def test_counters_and_fallback():
+    """Тест: счётчики суммируются по слотам, без установленных счётчиков берётся оценка pg_class"""
+    from app.models import STATS_COUNTED_TABLES
+    from app.stats import table_counts
+
+    counters = [(table, 10) for table in STATS_COUNTED_TABLES]
+    session = FakeSession("postgresql", {"table_counters": counters})
+    counts, mode = asyncio.run(table_counts(session, "counters"))
+    assert mode == "counters" and counts["metrics"] == 10
+    assert "sum(table_counters.rows)" in session.statements[0]
+
+    session = FakeSession("postgresql", {"table_counters": [("metrics", 5)], "reltuples": [("metrics", 1200000)]})
+    counts, mode = asyncio.run(table_counts(session, "counters"))
+    assert mode == "estimate" and counts["metrics"] == 1200000 and counts["users"] == 0
+    assert "count(*)" not in session.statements[-1]
+
+    try:
+        asyncio.run(table_counts(session, "fast"))
+        assert False, "нет ValueError для неизвестного режима"
+    except ValueError:
+        pass
+    print("✅ Счётчики и переход на оценку")
+
+
+def test_breakdown_and_ingest():
+    """Тест: разбивка по пользователям берётся из user_stats, а без неё — из metric_uploads; скорость загрузки"""
+    from app.stats import user_breakdown, ingest_rate, INGEST_WINDOWS
+
+    session = FakeSession("postgresql", {"user_stats": [], "metric_uploads": [(1001, "Анна", 5000, None, None)]})
+    users, source = asyncio.run(user_breakdown(session, limit=3))
+    assert source == "uploads" and users[0]["rows"] == 5000
+    assert "metrics " not in " ".join(session.statements)
+
+    session = FakeSession("postgresql", {"metric_uploads": [(2, 4800, 3, 9600)]})
+    rate = asyncio.run(ingest_rate(session))
+    assert list(rate) == list(INGEST_WINDOWS)
+    assert rate[24] == {"uploads": 2, "rows": 4800, "rows_per_hour": 200.0}
+    assert len(session.statements) == 1
+    print("✅ Разбивка по пользователям и скорость загрузки")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты статистики /db_stats")
+    print("=" * 50)
+
+    tests = [
+        ("Тест точного подсчёта", test_exact_single_query),
+        ("Тест счётчиков", test_counters_and_fallback),
+        ("Тест разбивки и скорости загрузки", test_breakdown_and_ingest),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeMessage:
+    """Минимальная замена telegram.Message: запоминает правки и новые сообщения"""
+
+    def __init__(self, text, sent=None):
+        self.text = text
+        self.markup = None
+        self.chat_id = 1
+        self.edits = []
+        self.sent = [] if sent is None else sent
+
+    async def edit_text(self, text, reply_markup=None):
+        self.text = text
+        self.markup = reply_markup
+        self.edits.append((text, reply_markup))
+
+    async def delete(self):
+        self.text = None
+
+    def get_bot(self):
+        message = self
+
+        class Bot:
+            async def send_message(self, chat_id, text, reply_markup=None):
+                new = FakeMessage(text, message.sent)
+                new.markup = reply_markup
+                message.sent.append(new)
+                return new
+
+        return Bot()
+
+
+async def _chunks(pieces):
+    for piece in pieces:
+        yield piece
+
+
+def test_split_message():
+    """Тест разбиения длинного текста под лимит Telegram"""
+    from app.streaming import split_message
+
+    assert split_message("коротко", limit=20) == ["коротко"]
+    text = "строка один\nстрока два\nстрока три"
+    pages = split_message(text, limit=15)
+    assert all(len(p) <= 15 for p in pages)
+    assert " ".join(pages).replace("\n", " ").split() == text.split()
+    assert split_message("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+    print("✅ Текст режется по строкам и не превышает лимит")
+
+
+def test_stream_to_message():
+    """Тест потокового вывода: правки, кнопки в конце, продолжение в новых сообщениях"""
+    from app import streaming
+    from app.streaming import stream_to_message
+
+    placeholder = FakeMessage("🤔 Обрабатываю...")
+    answer = asyncio.run(stream_to_message(
+        placeholder, _chunks(["При", "вет", "!"]), prefix="Ответ:\n\n", reply_markup="kb", interval=0
+    ))
+    assert answer == "Привет!"
+    assert placeholder.edits[0][0] == "Ответ:\n\nПри" + streaming.CURSOR
+    assert placeholder.edits[-1] == ("Ответ:\n\nПривет!", "kb")
+
+    # с большим интервалом промежуточных правок нет — только итоговая
+    placeholder = FakeMessage("...")
+    asyncio.run(stream_to_message(placeholder, _chunks(["a", "b", "c"]), interval=60))
+    assert [t for t, _ in placeholder.edits] == ["a" + streaming.CURSOR, "abc"]
+
+    original = streaming.MESSAGE_LIMIT
+    streaming.MESSAGE_LIMIT = 12
+    try:
+        placeholder = FakeMessage("...")
+        words = ["слово "] * 6
+        asyncio.run(stream_to_message(placeholder, _chunks(words), reply_markup="kb", interval=0))
+    finally:
+        streaming.MESSAGE_LIMIT = original
+    pages = [placeholder] + placeholder.sent
+    assert [m.text for m in pages] == ["слово слово", "слово слово", "слово слово "]
+    assert [m.markup for m in pages] == [None, None, "kb"]
+    print("✅ Ответ дописывается правками и продолжается в новых сообщениях")
+
+
+def test_llm_sse_stream():
+    """Тест разбора SSE-потока OpenAI-совместимого API"""
+    import json
+    import httpx
+    from app import llm_client
+
+    events = [
+        ": OPENROUTER PROCESSING",
+        "",
+        "data: " + json.dumps({"choices": [{"delta": {"role": "assistant"}}]}),
+        "",
+        "data: " + json.dumps({"choices": [{"delta": {"content": "Аль"}}]}),
+        "",
+        "data: " + json.dumps({"choices": [{"delta": {"content": "фа"}}]}),
+        "",
+        "data: [DONE]",
+        "",
+    ]
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, text="\n".join(events), headers={"content-type": "text/event-stream"})
+
+    async def run():
+        llm_client._llm_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return [p async for p in llm_client._stream_deepseek([{"role": "user", "content": "q"}], model="m")]
+        finally:
+            await llm_client.close_llm_client()
+
+    assert asyncio.run(run()) == ["Аль", "фа"]
+    print("✅ SSE-поток разбирается в куски текста")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тесты потоковых ответов")
+    print("=" * 50)
+
+    tests = [
+        ("Тест разбиения сообщений", test_split_message),
+        ("Тест потокового вывода", test_stream_to_message),
+        ("Тест SSE", test_llm_sse_stream),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
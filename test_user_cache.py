@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import asyncio
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeResult:
+    def __init__(self, user):
+        self.user = user
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.user
+
+
+class FakeSession:
+    """Сессия без БД: считает запросы и хранит одного пользователя"""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.queries = 0
+        self.statements = []
+
+    async def connection(self):
+        from types import SimpleNamespace
+        return SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+
+    async def execute(self, statement, params=None, execution_options=None):
+        from sqlalchemy.dialects import postgresql
+        from app.models import User
+
+        self.queries += 1
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append(str(compiled))
+        if statement.is_insert and self.user is None:
+            self.user = User(user_id=42, telegram_id=compiled.params["telegram_id"], name=compiled.params["name"])
+        elif statement.is_update and self.user is not None:
+            self.user.iaf = compiled.params["iaf"]
+        return FakeResult(self.user)
+
+    async def commit(self):
+        pass
+
+
+def test_user_cache():
+    """Тест: повторный get_or_create_user не ходит в БД, update_user_iaf сбрасывает запись"""
+    from app import crud
+
+    crud._user_cache.clear()
+    session = FakeSession()
+
+    async def scenario():
+        first = await crud.get_or_create_user(session, telegram_id=1001, name="Анна")
+        again = await crud.get_or_create_user(session, telegram_id=1001, name="Анна")
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert session.queries == 1, session.queries
+    # один запрос на промах кэша: upsert с RETURNING, без отдельных SELECT и refresh
+    assert "ON CONFLICT (telegram_id) DO UPDATE" in session.statements[0]
+    assert "RETURNING" in session.statements[0]
+    assert (again.user_id, again.name, again.iaf) == (42, "Анна", None)
+
+    asyncio.run(crud.update_user_iaf(session, 1001, 10.5))
+    fresh = asyncio.run(crud.get_or_create_user(session, telegram_id=1001, name="Анна"))
+    assert fresh.iaf == 10.5
+    assert session.queries == 3   # update_user_iaf + повторное чтение после сброса
+    assert session.statements[1].startswith("UPDATE users") and "RETURNING" in session.statements[1]
+
+    try:
+        asyncio.run(crud.update_user_iaf(FakeSession(), 1002, 9.0))
+        assert False, "нет ValueError для неизвестного пользователя"
+    except ValueError:
+        pass
+
+    stats = crud.user_cache_stats()
+    assert stats["hits"] >= 1 and 0 < stats["hit_rate"] < 1
+    crud._user_cache.clear()
+    print(f"✅ Кэш пользователей: попаданий {stats['hit_rate']:.0%}")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Тест кэша пользователей")
+    print("=" * 50)
+
+    tests = [
+        ("Тест кэша пользователей", test_user_cache),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_metrics.csv")
+
+
+def test_parse_sample():
+    """Тест разбора sample_metrics.csv в колоночный формат"""
+    from app.utils import parse_metrics_file, NUMERIC_MAP
+
+    rows, status = parse_metrics_file(SAMPLE)
+    assert status == "success", status
+    assert len(rows) == 4
+
+    cols = rows.columns
+    assert cols.timestamps.dtype.kind == "M"
+    for key, cast in NUMERIC_MAP.items():
+        assert cols.values[key].dtype.kind == ("i" if cast is int else "f"), key
+    print("✅ Колонки и типы соответствуют NUMERIC_MAP")
+
+
+def test_lazy_rows_view():
+    """Тест ленивого представления строк (совместимость со старым list[dict])"""
+    from datetime import datetime
+    from app.utils import parse_metrics_file, build_prompt_for_llm
+
+    rows, _ = parse_metrics_file(SAMPLE)
+    first = rows[0]
+    assert first["timestamp"] == datetime(2025, 1, 1, 9, 0)
+    assert first["focus"] == 60 and isinstance(first["focus"], int)
+    assert first["self_control"] == 70
+    assert rows[-1]["heart_rate"] == 72
+    assert [r["focus"] for r in rows[1:3]] == [90, 85]
+    assert len(list(rows)) == 4
+
+    prompt = build_prompt_for_llm("Test", rows, "instruction")
+    assert "2025-01-01 09:00 | cognitive_score:50" in prompt
+    print("✅ Ленивое представление строк работает")
+
+
+def test_invalid_values():
+    """Тест приведения некорректных значений к None и пропуска строк без времени"""
+    import tempfile
+    from app.utils import parse_metrics_file
+
+    content = (
+        "time,focus,chill,stress,cognitive_score\n"
+        "not a date,1,2,3,4\n"
+        "2025-01-01 10:00,abc,2,3,inf\n"
+        "2025-01-01 11:00,5.7,2,,4\n"
+    )
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+        f.write(content)
+    try:
+        rows, status = parse_metrics_file(f.name)
+    finally:
+        os.unlink(f.name)
+
+    assert status == "success", status
+    assert len(rows) == 2
+    assert rows[0]["focus"] is None and rows[0]["cognitive_score"] is None
+    assert rows[1]["focus"] == 5 and rows[1]["stress"] is None
+    print("✅ Некорректные значения обработаны")
+
+
+def test_unique_timestamps():
+    """Тест удаления повторов временных меток внутри куска"""
+    from datetime import datetime
+    from app.utils import MetricsColumns
+
+    t1, t2 = datetime(2025, 1, 1, 10, 0), datetime(2025, 1, 1, 10, 1)
+    columns = MetricsColumns.from_rows([
+        {"timestamp": t1, "focus": 1},
+        {"timestamp": t2, "focus": 2},
+        {"timestamp": t1, "focus": 3},
+    ])
+    assert columns.unique_timestamps().values["focus"].tolist() == [1, 2]
+    assert columns.unique_timestamps(keep_last=True).values["focus"].tolist() == [2, 3]
+    print("✅ Повторы меток убираются, порядок строк сохраняется")
+
+
+def test_compact_prompt():
+    """Тест компактной кодировки таблицы метрик в промпте"""
+    from datetime import datetime
+    from app.utils import build_prompt_for_llm, encode_metrics_compact, estimate_tokens, parse_metrics_file
+
+    rows = [
+        {"timestamp": datetime(2025, 1, 1, 23, 59), "focus": 60, "relaxation_index": 0.3004, "alpha_gravity": None},
+        {"timestamp": datetime(2025, 1, 2, 0, 1), "focus": None, "relaxation_index": 0.25, "alpha_gravity": None},
+    ]
+    table = encode_metrics_compact(rows)
+    assert table.splitlines() == [
+        "time\tfocus\trelaxation_index",
+        "# 2025-01-01",
+        "23:59\t60\t0.3",
+        "# 2025-01-02",
+        "00:01\t\t0.25",
+    ], table
+
+    sample, _ = parse_metrics_file(SAMPLE)
+    verbose = build_prompt_for_llm("Test", sample, "instruction")
+    compact = build_prompt_for_llm("Test", sample, "instruction", encoding="compact")
+    assert "09:00\t50\t60" in compact
+    assert estimate_tokens(compact) < estimate_tokens(verbose)
+    print(f"✅ Компактная кодировка: ~{estimate_tokens(compact)} токенов вместо ~{estimate_tokens(verbose)}")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Запуск тестов utils...")
+    print("=" * 50)
+
+    tests = [
+        ("Тест разбора файла", test_parse_sample),
+        ("Тест ленивых строк", test_lazy_rows_view),
+        ("Тест некорректных значений", test_invalid_values),
+        ("Тест повторов меток", test_unique_timestamps),
+        ("Тест компактного промпта", test_compact_prompt),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 {test_name}:")
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+
+    print("=" * 50)
+    print(f"📊 Результаты: {passed}/{len(tests)} тестов прошли успешно")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    exit(main())